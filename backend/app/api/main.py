@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from api.routes import users, auth, products, images, jobs
+from api.routes import users, auth, products, images, jobs, metrics
 # routes/
 # ├── __init__.py
 # ├── jobs.py          ← Dedicated jobs routes
@@ -13,3 +13,4 @@ api_router.include_router(users.router)
 api_router.include_router(images.router)
 api_router.include_router(products.router)
 api_router.include_router(jobs.router)
+api_router.include_router(metrics.router)
@@ -4,11 +4,13 @@ from typing import Annotated, List
 from fastapi import APIRouter, HTTPException, Header, Path, Query, status
 import uuid
 
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.orm import selectinload
 from sqlmodel import select
 from api.deps import CurrentUser, SessionDep
 from core.config import settings
 from core import storage
+from core.virtual_crops import VIRTUAL_CROP_FORMAT, render_virtual_crop
 from models.image import ImageFile, BUCKET_NAME_TO_S3
 
 
@@ -52,7 +54,6 @@ async def list_imgs_metadata(
 
 
 # we changed for now we will only stream the img, when we prepare for prod we can utilize a get presigned url,
-# TODO: using boto3 (sync) consider offloading to a threadpool to avoid blocking the event loop.
 @router.get(
     "/{img_id}/download",
     response_class=StreamingResponse,
@@ -66,28 +67,40 @@ async def list_imgs_metadata(
 async def download_img(
     img_id: Annotated[uuid.UUID, Path(description="ID of the image to download")],
     session: SessionDep,
-) -> StreamingResponse:
+) -> Response:
     """
     Stream image bytes from S3/MinIO to client.
-    Note: if using boto3 (sync) consider offloading to a threadpool to avoid blocking the event loop.
+    The storage calls run in the storage threads, the event loop is never blocked by S3.
     """
 
     try:
-        img_metadata = session.get(ImageFile, img_id)
+        # the original of a virtual crop is loaded here, not lazily in the storage thread
+        img_metadata = session.get(ImageFile, img_id, options=[selectinload(ImageFile.original)])
         if not img_metadata:
             raise HTTPException(status_code=404, detail="Img metadata not founded")
 
+        headers = {
+            "Content-Disposition": f"inline; filename={img_metadata.filename}",
+            "Cache-Control": "public, max-age=86400",  # cache for frontend max:1day
+        }
+        if img_metadata.is_virtual_crop:
+            # virtual crops have no object in S3, they are cut from the original (and cached)
+            # already fully in memory, sent as one body
+            return Response(
+                content=await storage.run_in_storage_pool(render_virtual_crop, img_metadata),
+                media_type=f"image/{VIRTUAL_CROP_FORMAT.lower()}",
+                headers=headers,
+                status_code=status.HTTP_200_OK,
+            )
+
         real_bucket = BUCKET_NAME_TO_S3[img_metadata.bucket]
-        s3_client = storage.get_s3_client()
-        img_data = s3_client.get_object(Bucket=real_bucket, Key=img_metadata.filename)
-        content_type = img_data.get("ContentType", "application/octet-stream")
+        content_type, img_chunks = await storage.stream_object_from_s3_async(
+            real_bucket, img_metadata.filename
+        )
         return StreamingResponse(
-            img_data["Body"],
+            img_chunks,
             media_type=content_type,
-            headers={
-                "Content-Disposition": f"inline; filename={img_metadata.filename}",
-                "Cache-Control": "public, max-age=86400",  # cache for frontend max:1day
-            },
+            headers=headers,
             status_code=status.HTTP_200_OK,
         )
 
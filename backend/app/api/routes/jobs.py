@@ -52,7 +52,7 @@ async def procces_image(
 
     img_filename = build_image_filename(img=pil_img, id=new_img_id, prefix=img_type)
     real_bucket = BUCKET_NAME_TO_S3[bucket_name]
-    s3_path = storage.upload_file_to_s3(
+    s3_path = await storage.upload_file_to_s3_async(
         file_obj=img_stream,
         bucket_name=real_bucket,
         object_name=img_filename,
@@ -0,0 +1,12 @@
+from fastapi import APIRouter, Depends
+
+from api.deps import get_current_admin_user
+from utils.metrics import metrics
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+# metrics of this api process, the worker processes log theirs (ML_CLIENT_METRICS_LOG_INTERVAL_S)
+@router.get("", dependencies=[Depends(get_current_admin_user)])
+async def get_metrics() -> dict:
+    return metrics.snapshot()
@@ -132,13 +132,14 @@ async def delete_product(
         imgs = session.exec(
             select(ImageFile).where(col(ImageFile.id).in_(img_ids))
         ).all()
-        imgs_filenames = [img.filename for img in imgs]
+        # virtual crops have no object in S3
+        imgs_filenames = [img.filename for img in imgs if not img.is_virtual_crop]
 
         session.execute(delete(Job).where(col(Job.input_product_id).in_([product_id])))
         session.delete(product)
 
         #clear image in s3
-        storage.delete_files_from_s3_batch(bucket_name=real_bucket, keys=imgs_filenames)
+        await storage.delete_files_from_s3_batch_async(bucket_name=real_bucket, keys=imgs_filenames)
 
         #delete vector in the chromadb
         chroma_client = chroma_client_wrapper.get_client()
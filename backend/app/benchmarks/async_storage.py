@@ -0,0 +1,137 @@
+"""
+Throughput of async endpoints calling the storage inline (blocking boto3) against the storage threads
+of core/storage.py, while every S3 call is artificially slowed down.
+
+Run from backend/app:
+    python -m benchmarks.async_storage [--delay-ms 100] [--requests 200] [--concurrency 50]
+
+The S3 client is replaced by one that sleeps `--delay-ms` per call, the endpoints run in-process on one
+event loop (like one uvicorn worker) through the httpx ASGI transport. For every mode it reports
+requests/second, p50 and p95 latency, and the worst latency of a trivial /ping endpoint polled during
+the load, which is how long the event loop was blocked.
+"""
+
+import argparse
+import asyncio
+import time
+from io import BytesIO
+
+import httpx
+from fastapi import FastAPI, Response
+from fastapi.responses import StreamingResponse
+
+from core import storage
+from core.config import settings
+
+PAYLOAD = b"\x89PNG" + bytes(64 * 1024)
+
+
+class SlowS3Client:
+    def __init__(self, delay_s: float):
+        self.delay_s = delay_s
+
+    def get_object(self, Bucket: str, Key: str) -> dict:
+        time.sleep(self.delay_s)
+        return {"Body": BytesIO(PAYLOAD), "ContentType": "image/png"}
+
+    def upload_fileobj(self, file_obj, bucket_name: str, object_name: str, Config=None) -> None:
+        time.sleep(self.delay_s)
+        file_obj.read()
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/ping")
+    async def ping() -> dict:
+        return {}
+
+    # the previous route code, boto3 called in the event loop
+    @app.get("/blocking/download")
+    async def blocking_download() -> Response:
+        res = storage.get_s3_client().get_object(Bucket="bench", Key="img.png")
+        return Response(res["Body"].read(), media_type=res["ContentType"])
+
+    @app.post("/blocking/upload")
+    async def blocking_upload() -> dict:
+        return {"path": storage.upload_file_to_s3(BytesIO(PAYLOAD), "bench", "img.png")}
+
+    @app.get("/async/download")
+    async def async_download() -> StreamingResponse:
+        content_type, chunks = await storage.stream_object_from_s3_async("bench", "img.png")
+        return StreamingResponse(chunks, media_type=content_type)
+
+    @app.post("/async/upload")
+    async def async_upload() -> dict:
+        return {"path": await storage.upload_file_to_s3_async(BytesIO(PAYLOAD), "bench", "img.png")}
+
+    return app
+
+
+async def run(client: httpx.AsyncClient, method: str, path: str, args: argparse.Namespace) -> None:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+    ping_latencies: list[float] = []
+    done = asyncio.Event()
+
+    async def one() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            res = await client.request(method, path)
+            res.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    async def poll_ping() -> None:
+        while not done.is_set():
+            start = time.perf_counter()
+            await client.get("/ping")
+            ping_latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    poller = asyncio.create_task(poll_ping())
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await poller
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(
+        f"{method + ' ' + path:<24} {args.requests / elapsed:>8.1f} {p50:>9.0f}ms {p95:>9.0f}ms "
+        f"{max(ping_latencies) * 1000:>11.0f}ms"
+    )
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    slow_client = SlowS3Client(args.delay_ms / 1000)
+    storage.get_s3_client = lambda: slow_client  # type: ignore[assignment]
+
+    transport = httpx.ASGITransport(app=build_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        print(
+            f"{args.requests} requests, concurrency {args.concurrency}, S3 delay {args.delay_ms}ms, "
+            f"{settings.S3_ASYNC_MAX_WORKERS} storage threads\n"
+        )
+        print(f"{'endpoint':<24} {'req/s':>8} {'p50':>11} {'p95':>11} {'ping max':>13}")
+        for method, path in (
+            ("GET", "/blocking/download"),
+            ("GET", "/async/download"),
+            ("POST", "/blocking/upload"),
+            ("POST", "/async/upload"),
+        ):
+            await run(client, method, path, args)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--delay-ms", type=float, default=100)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
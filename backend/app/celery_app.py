@@ -1,5 +1,12 @@
+import json
+import logging
+import time
 from celery import Celery
+from celery.signals import task_postrun
 from core.config import settings
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
 
 #celery wil be configured to use redis for both broker and backend
 app = Celery(
@@ -16,4 +23,18 @@ app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
-)
\ No newline at end of file
+)
+
+
+_last_metrics_log = 0.0
+
+
+# the pool processes make the ml_service calls, each logs its metrics (latency and errors per endpoint) now and then
+@task_postrun.connect
+def log_worker_metrics(**kwargs):
+    global _last_metrics_log
+    now = time.monotonic()
+    if now - _last_metrics_log < settings.ML_CLIENT_METRICS_LOG_INTERVAL_S:
+        return
+    _last_metrics_log = now
+    logger.info(f"worker metrics {json.dumps(metrics.snapshot())}")
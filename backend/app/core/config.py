@@ -26,7 +26,28 @@ class Settings(BaseSettings):
     ALGORITHM: str
     ADMIN_USER: str
     ADMIN_PASSWORD: str
+    # one url, or the comma separated urls of the ml_service replicas, balanced by core/ml_client.py
     ML_SERVICE_URL: str
+    # detect and label all the crops of an image in a single ml_service call
+    ML_FUSED_DETECTION: bool = False
+    # ask ml_service only for the boxes and crop the original locally, instead of receiving encoded crops
+    ML_DETECTION_BOXES_ONLY: bool = False
+    # ml_service reads the images from S3 by {bucket, key}, the worker does not proxy the bytes
+    ML_SERVICE_READS_S3: bool = False
+    # label all the crops of an image in one task and one /label_batch call, instead of a chord of label_img_task
+    ML_BATCHED_LABELLING: bool = False
+    ML_LABEL_BATCH_SIZE: int = 64  # crops per /label_batch request, at most the ml_service MAX_LABEL_BATCH_SIZE
+    # ml_service client (core/ml_client.py), pooled per process, retries the idempotent inference calls
+    ML_CLIENT_POOL_SIZE: int = 10  # keep-alive connections per process, >= the threads calling ml_service
+    ML_CLIENT_CONNECT_TIMEOUT_S: float = 3.0
+    ML_CLIENT_MAX_RETRIES: int = 3
+    ML_CLIENT_BACKOFF_BASE_S: float = 0.2
+    ML_CLIENT_BACKOFF_MAX_S: float = 5.0
+    ML_CLIENT_BREAKER_FAILURES: int = 5  # consecutive failures that open the circuit
+    ML_CLIENT_BREAKER_RESET_S: float = 30.0  # an ejected replica is re-probed after this delay
+    ML_CLIENT_BREAKER_MAX_RESET_S: float = 300.0  # the re-probe delay doubles up to this after failed probes
+    ML_CLIENT_PROBE_INTERVAL_S: float = 5.0  # readiness probes of the replicas in rotation
+    ML_CLIENT_METRICS_LOG_INTERVAL_S: float = 60.0  # the worker processes log their metrics at most this often
     CHROMA_PRODUCT_IMAGE_COLLECTION: str
     MODEL_VERSION:str
     # 60 minutes * 24 hours * 8 days = 8 days
@@ -40,7 +61,26 @@ class Settings(BaseSettings):
     S3_PRODUCT_BUCKET_NAME: str
     S3_QUERY_BUCKET_NAME: str
     MAX_IMAGE_SIZE_BYTES: int = 5 * 1024 * 1024 # 5mb
+    # one S3 client per process (core/storage.py), its pool must cover the bulk workers * the transfer threads
+    S3_MAX_POOL_CONNECTIONS: int = 50
+    S3_MULTIPART_THRESHOLD_BYTES: int = 8 * 1024 * 1024
+    S3_MULTIPART_CHUNKSIZE_BYTES: int = 8 * 1024 * 1024
+    S3_TRANSFER_MAX_CONCURRENCY: int = 4  # threads per multipart transfer
+    S3_BULK_MAX_WORKERS: int = 8  # objects transferred in parallel by the bulk upload and download
+    S3_ASYNC_MAX_WORKERS: int = 16  # threads running the storage calls of the async endpoints
+    S3_STREAM_CHUNK_BYTES: int = 64 * 1024
+
+    # store crops as parent + bbox instead of uploading a file per crop
+    VIRTUAL_CROPS: bool = False
+    CROP_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # in memory LRU of rendered crops and their originals
+    CROP_CACHE_DIR: str | None = None  # optional disk tier for hot crops
+    CROP_DISK_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
     
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def ML_SERVICE_URLS(self) -> list[str]:
+        return [url.strip() for url in self.ML_SERVICE_URL.split(",") if url.strip()]
+
     @computed_field  # type: ignore[prop-decorator]
     @property
     def SQLALCHEMY_DATABASE_URI(self) -> MultiHostUrl:
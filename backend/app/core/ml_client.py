@@ -0,0 +1,495 @@
+"""
+HTTP client of the ml_service, `ml_client` for the worker tasks and `async_ml_client` for the API.
+
+ML_SERVICE_URL may list several replicas (comma separated), every call picks one with the power of
+two choices: two random available replicas, the one with the lowest latency EWMA * (in flight + 1)
+wins. No proxy hop in front of the replicas, adding one adds its throughput.
+
+Both clients keep a pool of keep-alive connections per replica, apply a timeout per endpoint, and
+retry the idempotent inference calls on another replica (or with jittered exponential backoff when
+none is left). Each replica has a circuit breaker: after ML_CLIENT_BREAKER_FAILURES consecutive
+failures (connection errors, timeouts, 5xx but 503) it is ejected, and a prober thread re-probes it on
+/health/ready after ML_CLIENT_BREAKER_RESET_S, doubling the delay on every failed probe up to
+ML_CLIENT_BREAKER_MAX_RESET_S. The prober also checks the readiness of the healthy replicas every
+ML_CLIENT_PROBE_INTERVAL_S, a replica still loading its models gets no traffic. When no replica is
+available the calls fail fast with MLServiceUnavailableError.
+
+A 503 is backpressure (inference queue full, models loading), not a failure: the replica stays in
+rotation but is marked busy for its Retry-After, the picks prefer the replicas that are not busy and
+the call is retried on another replica.
+
+Non 5xx responses are returned as they are, a 404 of /crop_clothes ("no clothes found") is a result.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from threading import Lock
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from core.config import settings
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# read timeouts, in seconds, the connect timeout is ML_CLIENT_CONNECT_TIMEOUT_S for all of them
+ENDPOINT_TIMEOUTS_S: dict[str, float] = {
+    "/inference/image/crop_clothes": 30,
+    "/inference/image/label": 15,
+    "/inference/image/label_batch": 60,
+    "/inference/image/detect_and_label": 60,
+    "/inference/text/matching": 10,
+    "/inference/text/matching_batch": 30,
+}
+DEFAULT_TIMEOUT_S = 30
+
+# the inference endpoints are pure functions of their inputs, calling them twice is safe
+IDEMPOTENT_ENDPOINTS = frozenset(ENDPOINT_TIMEOUTS_S)
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+READINESS_ENDPOINT = "/health/ready"
+PROBE_TIMEOUT_S = 2.0
+LATENCY_EWMA_ALPHA = 0.3
+BUSY_STATUS = 503
+DEFAULT_BUSY_S = 1.0  # busy period of a 503 without Retry-After
+
+LATENCY_MS_BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+
+class MLServiceUnavailableError(RuntimeError):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Consecutive failures circuit breaker with an exponential re-probe delay.
+
+    Args:
+        failure_threshold (int): Consecutive failures that open the circuit.
+        reset_timeout_s (float): Seconds the circuit stays open before the first probe.
+        max_reset_timeout_s (float): Cap of the delay, doubled after every failed probe.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout_s: float, max_reset_timeout_s: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.max_reset_timeout_s = max_reset_timeout_s
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._delay_s = reset_timeout_s
+        self._lock = Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    @property
+    def probe_due(self) -> bool:
+        opened_at = self._opened_at
+        return opened_at is not None and time.monotonic() - opened_at >= self._delay_s
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._delay_s = self.reset_timeout_s
+
+    def record_failure(self) -> bool:
+        """Returns True when this failure opened the circuit."""
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is not None:
+                # failed probe (or a late failure of a call started before the ejection), wait longer
+                self._delay_s = min(self._delay_s * 2, self.max_reset_timeout_s)
+                self._opened_at = time.monotonic()
+                return False
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+
+class Replica:
+    """One ml_service replica, its breaker and the load seen by this process."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.breaker = CircuitBreaker(
+            settings.ML_CLIENT_BREAKER_FAILURES,
+            settings.ML_CLIENT_BREAKER_RESET_S,
+            settings.ML_CLIENT_BREAKER_MAX_RESET_S,
+        )
+        self.in_flight = 0
+        self.latency_ms_ewma = 0.0  # 0 until the first answer, new replicas get tried first
+        self.ready = True  # until a readiness probe says otherwise
+        self.busy_until = 0.0  # monotonic time until which the replica answered 503, picked last
+        label = f'{{replica="{self.url}"}}'
+        self.requests = metrics.counter(f"ml_replica_requests_total{label}")
+        self.ejections = metrics.counter(f"ml_replica_ejections_total{label}")
+        self.busy_responses = metrics.counter(f"ml_replica_busy_total{label}")
+        metrics.gauge(f"ml_replica_in_flight{label}", lambda: self.in_flight)
+        metrics.gauge(f"ml_replica_latency_ms_ewma{label}", lambda: self.latency_ms_ewma)
+        metrics.gauge(f"ml_replica_available{label}", lambda: float(self.available))
+
+    @property
+    def available(self) -> bool:
+        return self.ready and not self.breaker.is_open
+
+    @property
+    def busy(self) -> bool:
+        return time.monotonic() < self.busy_until
+
+    @property
+    def cost(self) -> tuple[bool, float]:
+        # a busy replica loses against any replica that is not
+        return self.busy, self.latency_ms_ewma * (self.in_flight + 1)
+
+
+class ReplicaSet:
+    """The replicas of ml_service, shared by the sync and the async client of a process."""
+
+    def __init__(self, urls: list[str]):
+        if not urls:
+            raise ValueError("ML_SERVICE_URL lists no replica")
+        self.replicas = [Replica(url) for url in urls]
+        self._lock = Lock()
+        self._prober_pid: int | None = None
+
+    def acquire(self, exclude: set[str]) -> Replica:
+        """Picks a replica for one attempt, preferring the ones not tried yet by this call."""
+        self._ensure_prober()
+        with self._lock:
+            available = [r for r in self.replicas if r.available]
+            candidates = [r for r in available if r.url not in exclude] or available
+            if not candidates:
+                raise MLServiceUnavailableError(
+                    f"No ml_service replica available out of {len(self.replicas)}, retry later"
+                )
+            if len(candidates) == 1:
+                replica = candidates[0]
+            else:
+                first, second = random.sample(candidates, 2)
+                replica = first if first.cost <= second.cost else second
+            replica.in_flight += 1
+        return replica
+
+    def release(
+        self, replica: Replica, latency_ms: float, status_code: int | None, busy_s: float | None = None
+    ) -> None:
+        """
+        Gives the slot back and records the outcome, `status_code` is None when no response came back.
+        A 503 marks the replica busy for `busy_s` without touching its breaker.
+        """
+        failed = status_code is None or (status_code >= 500 and status_code != BUSY_STATUS)
+        with self._lock:
+            replica.in_flight -= 1
+            if status_code == BUSY_STATUS:
+                replica.busy_until = time.monotonic() + (busy_s or DEFAULT_BUSY_S)
+            elif not failed:
+                if replica.latency_ms_ewma == 0.0:
+                    replica.latency_ms_ewma = latency_ms
+                else:
+                    replica.latency_ms_ewma += LATENCY_EWMA_ALPHA * (latency_ms - replica.latency_ms_ewma)
+        replica.requests.inc()
+        if status_code == BUSY_STATUS:
+            # alive, like a 503 of the readiness probe
+            replica.busy_responses.inc()
+            replica.breaker.record_success()
+        elif not failed:
+            replica.breaker.record_success()
+        elif replica.breaker.record_failure():
+            replica.ejections.inc()
+            logger.warning(f"ml_service replica {replica.url} ejected after {replica.breaker.failure_threshold} failures")
+
+    def has_untried(self, exclude: set[str]) -> bool:
+        return any(r.available and not r.busy and r.url not in exclude for r in self.replicas)
+
+    def _ensure_prober(self) -> None:
+        # one prober thread per process, threads do not survive the celery fork
+        if self._prober_pid == os.getpid():
+            return
+        with self._lock:
+            if self._prober_pid == os.getpid():
+                return
+            self._prober_pid = os.getpid()
+        threading.Thread(target=self._probe_loop, name="ml-replica-prober", daemon=True).start()
+
+    def _probe_loop(self) -> None:
+        last_probe = {replica.url: time.monotonic() for replica in self.replicas}
+        with httpx.Client(timeout=PROBE_TIMEOUT_S) as client:
+            while True:
+                time.sleep(min(1.0, settings.ML_CLIENT_PROBE_INTERVAL_S))
+                now = time.monotonic()
+                for replica in self.replicas:
+                    if replica.breaker.is_open:
+                        if not replica.breaker.probe_due:
+                            continue
+                    elif now - last_probe[replica.url] < settings.ML_CLIENT_PROBE_INTERVAL_S:
+                        continue
+                    last_probe[replica.url] = now
+                    self._probe(client, replica)
+
+    def _probe(self, client: httpx.Client, replica: Replica) -> None:
+        try:
+            status_code = client.get(replica.url + READINESS_ENDPOINT).status_code
+        except httpx.HTTPError:
+            status_code = None
+
+        if status_code == 200:
+            if not replica.available:
+                logger.info(f"ml_service replica {replica.url} is back")
+            replica.ready = True
+            replica.breaker.record_success()
+        elif status_code == 503:
+            # alive but loading its models, no traffic until ready, not a failure
+            replica.ready = False
+            replica.breaker.record_success()
+        elif replica.breaker.record_failure():
+            replica.ejections.inc()
+            logger.warning(f"ml_service replica {replica.url} ejected, readiness probe failed")
+
+
+class _EndpointMetrics:
+    def __init__(self, endpoint: str):
+        label = f'{{endpoint="{endpoint}"}}'
+        self.latency_ms = metrics.histogram(f"ml_client_request_ms{label}", LATENCY_MS_BUCKETS)
+        self.requests = metrics.counter(f"ml_client_requests_total{label}")
+        self.errors = metrics.counter(f"ml_client_errors_total{label}")
+        self.retries = metrics.counter(f"ml_client_retries_total{label}")
+        self.rejections = metrics.counter(f"ml_client_unavailable_total{label}")
+
+
+def _retry_after_s(retry_after: str | None) -> float | None:
+    """Seconds of a Retry-After header, capped to ML_CLIENT_BACKOFF_MAX_S. None when absent or an http date."""
+    if not retry_after:
+        return None
+    try:
+        return min(float(retry_after), settings.ML_CLIENT_BACKOFF_MAX_S)
+    except ValueError:
+        return None
+
+
+def _rewind(files) -> None:
+    # a retried multipart upload must send the files from the start again
+    if not files:
+        return
+    for value in files.values() if isinstance(files, dict) else (value for _, value in files):
+        fileobj = value[1] if isinstance(value, tuple) else value
+        if hasattr(fileobj, "seek"):
+            fileobj.seek(0)
+
+
+class _MLClientBase:
+    def __init__(self, replica_set: ReplicaSet):
+        self.replica_set = replica_set
+        self._endpoint_metrics: dict[str, _EndpointMetrics] = {}
+        self._lock = Lock()
+
+    def _metrics(self, endpoint: str) -> _EndpointMetrics:
+        with self._lock:
+            if endpoint not in self._endpoint_metrics:
+                self._endpoint_metrics[endpoint] = _EndpointMetrics(endpoint)
+            return self._endpoint_metrics[endpoint]
+
+    @staticmethod
+    def _timeout_s(endpoint: str) -> tuple[float, float]:
+        return settings.ML_CLIENT_CONNECT_TIMEOUT_S, ENDPOINT_TIMEOUTS_S.get(endpoint, DEFAULT_TIMEOUT_S)
+
+    @staticmethod
+    def _attempts(endpoint: str) -> int:
+        return 1 + (settings.ML_CLIENT_MAX_RETRIES if endpoint in IDEMPOTENT_ENDPOINTS else 0)
+
+    @staticmethod
+    def _backoff_s(attempt: int, retry_after: str | None) -> float:
+        # full jitter, the retries of the workers do not hit a recovering service in lockstep
+        delay = random.uniform(0, min(settings.ML_CLIENT_BACKOFF_MAX_S, settings.ML_CLIENT_BACKOFF_BASE_S * 2**attempt))
+        return max(delay, _retry_after_s(retry_after) or 0.0)
+
+    def _before_attempt(self, endpoint: str, tried: set[str]) -> Replica:
+        try:
+            replica = self.replica_set.acquire(exclude=tried)
+        except MLServiceUnavailableError:
+            self._metrics(endpoint).rejections.inc()
+            raise
+        tried.add(replica.url)
+        return replica
+
+    def _after_attempt(
+        self, endpoint: str, replica: Replica, start: float, status_code: int | None, retry_after: str | None
+    ) -> None:
+        """Records the attempt and releases the replica, `status_code` is None when no response came back."""
+        latency_ms = (time.perf_counter() - start) * 1000
+        endpoint_metrics = self._metrics(endpoint)
+        endpoint_metrics.requests.inc()
+        endpoint_metrics.latency_ms.observe(latency_ms)
+        if status_code is None or status_code >= 500:
+            endpoint_metrics.errors.inc()
+        self.replica_set.release(replica, latency_ms, status_code, busy_s=_retry_after_s(retry_after))
+
+    def _retry_delay_s(
+        self, endpoint: str, attempt: int, status_code: int | None, retry_after: str | None, tried: set[str]
+    ) -> float | None:
+        """Seconds to wait before the next attempt, None when the call must not be retried."""
+        if attempt + 1 >= self._attempts(endpoint):
+            return None
+        if status_code is not None and status_code not in RETRY_STATUSES:
+            return None
+        self._metrics(endpoint).retries.inc()
+        if self.replica_set.has_untried(tried):
+            return 0.0  # another replica, right away
+        return self._backoff_s(attempt, retry_after)
+
+
+class MLServiceClient(_MLClientBase):
+    """Blocking client, one pooled requests.Session per process (created after the celery fork)."""
+
+    def __init__(self, replica_set: ReplicaSet):
+        super().__init__(replica_set)
+        self._session: requests.Session | None = None
+        self._pid: int | None = None
+
+    def _get_session(self) -> requests.Session:
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    # a pool of ML_CLIENT_POOL_SIZE connections per replica
+                    adapter = HTTPAdapter(
+                        pool_connections=len(self.replica_set.replicas),
+                        pool_maxsize=settings.ML_CLIENT_POOL_SIZE,
+                    )
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session, self._pid = session, os.getpid()
+        return self._session
+
+    def request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        """
+        Args:
+            method (str): HTTP method.
+            endpoint (str): Path of the endpoint, e.g. "/inference/image/label".
+            **kwargs: Passed to requests (files, data, json, params, headers).
+
+        Raises:
+            MLServiceUnavailableError: No replica is available.
+            requests.RequestException: The last attempt failed to connect or timed out.
+        """
+        tried: set[str] = set()
+        attempt = 0
+        while True:
+            replica = self._before_attempt(endpoint, tried)
+            start = time.perf_counter()
+            response: requests.Response | None = None
+            error: requests.RequestException | None = None
+            try:
+                _rewind(kwargs.get("files"))
+                response = self._get_session().request(
+                    method, replica.url + endpoint, timeout=self._timeout_s(endpoint), **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                # always gives the replica slot back, any other exception (broken body, task time limit) is a failure
+                self._after_attempt(
+                    endpoint,
+                    replica,
+                    start,
+                    None if response is None else response.status_code,
+                    None if response is None else response.headers.get("Retry-After"),
+                )
+
+            if response is None:
+                delay = self._retry_delay_s(endpoint, attempt, None, None, tried)
+                if delay is None:
+                    raise error  # type: ignore[misc]
+            elif response.status_code < 500:
+                return response
+            else:
+                delay = self._retry_delay_s(
+                    endpoint, attempt, response.status_code, response.headers.get("Retry-After"), tried
+                )
+                if delay is None:
+                    return response
+            logger.info(f"Retrying {endpoint} in {delay:.2f}s (attempt {attempt + 2})")
+            time.sleep(delay)
+            attempt += 1
+
+    def post(self, endpoint: str, **kwargs) -> requests.Response:
+        return self.request("POST", endpoint, **kwargs)
+
+
+class AsyncMLServiceClient(_MLClientBase):
+    """asyncio client for the FastAPI side, the httpx client is created on first use and closed by the lifespan."""
+
+    def __init__(self, replica_set: ReplicaSet):
+        super().__init__(replica_set)
+        self._client: httpx.AsyncClient | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            pool_size = settings.ML_CLIENT_POOL_SIZE * len(self.replica_set.replicas)
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+            )
+        return self._client
+
+    async def request(self, method: str, endpoint: str, **kwargs) -> httpx.Response:
+        """Same contract as MLServiceClient.request, raising httpx.TransportError on the last failed attempt."""
+        connect_s, read_s = self._timeout_s(endpoint)
+        timeout = httpx.Timeout(read_s, connect=connect_s)
+        tried: set[str] = set()
+        attempt = 0
+        while True:
+            replica = self._before_attempt(endpoint, tried)
+            start = time.perf_counter()
+            response: httpx.Response | None = None
+            error: httpx.TransportError | None = None
+            try:
+                _rewind(kwargs.get("files"))
+                response = await self._get_client().request(method, replica.url + endpoint, timeout=timeout, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            finally:
+                # always gives the replica slot back, any other exception (CancelledError on a disconnect) is a failure
+                self._after_attempt(
+                    endpoint,
+                    replica,
+                    start,
+                    None if response is None else response.status_code,
+                    None if response is None else response.headers.get("Retry-After"),
+                )
+
+            if response is None:
+                delay = self._retry_delay_s(endpoint, attempt, None, None, tried)
+                if delay is None:
+                    raise error  # type: ignore[misc]
+            elif response.status_code < 500:
+                return response
+            else:
+                delay = self._retry_delay_s(
+                    endpoint, attempt, response.status_code, response.headers.get("Retry-After"), tried
+                )
+                if delay is None:
+                    return response
+            logger.info(f"Retrying {endpoint} in {delay:.2f}s (attempt {attempt + 2})")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def post(self, endpoint: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", endpoint, **kwargs)
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+ml_replicas = ReplicaSet(settings.ML_SERVICE_URLS)
+ml_client = MLServiceClient(ml_replicas)
+async_ml_client = AsyncMLServiceClient(ml_replicas)
@@ -1,22 +1,57 @@
+import asyncio
+import functools
+import os
+from collections.abc import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, TypeVar
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
 from botocore.exceptions import BotoCoreError, ClientError
 from core.config import settings
 from io import BytesIO
 
-# TODO: needs to implement async operations to not block the fastapi async endpoints(consider aioboto3)
+# the *_async functions are for the fastapi async endpoints, they run the blocking boto3 calls in a
+# bounded pool of S3_ASYNC_MAX_WORKERS threads, so a slow MinIO never blocks the event loop and never
+# takes all the threads of the default threadpool (the sync dependencies, like the db session, run there)
+
+T = TypeVar("T")
+
+_lock = Lock()
+_s3_client = None
+_s3_client_pid: int | None = None
+_async_executor: ThreadPoolExecutor | None = None
+_async_executor_pid: int | None = None
+
+# multipart above the threshold, the parts of one object are sent by max_concurrency threads
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=settings.S3_MULTIPART_THRESHOLD_BYTES,
+    multipart_chunksize=settings.S3_MULTIPART_CHUNKSIZE_BYTES,
+    max_concurrency=settings.S3_TRANSFER_MAX_CONCURRENCY,
+    use_threads=True,
+)
 
 
 def get_s3_client():
-    return boto3.client(
-        "s3",
-        endpoint_url=settings.S3_ENDPOINT_URL,
-        aws_access_key_id=settings.S3_ACCESS_KEY,
-        aws_secret_access_key=settings.S3_SECRET_KEY,
-        config=Config(signature_version="s3v4"),
-    )
-    # TODO: This function creates a new client every time. For high performance,
-    # you might consider a singleton pattern or dependency injection.
+    # one client per process, boto3 clients are thread safe and keep a pool of connections.
+    # keyed by pid, a client (and its sockets) inherited through the celery fork is never reused
+    global _s3_client, _s3_client_pid
+    if _s3_client is None or _s3_client_pid != os.getpid():
+        with _lock:
+            if _s3_client is None or _s3_client_pid != os.getpid():
+                _s3_client = boto3.client(
+                    "s3",
+                    endpoint_url=settings.S3_ENDPOINT_URL,
+                    aws_access_key_id=settings.S3_ACCESS_KEY,
+                    aws_secret_access_key=settings.S3_SECRET_KEY,
+                    config=Config(
+                        signature_version="s3v4",
+                        max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                    ),
+                )
+                _s3_client_pid = os.getpid()
+    return _s3_client
 
 
 def upload_file_to_s3(file_obj: BytesIO, bucket_name: str, object_name: str):
@@ -24,13 +59,33 @@ def upload_file_to_s3(file_obj: BytesIO, bucket_name: str, object_name: str):
     try:
         s3_client = get_s3_client()
         file_obj.seek(0)  # set pointer at the start
-        s3_client.upload_fileobj(file_obj, bucket_name, object_name)
+        s3_client.upload_fileobj(file_obj, bucket_name, object_name, Config=TRANSFER_CONFIG)
         return f"s3://{bucket_name}/{object_name}"
     except ClientError as e:
         # Needs to logging later
         raise
 
 
+def upload_files_to_s3(files: list[tuple[BytesIO, str, str]]) -> list[str]:
+    """
+    Uploads many file-like objects in parallel, `files` holds (file_obj, bucket_name, object_name).
+
+    Returns:
+        list[str]: The S3 URIs, in the order of `files`.
+
+    Raises:
+        RuntimeError: If an upload fails, the other uploads are finished (not rolled back) first.
+    """
+    if not files:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(files), settings.S3_BULK_MAX_WORKERS)) as pool:
+        futures = [pool.submit(upload_file_to_s3, *file) for file in files]
+    try:
+        return [future.result() for future in futures]
+    except (BotoCoreError, ClientError) as e:
+        raise RuntimeError(f"Failed to upload {len(files)} objects to S3: {e}") from e
+
+
 def download_file_from_s3(bucket_name: str, key: str) -> BytesIO:
     """
     Downloads an object from S3 given its bucket and key, and returns
@@ -45,7 +100,7 @@ def download_file_from_s3(bucket_name: str, key: str) -> BytesIO:
         # positional args: Bucket, Key, Fileobj
         s3_client = get_s3_client()
         file_obj = BytesIO()
-        s3_client.download_fileobj(bucket_name, key, file_obj)
+        s3_client.download_fileobj(bucket_name, key, file_obj, Config=TRANSFER_CONFIG)
     except (BotoCoreError, ClientError) as e:
         raise RuntimeError(f"Failed to download s3://{bucket_name}/{key}: {e}") from e
 
@@ -53,6 +108,22 @@ def download_file_from_s3(bucket_name: str, key: str) -> BytesIO:
     return file_obj
 
 
+def download_files_from_s3(bucket_name: str, keys: list[str]) -> list[BytesIO]:
+    """
+    Downloads many objects of a bucket in parallel.
+
+    Returns:
+        list[BytesIO]: The objects bytes, in the order of `keys`.
+
+    Raises:
+        RuntimeError: If a download fails.
+    """
+    if not keys:
+        return []
+    with ThreadPoolExecutor(max_workers=min(len(keys), settings.S3_BULK_MAX_WORKERS)) as pool:
+        return list(pool.map(lambda key: download_file_from_s3(bucket_name, key), keys))
+
+
 def generate_presigned_url(bucket: str, key: str, expires_in: int = 300) -> str:
     try:
         s3_client = get_s3_client()
@@ -106,3 +177,54 @@ def delete_files_from_s3_batch(bucket_name: str, keys: list[str]) -> None:
 
     except (BotoCoreError, ClientError) as e:
         raise RuntimeError(f"Failed to delete s3://{bucket_name}/{keys}: {e}") from e
+
+
+def _get_async_executor() -> ThreadPoolExecutor:
+    global _async_executor, _async_executor_pid
+    if _async_executor is None or _async_executor_pid != os.getpid():
+        with _lock:
+            if _async_executor is None or _async_executor_pid != os.getpid():
+                _async_executor = ThreadPoolExecutor(
+                    max_workers=settings.S3_ASYNC_MAX_WORKERS, thread_name_prefix="s3-async"
+                )
+                _async_executor_pid = os.getpid()
+    return _async_executor
+
+
+async def run_in_storage_pool(fn: Callable[..., T], *args, **kwargs) -> T:
+    """Runs a blocking storage call in the storage threads and awaits it."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_async_executor(), functools.partial(fn, *args, **kwargs))
+
+
+async def upload_file_to_s3_async(file_obj: BytesIO, bucket_name: str, object_name: str) -> str:
+    return await run_in_storage_pool(upload_file_to_s3, file_obj, bucket_name, object_name)
+
+
+async def download_file_from_s3_async(bucket_name: str, key: str) -> BytesIO:
+    return await run_in_storage_pool(download_file_from_s3, bucket_name, key)
+
+
+async def delete_files_from_s3_batch_async(bucket_name: str, keys: list[str]) -> None:
+    await run_in_storage_pool(delete_files_from_s3_batch, bucket_name, keys)
+
+
+async def stream_object_from_s3_async(bucket_name: str, key: str) -> tuple[str, AsyncIterator[bytes]]:
+    """
+    Opens an object for streaming, every chunk of S3_STREAM_CHUNK_BYTES is read in the storage threads.
+
+    Returns:
+        tuple[str, AsyncIterator[bytes]]: The content type and the chunks of the object.
+    """
+    # the client is resolved in the storage thread too, its first creation is slow
+    res = await run_in_storage_pool(lambda: get_s3_client().get_object(Bucket=bucket_name, Key=key))
+    body = res["Body"]
+
+    async def chunks() -> AsyncIterator[bytes]:
+        try:
+            while chunk := await run_in_storage_pool(body.read, settings.S3_STREAM_CHUNK_BYTES):
+                yield chunk
+        finally:
+            body.close()
+
+    return res.get("ContentType", "application/octet-stream"), chunks()
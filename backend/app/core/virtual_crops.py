@@ -0,0 +1,187 @@
+import logging
+import os
+from io import BytesIO
+from pathlib import Path
+from threading import Lock
+import uuid
+
+from cachetools import LRUCache
+from PIL import Image
+
+from core import storage
+from core.config import settings
+from models.image import BUCKET_NAME_TO_S3, ImageFile
+
+logger = logging.getLogger(__name__)
+
+VIRTUAL_CROP_FORMAT = "PNG"
+
+
+class CropCache:
+    """
+    Two tier cache for the bytes of virtual crops (and of the originals they are cut from).
+    An in memory LRU bounded by bytes, and an optional disk tier bounded by bytes that
+    evicts the least recently used files first.
+
+    The size of the disk tier is counted once at startup and then kept up to date by the puts,
+    the directory is only listed again when a put goes over the limit, to evict down to EVICT_TO
+    of it and to pick up what the other processes sharing the directory wrote meanwhile.
+    """
+
+    EVICT_TO = 0.9
+
+    def __init__(self, max_bytes: int, cache_dir: str | None, disk_max_bytes: int):
+        self._memory: LRUCache = LRUCache(maxsize=max_bytes, getsizeof=len)
+        self._lock = Lock()
+        self._dir = Path(cache_dir) if cache_dir else None
+        self._disk_max_bytes = disk_max_bytes
+        self._disk_lock = Lock()
+        self._disk_bytes = 0
+        if self._dir:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._memory.get(key)
+        if data is not None:
+            return data
+
+        if not self._dir:
+            return None
+        path = self._dir / key
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # mark as recently used for the disk eviction
+        except FileNotFoundError:
+            return None
+        self._put_memory(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self._put_memory(key, data)
+        if self._dir:
+            self._put_disk(key, data)
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self._memory.maxsize:
+            return
+        with self._lock:
+            self._memory[key] = data
+
+    def _put_disk(self, key: str, data: bytes) -> None:
+        assert self._dir is not None
+        path = self._dir / key
+        try:
+            replaced = path.stat().st_size if path.exists() else 0
+            tmp_path = self._dir / f".{key}.{os.getpid()}.tmp"
+            tmp_path.write_bytes(data)
+            tmp_path.replace(path)
+        except OSError as e:
+            logger.warning(f"Could not write crop {key} to the disk cache: {e}")
+            return
+        with self._disk_lock:
+            self._disk_bytes += len(data) - replaced
+            if self._disk_bytes > self._disk_max_bytes:
+                self._evict_disk()
+
+    def _disk_files(self) -> list[tuple[Path, int, float]]:
+        assert self._dir is not None
+        files = []
+        for entry in os.scandir(self._dir):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((Path(entry.path), stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict_disk(self) -> None:
+        files = self._disk_files()
+        total = sum(size for _, size, _ in files)
+        target = self._disk_max_bytes * self.EVICT_TO
+        for path, size, _ in sorted(files, key=lambda f: f[2]):
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_bytes = total
+
+
+crop_cache = CropCache(
+    max_bytes=settings.CROP_CACHE_MAX_BYTES,
+    cache_dir=settings.CROP_CACHE_DIR,
+    disk_max_bytes=settings.CROP_DISK_CACHE_MAX_BYTES,
+)
+
+
+def build_virtual_crop(original: ImageFile, bbox: list[int]) -> ImageFile:
+    """Creates the metadata of a crop stored as a reference to the original plus a box, nothing is uploaded."""
+    x1, y1, x2, y2 = bbox
+    crop_id = uuid.uuid4()
+    return ImageFile(
+        id=crop_id,
+        bucket=original.bucket,
+        filename=f"crop__{crop_id}.{VIRTUAL_CROP_FORMAT.lower()}",
+        path=f"{original.path}#bbox={x1},{y1},{x2},{y2}",
+        width=x2 - x1,
+        height=y2 - y1,
+        format=VIRTUAL_CROP_FORMAT,
+        bbox=[x1, y1, x2, y2],
+        original_id=original.id,
+    )
+
+
+def cache_original(original: ImageFile, data: bytes) -> None:
+    """Seed the cache with an original the caller already downloaded, its crops will be cut from it."""
+    crop_cache.put(f"original__{original.id}", data)
+
+
+def _original_bytes(original: ImageFile) -> bytes:
+    key = f"original__{original.id}"
+    data = crop_cache.get(key)
+    if data is None:
+        real_bucket = BUCKET_NAME_TO_S3[original.bucket]
+        data = storage.download_file_from_s3(real_bucket, original.filename).getvalue()
+        # keeps the original around, the other crops of the same image are usually requested right after
+        crop_cache.put(key, data)
+    return data
+
+
+def prefetch_original(original: ImageFile) -> None:
+    """Downloads an original into the cache, so the crops cut from it next do not each fetch it again."""
+    _original_bytes(original)
+
+
+def render_virtual_crop(crop: ImageFile) -> bytes:
+    """Returns the encoded bytes of a virtual crop, cutting it from its original on a cache miss."""
+    if not crop.is_virtual_crop or crop.original is None:
+        raise ValueError(f"Image {crop.id} is not a virtual crop")
+
+    key = f"crop__{crop.id}"
+    data = crop_cache.get(key)
+    if data is not None:
+        return data
+
+    with Image.open(BytesIO(_original_bytes(crop.original))) as original_img:
+        x1, y1, x2, y2 = crop.bbox  # type: ignore[misc]
+        crop_img = original_img.crop((x1, y1, x2, y2))
+        buf = BytesIO()
+        crop_img.save(buf, format=VIRTUAL_CROP_FORMAT)
+
+    data = buf.getvalue()
+    crop_cache.put(key, data)
+    return data
+
+
+def load_image_bytes(img: ImageFile) -> BytesIO:
+    """Bytes of any image, materialised crops and originals come from S3, virtual crops are rendered."""
+    if img.is_virtual_crop:
+        return BytesIO(render_virtual_crop(img))
+    real_bucket = BUCKET_NAME_TO_S3[img.bucket]
+    return storage.download_file_from_s3(real_bucket, img.filename)
@@ -1,17 +1,26 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.routing import APIRoute
 from api.main import api_router
 from core.config import settings
+from core.ml_client import async_ml_client
 from starlette.middleware.cors import CORSMiddleware
 
 #needs for proper openapi ts generator in the frontend
 def custom_generate_unique_id(route: APIRoute) -> str:
     return f"{route.tags[0]}-{route.name}"
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # closes the pooled keep-alive connections to ml_service
+    await async_ml_client.aclose()
+
 app = FastAPI(
     root_path="/api",              # Requests are prefixed with /api
     title=settings.PROJECT_NAME,
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 app.include_router(api_router)
 app.add_middleware(
@@ -69,6 +69,14 @@ class ImageFile(SQLModel, table=True):
     )
     crops: List["ImageFile"] = Relationship(back_populates="original")
 
+    # virtual crops: only the box [x1, y1, x2, y2] inside the original is stored, no object in S3,
+    # the pixels are cut from the original on demand (see core.virtual_crops)
+    bbox: List[int] | None = Field(default=None, sa_column=Column(JSON))
+
+    @property
+    def is_virtual_crop(self) -> bool:
+        return self.bbox is not None and self.original_id is not None
+
 
 class ImagePublic(SQLModel):
     id: uuid.UUID
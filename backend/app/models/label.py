@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 
 #this structured label we will pass to the vector db as metadata
@@ -11,8 +11,43 @@ class StructuredLabel(BaseModel):
         """Convert structured label to a single descriptive string."""
         parts = [self.color, self.style, self.pattern, self.category]
         return " ".join(filter(None, parts))
+
+
+class LabelScore(BaseModel):
+    label: str
+    # cosine similarity between the image and the label embeddings
+    score: float
+
+
 class LabelingResponse(BaseModel):
     label_data: StructuredLabel
     # The final vector to be stored in ChromaDB.
     # The ml_service is responsible for merging the image and text vectors.
     storage_vector: List[float]
+    # attribute -> top-k labels with their scores, best first, for confidence filtering
+    label_scores: Optional[Dict[str, List[LabelScore]]] = None
+
+
+class DetectedCloth(BaseModel):
+    # base64 encoded PNG of the crop
+    crop: str
+    # [x1, y1, x2, y2] in pixels of the original image
+    box: List[int]
+    label_data: StructuredLabel
+    storage_vector: List[float]
+    # attribute -> top-k labels with their scores, best first
+    label_scores: Optional[Dict[str, List[LabelScore]]] = None
+
+
+class Detection(BaseModel):
+    # [x1, y1, x2, y2] in pixels of the original image
+    box: List[int]
+    class_id: int
+    confidence: float
+
+
+class DetectionsResponse(BaseModel):
+    # size of the image the boxes refer to
+    width: int
+    height: int
+    detections: List[Detection]
@@ -0,0 +1,211 @@
+import os
+
+import pytest
+import requests
+
+from core import ml_client
+from core.config import settings
+from core.ml_client import (
+    CircuitBreaker,
+    MLServiceClient,
+    MLServiceUnavailableError,
+    ReplicaSet,
+    _MLClientBase,
+)
+
+LABEL = "/inference/image/label"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class StubResponse:
+    def __init__(self, status_code: int, headers: dict | None = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class StubSession:
+    """Answers the requests with `outcomes` in order, an exception outcome is raised."""
+
+    def __init__(self, outcomes: list):
+        self.outcomes = list(outcomes)
+        self.urls: list[str] = []
+
+    def request(self, method: str, url: str, **kwargs):
+        self.urls.append(url)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ml_client.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def client_settings(monkeypatch):
+    monkeypatch.setattr(settings, "ML_CLIENT_BREAKER_FAILURES", 2)
+    monkeypatch.setattr(settings, "ML_CLIENT_BREAKER_RESET_S", 10.0)
+    monkeypatch.setattr(settings, "ML_CLIENT_BREAKER_MAX_RESET_S", 30.0)
+    monkeypatch.setattr(settings, "ML_CLIENT_MAX_RETRIES", 2)
+    monkeypatch.setattr(settings, "ML_CLIENT_BACKOFF_BASE_S", 0.5)
+    monkeypatch.setattr(settings, "ML_CLIENT_BACKOFF_MAX_S", 4.0)
+    return settings
+
+
+@pytest.fixture
+def replica_set(monkeypatch, client_settings, clock):
+    # no prober thread in the tests
+    monkeypatch.setattr(ReplicaSet, "_ensure_prober", lambda self: None)
+    return ReplicaSet(["http://ml-a", "http://ml-b"])
+
+
+def stub_client(replica_set: ReplicaSet, session: StubSession) -> MLServiceClient:
+    client = MLServiceClient(replica_set)
+    client._session, client._pid = session, os.getpid()  # type: ignore[assignment]
+    return client
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout_s=10, max_reset_timeout_s=30)
+    assert not breaker.record_failure()
+    breaker.record_success()  # resets the count
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.probe_due
+
+    clock.now += 10
+    assert breaker.probe_due
+
+
+def test_breaker_failed_probes_double_the_delay_up_to_the_cap(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_s=10, max_reset_timeout_s=30)
+    assert breaker.record_failure()
+
+    for expected_delay_s in (20, 30, 30):
+        clock.now += 100
+        assert not breaker.record_failure()  # failed probe, reopens
+        clock.now += expected_delay_s - 1
+        assert not breaker.probe_due
+        clock.now += 1
+        assert breaker.probe_due
+
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.record_failure()
+    clock.now += 10
+    assert breaker.probe_due  # back to the first delay
+
+
+def test_backoff_is_bounded_and_honours_retry_after(monkeypatch, client_settings):
+    monkeypatch.setattr(ml_client.random, "uniform", lambda low, high: high)
+    assert _MLClientBase._backoff_s(0, None) == 0.5
+    assert _MLClientBase._backoff_s(2, None) == 2.0
+    assert _MLClientBase._backoff_s(10, None) == 4.0
+    assert _MLClientBase._backoff_s(0, "3") == 3.0
+    assert _MLClientBase._backoff_s(0, "120") == 4.0  # capped
+    assert _MLClientBase._backoff_s(0, "Wed, 21 Oct 2015 07:28:00 GMT") == 0.5
+
+
+def test_retry_delay(monkeypatch, replica_set):
+    monkeypatch.setattr(ml_client.random, "uniform", lambda low, high: high)
+    client = MLServiceClient(replica_set)
+
+    # another replica to try, right away
+    assert client._retry_delay_s(LABEL, 0, 502, None, {"http://ml-a"}) == 0.0
+    assert client._retry_delay_s(LABEL, 0, None, None, {"http://ml-a"}) == 0.0
+    # all tried, backoff
+    assert client._retry_delay_s(LABEL, 1, 503, "2", {"http://ml-a", "http://ml-b"}) == 2.0
+    # not retried
+    assert client._retry_delay_s(LABEL, 0, 500, None, {"http://ml-a"}) is None
+    assert client._retry_delay_s(LABEL, 2, 502, None, {"http://ml-a"}) is None  # out of attempts
+    assert client._retry_delay_s("/inference/unknown", 0, 502, None, {"http://ml-a"}) is None
+
+
+def test_acquire_prefers_untried_replicas(replica_set):
+    first = replica_set.acquire(exclude=set())
+    second = replica_set.acquire(exclude={first.url})
+    assert second.url != first.url
+    assert first.in_flight == second.in_flight == 1
+
+    replica_set.release(first, 10.0, 200)
+    replica_set.release(second, 10.0, 200)
+    assert first.in_flight == second.in_flight == 0
+
+
+def test_acquire_prefers_the_cheapest_replica(replica_set):
+    fast, slow = replica_set.replicas
+    fast.latency_ms_ewma, slow.latency_ms_ewma = 10.0, 100.0
+    for _ in range(10):
+        replica = replica_set.acquire(exclude=set())
+        assert replica is fast
+        replica_set.release(replica, 10.0, 200)
+
+
+def test_release_ejects_after_consecutive_failures(replica_set):
+    replica_a, replica_b = replica_set.replicas
+    for status_code in (500, None):
+        assert replica_set.acquire(exclude={replica_b.url}) is replica_a
+        replica_set.release(replica_a, 10.0, status_code)
+    assert not replica_a.available
+    assert replica_a.in_flight == 0
+
+    for _ in range(2):
+        assert replica_set.acquire(exclude=set()) is replica_b
+        replica_set.release(replica_b, 10.0, 502)
+    with pytest.raises(MLServiceUnavailableError):
+        replica_set.acquire(exclude=set())
+
+
+def test_release_busy_does_not_feed_the_breaker(replica_set, clock):
+    replica_a, replica_b = replica_set.replicas
+    for _ in range(5):
+        replica_set.acquire(exclude={replica_b.url})
+        replica_set.release(replica_a, 10.0, 503, busy_s=2.0)
+    assert replica_a.available
+    assert replica_a.busy
+    assert not replica_set.has_untried({replica_b.url})
+
+    clock.now += 2
+    assert not replica_a.busy
+
+
+def test_request_retries_on_another_replica(monkeypatch, replica_set):
+    monkeypatch.setattr(ml_client.time, "sleep", lambda s: None)
+    session = StubSession([requests.ConnectionError("refused"), StubResponse(200)])
+    client = stub_client(replica_set, session)
+
+    response = client.post(LABEL)
+    assert response.status_code == 200
+    assert len(set(session.urls)) == 2
+    assert all(r.in_flight == 0 for r in replica_set.replicas)
+
+
+def test_request_releases_the_slot_on_unexpected_errors(replica_set):
+    session = StubSession([ValueError("broken body")])
+    client = stub_client(replica_set, session)
+
+    with pytest.raises(ValueError):
+        client.post(LABEL)
+    assert all(r.in_flight == 0 for r in replica_set.replicas)
+    assert sum(r.breaker._failures for r in replica_set.replicas) == 1
+
+
+def test_request_returns_client_errors_without_retrying(replica_set):
+    session = StubSession([StubResponse(404)])
+    client = stub_client(replica_set, session)
+
+    assert client.post(LABEL).status_code == 404
+    assert len(session.urls) == 1
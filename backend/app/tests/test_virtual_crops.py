@@ -0,0 +1,116 @@
+import os
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from core import virtual_crops
+from core.virtual_crops import CropCache, build_virtual_crop, cache_original, render_virtual_crop
+from models.image import BucketName, ImageFile
+
+
+@pytest.fixture
+def crop_cache(monkeypatch, tmp_path):
+    cache = CropCache(max_bytes=1024 * 1024, cache_dir=str(tmp_path), disk_max_bytes=10 * 1024 * 1024)
+    monkeypatch.setattr(virtual_crops, "crop_cache", cache)
+
+    def no_s3(*args, **kwargs):
+        raise AssertionError("the original must come from the cache")
+
+    monkeypatch.setattr(virtual_crops.storage, "download_file_from_s3", no_s3)
+    return cache
+
+
+def gradient(width: int, height: int) -> Image.Image:
+    # every pixel differs, a shifted box would not compare equal
+    img = Image.new("RGB", (width, height))
+    img.putdata([(x % 256, y % 256, (x * y) % 256) for y in range(height) for x in range(width)])
+    return img
+
+
+def original_file(img: Image.Image) -> ImageFile:
+    return ImageFile(
+        bucket=BucketName.PRODUCT,
+        filename="original.png",
+        path="product/original.png",
+        width=img.width,
+        height=img.height,
+        format="PNG",
+    )
+
+
+def png_bytes(img: Image.Image) -> bytes:
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def test_build_virtual_crop_encodes_the_box():
+    original = original_file(gradient(200, 100))
+    crop = build_virtual_crop(original, [10, 20, 50, 80])
+
+    assert crop.is_virtual_crop
+    assert crop.original_id == original.id
+    assert crop.bucket == original.bucket
+    assert crop.bbox == [10, 20, 50, 80]
+    assert crop.path == "product/original.png#bbox=10,20,50,80"
+    assert (crop.width, crop.height) == (40, 60)
+    assert crop.filename == f"crop__{crop.id}.png"
+    assert not original.is_virtual_crop
+
+
+def test_render_virtual_crop_cuts_the_box_of_the_original(crop_cache):
+    img = gradient(200, 100)
+    original = original_file(img)
+    cache_original(original, png_bytes(img))
+    crop = build_virtual_crop(original, [10, 20, 50, 80])
+    crop.original = original
+
+    data = render_virtual_crop(crop)
+
+    with Image.open(BytesIO(data)) as rendered:
+        assert rendered.format == "PNG"
+        assert rendered.size == (40, 60)
+        assert list(rendered.convert("RGB").getdata()) == list(img.crop((10, 20, 50, 80)).getdata())
+    assert crop_cache.get(f"crop__{crop.id}") == data  # next renders are cache hits
+
+
+def test_render_virtual_crop_rejects_materialised_images(crop_cache):
+    with pytest.raises(ValueError):
+        render_virtual_crop(original_file(gradient(10, 10)))
+
+
+def test_memory_tier_evicts_least_recently_used_by_bytes():
+    cache = CropCache(max_bytes=100, cache_dir=None, disk_max_bytes=0)
+    cache.put("a", b"a" * 60)
+    cache.put("b", b"b" * 30)
+    assert cache.get("a") is not None  # b is now the least recently used
+    cache.put("c", b"c" * 30)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_disk_tier_size_after_overwrite_and_evict(tmp_path):
+    cache = CropCache(max_bytes=1, cache_dir=str(tmp_path), disk_max_bytes=10_000)
+    for i in range(5):
+        cache.put(f"k{i}", bytes(1000))
+    assert cache._disk_bytes == 5000
+
+    cache.put("k0", bytes(200))  # overwrite
+    assert cache._disk_bytes == 4200
+
+    # oldest first: k1..k4 are older than the overwritten k0
+    for i, key in enumerate(["k1", "k2", "k3", "k4", "k0"]):
+        os.utime(tmp_path / key, (i, i))
+    for i in range(5, 11):
+        cache.put(f"k{i}", bytes(1000))  # 10_200, over the limit
+
+    on_disk = {path.name: path.stat().st_size for path in tmp_path.iterdir()}
+    assert cache._disk_bytes == sum(on_disk.values()) <= 9000
+    assert not {"k1", "k2"} & set(on_disk)
+    assert "k10" in on_disk
+
+    # another process starting on the same directory counts what is there
+    assert CropCache(max_bytes=1, cache_dir=str(tmp_path), disk_max_bytes=10_000)._disk_bytes == cache._disk_bytes
@@ -7,6 +7,8 @@ from fastapi import UploadFile
 from pydantic import BaseModel, TypeAdapter, ValidationError
 import requests
 
+from core.ml_client import ml_client
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,12 +31,12 @@ def parse_json_response(response: requests.Response, expected_type: Type[T]) ->
 
 T = TypeVar("T", bound=BaseModel)
 
-def safe_post_and_parse(url: str, payload: dict, model: Type[T], logger:Logger) -> T:
+def safe_post_and_parse(endpoint: str, payload: dict, model: Type[T], logger:Logger) -> T:
     """
-    Send a POST request and parse JSON into a Pydantic model.
+    Send a POST request to an ml_service endpoint and parse JSON into a Pydantic model.
     Always logs structured errors and raises to allow retrying.
     """
-    response = requests.post(url, json=payload)
+    response = ml_client.post(endpoint, json=payload)
     status_code = response.status_code
 
     try:
@@ -44,7 +46,7 @@ def safe_post_and_parse(url: str, payload: dict, model: Type[T], logger:Logger)
         logger.error(
             "Failed to parse JSON from service response",
             extra={
-                "url": url,
+                "endpoint": endpoint,
                 "status_code": status_code,
                 "raw_response": response.text[:500],
                 "exception": str(e),
@@ -60,7 +62,7 @@ def safe_post_and_parse(url: str, payload: dict, model: Type[T], logger:Logger)
         logger.error(
             "Response validation failed against model",
             extra={
-                "url": url,
+                "endpoint": endpoint,
                 "status_code": status_code,
                 "parsed_response": data,
                 "exception": str(e),
@@ -74,48 +76,46 @@ T = TypeVar("T", bound=BaseModel)
 def safe_request_and_parse(
     *,
     method: str = "GET",
-    url: str,
+    endpoint: str,
     payload: dict | None = None,
     headers: dict | None = None,
     params: dict | None = None,
     model: Type[T],
-    timeout: int = 30,
 ) -> T:
     """
-    Send an HTTP request and parse JSON response into a Pydantic model.
+    Send an HTTP request to an ml_service endpoint and parse JSON response into a Pydantic model.
     Logs detailed errors and raises exceptions to allow retry handling.
 
     Args:
         method: HTTP method ("GET", "POST", "PUT", etc.)
-        url: Request URL
+        endpoint: Path of the ml_service endpoint, the timeout and retries come from core.ml_client
         payload: JSON payload for POST/PUT/PATCH requests
         headers: Optional HTTP headers
         params: Optional query parameters for GET requests
         model: Pydantic model class to validate response JSON against
-        timeout: Request timeout in seconds
 
     Returns:
         Instance of `model` validated from JSON response
 
     Raises:
-        requests.HTTPError, requests.RequestException on network issues
+        requests.RequestException on network issues
+        MLServiceUnavailableError while the circuit to ml_service is open
         ValueError on JSON decoding errors
         pydantic.ValidationError on schema validation errors
     """
     try:
-        response = requests.request(
-            method=method,
-            url=url,
+        response = ml_client.request(
+            method,
+            endpoint,
             json=payload,
             headers=headers,
             params=params,
-            timeout=timeout,
         )
     except requests.RequestException as e:
         logger.error(
-            f"Request error during {method} {url}",
+            f"Request error during {method} {endpoint}",
             exc_info=True,
-            extra={"method": method, "url": url},
+            extra={"method": method, "endpoint": endpoint},
         )
         raise
 
@@ -130,7 +130,7 @@ def safe_request_and_parse(
             "Failed to parse JSON from response",
             extra={
                 "method": method,
-                "url": url,
+                "endpoint": endpoint,
                 "status_code": status_code,
                 "raw_response": response.text[:500],
                 "exception": str(e),
@@ -146,7 +146,7 @@ def safe_request_and_parse(
             "Response validation failed",
             extra={
                 "method": method,
-                "url": url,
+                "endpoint": endpoint,
                 "status_code": status_code,
                 "parsed_response": data,
                 "exception": str(e),
@@ -11,6 +11,8 @@ import requests
 from PIL import Image, UnidentifiedImageError
 import logging
 from core import storage
+from core.config import settings
+from core.ml_client import ml_client
 
 
 logger = logging.getLogger(__name__)
@@ -74,16 +76,97 @@ def get_or_generate_filename(pattern: str, job_id: UUID, idx) -> str:
 
 
 def send_s3_img_to_service(
-    img_filename: str, bucket_name: str, service_url: str, timeout: int = 30,
+    img_filename: str, bucket_name: str, endpoint: str, headers: dict | None = None,
 ) -> requests.Response:
-    """Downloads an image from S3 and send its to an service."""
+    """
+    Sends an image stored in S3 to an ml_service endpoint. When the ml_service has storage access (ML_SERVICE_READS_S3)
+    only the {bucket, key} reference is sent and the service reads the object itself,
+    otherwise the image is downloaded here and uploaded as multipart.
+    """
+    if settings.ML_SERVICE_READS_S3:
+        return ml_client.post(
+            endpoint,
+            data={"bucket": bucket_name, "key": img_filename},
+            headers=headers,
+        )
+
     img_file = storage.download_file_from_s3(bucket_name, img_filename)
+    return send_img_bytes_to_service(
+        img_file=img_file,
+        img_filename=img_filename,
+        endpoint=endpoint,
+        headers=headers,
+    )
+
+
+def send_img_bytes_to_service(
+    img_file: BytesIO, img_filename: str, endpoint: str, headers: dict | None = None, params: dict | None = None,
+) -> requests.Response:
+    """Sends image bytes the caller already has to an ml_service endpoint."""
     mime_type, _ = mimetypes.guess_type(img_filename)
     files = {
         "img_file": (img_filename, img_file, mime_type or "application/octet-stream")
     }
-    response = requests.post(url=service_url, files=files, timeout=timeout)
-    return response
+    return ml_client.post(endpoint, files=files, headers=headers, params=params)
+
+
+def send_imgs_bytes_to_service(
+    img_files: list[tuple[str, BytesIO]], endpoint: str, headers: dict | None = None,
+) -> requests.Response:
+    """Sends N images (filename, bytes) in one multipart request, as the repeated "img_files" field."""
+    files = []
+    for img_filename, img_file in img_files:
+        mime_type, _ = mimetypes.guess_type(img_filename)
+        files.append(("img_files", (img_filename, img_file, mime_type or "application/octet-stream")))
+    return ml_client.post(endpoint, files=files, headers=headers)
+
+
+def send_s3_imgs_to_service(
+    img_filenames: list[str], bucket_name: str, endpoint: str, headers: dict | None = None,
+) -> requests.Response:
+    """Sends N {bucket, key} references, the ml_service reads the objects itself (ML_SERVICE_READS_S3)."""
+    return ml_client.post(
+        endpoint,
+        data={"bucket": bucket_name, "keys": img_filenames},
+        headers=headers,
+    )
+
+
+LENGTH_PREFIXED_MEDIA_TYPE = "application/x-length-prefixed"
+
+
+def parse_length_prefixed_images(data: bytes) -> list[bytes]:
+    """
+    Split a length-prefixed body (4 bytes big-endian length + image bytes, repeated) into the images bytes.
+
+    Raises:
+        ValueError: If the body is truncated.
+    """
+    images = []
+    offset = 0
+    while offset < len(data):
+        if offset + 4 > len(data):
+            raise ValueError("Truncated length prefix in crops response")
+        size = int.from_bytes(data[offset : offset + 4], "big")
+        offset += 4
+        if offset + size > len(data):
+            raise ValueError("Truncated image in crops response")
+        images.append(data[offset : offset + size])
+        offset += size
+    return images
+
+
+def parse_crops_response(response: requests.Response) -> list[bytes]:
+    """
+    Parse the crops from /inference/image/crop_clothes, binary length-prefixed or the json list of base64 strings.
+    """
+    response.raise_for_status()
+    content_type = response.headers.get("Content-Type", "")
+    if content_type.startswith(LENGTH_PREFIXED_MEDIA_TYPE):
+        return parse_length_prefixed_images(response.content)
+
+    payload = parse_json(logger, response, expected_type=list)
+    return [base64.b64decode(img_encoded) for img_encoded in payload]
 
 
 def parse_json(logger, response: requests.Response, expected_type=list):
@@ -144,4 +227,18 @@ def build_image_filename(img:Image.Image, id: UUID, idx:int | None = None, prefi
     ext = (img.format or "PNG").lower()
     idx_str = f"__{idx}" if idx else ""
     id_str = f"__{id}"
-    return f"{prefix}{idx_str}{id_str}.{ext}"
\ No newline at end of file
+    return f"{prefix}{idx_str}{id_str}.{ext}"
+
+
+def crop_from_boxes(img: Image.Image, boxes: list[list[int]]) -> list[Image.Image]:
+    """
+    Crop all the boxes ([x1, y1, x2, y2]) from an image in one pass, the original is decoded only once.
+    """
+    img.load()
+    return [img.crop((x1, y1, x2, y2)) for x1, y1, x2, y2 in boxes]
+
+
+def pil_img_to_png_bytes(img: Image.Image) -> bytes:
+    buf = BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
@@ -0,0 +1,110 @@
+import bisect
+from threading import Lock
+from typing import Callable
+
+
+# small in-process metrics, exposed as json by the /metrics endpoint (api) and logged periodically by the celery worker processes.
+# good enough for tuning the service, swap for prometheus_client if we need scraping later
+# same registry as ml_service/app/utils/metrics.py, copied on purpose: the backend and ml_service are built
+# as separate images from their own directory and share no package, keep the two files in sync
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed upper bounds, like a prometheus histogram.
+
+    Args:
+        buckets (list[float]): Sorted upper bounds of the buckets, an implicit +Inf bucket is added.
+    """
+
+    def __init__(self, buckets: list[float]):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = Lock()
+
+    def observe(self, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+
+        cumulative = 0
+        buckets = {}
+        for bound, bucket_count in zip(self.buckets + [float("inf")], counts):
+            cumulative += bucket_count
+            buckets["+Inf" if bound == float("inf") else str(bound)] = cumulative
+
+        return {
+            "count": count,
+            "sum": total,
+            "mean": total / count if count else 0.0,
+            "buckets": buckets,
+        }
+
+
+class Counter:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def snapshot(self) -> float:
+        return self._value
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at snapshot time."""
+
+    def __init__(self, read_value: Callable[[], float]):
+        self._read_value = read_value
+
+    def snapshot(self) -> float:
+        return self._read_value()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Histogram | Counter | Gauge] = {}
+        self._lock = Lock()
+
+    def histogram(self, name: str, buckets: list[float]) -> Histogram:
+        return self._get_or_create(name, lambda: Histogram(buckets))  # type: ignore[return-value]
+
+    def counter(self, name: str) -> Counter:
+        return self._get_or_create(name, Counter)  # type: ignore[return-value]
+
+    def gauge(self, name: str, read_value: Callable[[], float]) -> Gauge:
+        # gauges are re-bound on purpose, the latest owner of the value wins
+        with self._lock:
+            gauge = Gauge(read_value)
+            self._metrics[name] = gauge
+            return gauge
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+    def _get_or_create(self, name: str, factory: Callable[[], Histogram | Counter]):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+
+metrics = MetricsRegistry()
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from typing import List
 from uuid import UUID
@@ -15,15 +16,28 @@ from models.result import (
 )
 from celery_app import app as celery_app
 from core import storage
+from core.virtual_crops import build_virtual_crop, cache_original, load_image_bytes, prefetch_original
 from models.image import BucketName, ImageFile, BUCKET_NAME_TO_S3
-from models.label import LabelingResponse, StructuredLabel
+from models.label import (
+    DetectedCloth,
+    DetectionsResponse,
+    LabelingResponse,
+    StructuredLabel,
+)
 from core.vector_db.chroma_db import chroma_client_wrapper
 from core.db import engine
 from core.config import settings
 from utils.image_helpers import (
+    LENGTH_PREFIXED_MEDIA_TYPE,
     build_image_filename,
     create_and_verify_pil_img,
+    crop_from_boxes,
+    parse_crops_response,
+    pil_img_to_png_bytes,
+    send_img_bytes_to_service,
+    send_imgs_bytes_to_service,
     send_s3_img_to_service,
+    send_s3_imgs_to_service,
 )
 from utils.helpers import parse_json_response, safe_post_and_parse
 import base64
@@ -33,29 +47,61 @@ from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
 logger = logging.getLogger(__name__)
 
 
-def procces_image(
-    img_stream: BytesIO, session: Session, img_type: str, bucket_name: BucketName
-) -> ImageFile:
-
-    pil_img = create_and_verify_pil_img(img_stream)
-    new_img_id = uuid.uuid4()
-    img_filename = build_image_filename(img=pil_img, id=new_img_id, prefix=img_type)
+def procces_images(
+    img_streams: List[BytesIO], img_type: str, bucket_name: BucketName
+) -> List[ImageFile]:
+    """Verifies the images and uploads them in parallel, returns their metadata in the same order."""
+    pil_imgs = [create_and_verify_pil_img(img_stream) for img_stream in img_streams]
+    new_img_ids = [uuid.uuid4() for _ in img_streams]
+    img_filenames = [
+        build_image_filename(img=pil_img, id=new_img_id, prefix=img_type)
+        for pil_img, new_img_id in zip(pil_imgs, new_img_ids)
+    ]
 
     real_bucket = BUCKET_NAME_TO_S3[bucket_name]
-    s3_path = storage.upload_file_to_s3(
-        file_obj=img_stream,
-        bucket_name=real_bucket,
-        object_name=img_filename,
+    s3_paths = storage.upload_files_to_s3(
+        [
+            (img_stream, real_bucket, img_filename)
+            for img_stream, img_filename in zip(img_streams, img_filenames)
+        ]
     )
-    return ImageFile(
-        id=new_img_id,
-        bucket=bucket_name,
-        filename=img_filename,
-        width=pil_img.width,
-        height=pil_img.height,
-        format=pil_img.format,
-        path=s3_path,
+    return [
+        ImageFile(
+            id=new_img_id,
+            bucket=bucket_name,
+            filename=img_filename,
+            width=pil_img.width,
+            height=pil_img.height,
+            format=pil_img.format,
+            path=s3_path,
+        )
+        for new_img_id, img_filename, pil_img, s3_path in zip(
+            new_img_ids, img_filenames, pil_imgs, s3_paths
+        )
+    ]
+
+
+def detect_cloth_boxes(img_file: BytesIO, img_filename: str) -> DetectionsResponse:
+    """Boxes-only detection, ml_service returns only the boxes of the clothes in the image."""
+    ml_service_res = send_img_bytes_to_service(
+        img_file=img_file,
+        img_filename=img_filename,
+        endpoint="/inference/image/crop_clothes",
+        params={"response_mode": "boxes"},
     )
+    return parse_json_response(response=ml_service_res, expected_type=DetectionsResponse)
+
+
+def detect_and_crop_locally(img_filename: str, bucket_name: str) -> List[bytes]:
+    """
+    Boxes-only detection: ml_service returns only the boxes and the crops are cut here
+    from the original we already downloaded, so no encoded crop travels over the network.
+    """
+    img_file = storage.download_file_from_s3(bucket_name, img_filename)
+    detections = detect_cloth_boxes(img_file, img_filename)
+    original = create_and_verify_pil_img(img_file)
+    crops = crop_from_boxes(original, [d.box for d in detections.detections])
+    return [pil_img_to_png_bytes(crop) for crop in crops]
 
 
 # celery tasks
@@ -88,35 +134,55 @@ def cloth_detection_task(self, img_id: UUID, bucket_name: str) -> list[UUID]:
 
                 logger.info("Calling ML service for cloth detection")
                 real_bucket = BUCKET_NAME_TO_S3[bucket]
-                ml_service_res = send_s3_img_to_service(
-                    img_filename=img_metadata.filename,
-                    bucket_name=real_bucket,
-                    service_url=f"{settings.ML_SERVICE_URL}/inference/image/crop_clothes",
-                )
-                cloth_imgs_encoded: List[str] = parse_json_response(
-                    response=ml_service_res, expected_type=List[str]
-                )
-                if not cloth_imgs_encoded:
+
+                if settings.VIRTUAL_CROPS:
+                    # only the boxes are stored, nothing is uploaded for the crops
+                    img_file = storage.download_file_from_s3(real_bucket, img_metadata.filename)
+                    detections = detect_cloth_boxes(img_file, img_metadata.filename)
+                    cache_original(img_metadata, img_file.getvalue())
+                    for detection in detections.detections:
+                        img_metadata.crops.append(
+                            build_virtual_crop(img_metadata, detection.box)
+                        )
+                    session.add(img_metadata)
+                    logger.info(
+                        f"Successfully added {len(detections.detections)} virtual crops for image {img_id}"
+                    )
+                    return [crop.id for crop in img_metadata.crops]
+
+                cloth_imgs: List[bytes]
+                if settings.ML_DETECTION_BOXES_ONLY:
+                    cloth_imgs = detect_and_crop_locally(
+                        img_filename=img_metadata.filename, bucket_name=real_bucket
+                    )
+                else:
+                    # binary crops, avoids the base64 overhead of the json response
+                    ml_service_res = send_s3_img_to_service(
+                        img_filename=img_metadata.filename,
+                        bucket_name=real_bucket,
+                        endpoint="/inference/image/crop_clothes",
+                        headers={"Accept": LENGTH_PREFIXED_MEDIA_TYPE},
+                    )
+                    cloth_imgs = parse_crops_response(ml_service_res)
+                if not cloth_imgs:
                     raise ValueError("No cloths found")
 
                 logger.info(
-                    f"Processing {len(cloth_imgs_encoded)} detected cloth crops"
+                    f"Processing {len(cloth_imgs)} detected cloth crops"
                 )
-                for idx, img_encoded in enumerate(cloth_imgs_encoded):
-                    cloth_img_file = BytesIO(base64.b64decode(img_encoded))
-                    cloth_crop_metadata = procces_image(
-                        img_stream=cloth_img_file,
-                        session=session,
-                        img_type="png",
-                        bucket_name=bucket,
-                    )
-                    # Append to parent image's crops relationship
-                    # this is not idepotent, as another run for the same image id will append the new crops with the old crops
-                    img_metadata.crops.append(cloth_crop_metadata)
+                # all the crops are uploaded at once
+                cloth_crops_metadata = procces_images(
+                    img_streams=[BytesIO(img_bytes) for img_bytes in cloth_imgs],
+                    img_type="png",
+                    bucket_name=bucket,
+                )
+                # Append to parent image's crops relationship
+                # this is not idepotent, as another run for the same image id will append the new crops with the old crops
+                img_metadata.crops.extend(cloth_crops_metadata)
 
                 session.add(img_metadata)
                 logger.info(
-                    f"Successfully added {len(cloth_imgs_encoded)} crops for image {img_id}"
+                    f"Successfully added {len(cloth_imgs)} crops for image {img_id}"
                 )
                 return [crop.id for crop in img_metadata.crops]
 
@@ -170,12 +236,20 @@ def label_img_task(self, img_id: UUID, bucket_name: str) -> dict:
                     raise ValueError(f"No image metadata found for id={img_id}")
 
                 logger.info("Calling ML service for image labeling")
-                real_bucket = BUCKET_NAME_TO_S3[bucket]
-                res = send_s3_img_to_service(
-                    img_filename=img_metadata.filename,
-                    bucket_name=real_bucket,
-                    service_url=f"{settings.ML_SERVICE_URL}/inference/image/label",
-                )
+                endpoint = "/inference/image/label"
+                if img_metadata.is_virtual_crop:
+                    # virtual crops have no object in S3, they are cut from their original here
+                    res = send_img_bytes_to_service(
+                        img_file=load_image_bytes(img_metadata),
+                        img_filename=img_metadata.filename,
+                        endpoint=endpoint,
+                    )
+                else:
+                    res = send_s3_img_to_service(
+                        img_filename=img_metadata.filename,
+                        bucket_name=BUCKET_NAME_TO_S3[bucket],
+                        endpoint=endpoint,
+                    )
 
                 labelling_res = LabelingResponse.model_validate(res.json())
 
@@ -200,6 +274,170 @@ def label_img_task(self, img_id: UUID, bucket_name: str) -> dict:
             raise
 
 
+def fetch_crops_bytes(crops: List[ImageFile]) -> List[BytesIO]:
+    """Bytes of the crops, fetched in parallel. The originals of virtual crops are downloaded once."""
+    # relationships are loaded here, the session is never used from the fetch threads
+    originals = {crop.original.id: crop.original for crop in crops if crop.is_virtual_crop and crop.original}
+    with ThreadPoolExecutor(max_workers=min(len(crops), settings.S3_BULK_MAX_WORKERS)) as pool:
+        list(pool.map(prefetch_original, originals.values()))
+        return list(pool.map(load_image_bytes, crops))
+
+
+def label_crops_with_service(crops: List[ImageFile], bucket: BucketName) -> List[LabelingResponse]:
+    """Labels the crops with /inference/image/label_batch, one request per ML_LABEL_BATCH_SIZE crops."""
+    endpoint = "/inference/image/label_batch"
+    responses: List[LabelingResponse] = []
+    for start in range(0, len(crops), settings.ML_LABEL_BATCH_SIZE):
+        batch = crops[start : start + settings.ML_LABEL_BATCH_SIZE]
+        if settings.ML_SERVICE_READS_S3 and not any(crop.is_virtual_crop for crop in batch):
+            res = send_s3_imgs_to_service(
+                img_filenames=[crop.filename for crop in batch],
+                bucket_name=BUCKET_NAME_TO_S3[bucket],
+                endpoint=endpoint,
+            )
+        else:
+            imgs_bytes = fetch_crops_bytes(batch)
+            res = send_imgs_bytes_to_service(
+                img_files=[(crop.filename, img_bytes) for crop, img_bytes in zip(batch, imgs_bytes)],
+                endpoint=endpoint,
+            )
+        res.raise_for_status()
+        labelled = parse_json_response(response=res, expected_type=List[LabelingResponse])
+        if len(labelled) != len(batch):
+            raise ValueError(f"Sent {len(batch)} crops to label but got {len(labelled)} labels back")
+        responses.extend(labelled)
+    return responses
+
+
+# batched stage, used instead of the label_img_task chord when settings.ML_BATCHED_LABELLING is on
+@celery_app.task(name="task.label_crops_task", bind=True)
+def label_crops_task(self, crop_ids: List[UUID], bucket_name: str) -> List[dict]:
+    logger.info(f"Starting batched labeling task for {len(crop_ids)} crops")
+    try:
+        bucket = BucketName(bucket_name)  # matches by enum value
+    except ValueError as e:
+        raise ValueError(f"invalid bucket {bucket_name}") from e
+
+    crop_ids = [UUID(str(crop_id)) for crop_id in crop_ids]
+    with Session(engine) as session:
+        try:
+            with session.begin():
+                crops_by_id = {
+                    crop.id: crop
+                    for crop in session.exec(select(ImageFile).where(ImageFile.id.in_(crop_ids))).all()  # type: ignore[attr-defined]
+                }
+                missing = [str(crop_id) for crop_id in crop_ids if crop_id not in crops_by_id]
+                if missing:
+                    raise ValueError(f"No image metadata found for ids={missing}")
+                crops = [crops_by_id[crop_id] for crop_id in crop_ids]
+
+                logger.info("Calling ML service for batched image labeling")
+                labelling_responses = label_crops_with_service(crops, bucket)
+
+                results = []
+                for crop, labelling_res in zip(crops, labelling_responses):
+                    crop.label = labelling_res.label_data.model_dump()
+                    session.add(crop)
+                    results.append(
+                        LabelImgResult(
+                            img_id=crop.id,
+                            label=labelling_res.label_data.model_dump(),
+                            img_vector=labelling_res.storage_vector,
+                        ).model_dump()
+                    )
+
+                logger.info(f"Successfully labeled {len(results)} crops")
+                return results
+        except IntegrityError as e:
+            logger.error(f"IntegrityError in label_crops_task: {e}", exc_info=True)
+            raise
+        except ValidationError as e:
+            logger.error(f"ValidationError in label_crops_task: {e}", exc_info=True)
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error in label_crops_task: {e}", exc_info=True)
+            raise
+
+
+# fused stage, used instead of cloth_detection_task + label_img_task when settings.ML_FUSED_DETECTION is on
+@celery_app.task(name="task.detect_and_label_task", bind=True)
+def detect_and_label_task(self, img_id: UUID, bucket_name: str) -> List[dict]:
+    logger.info(f"Starting fused detect and label task for img_id={img_id}")
+    try:
+        bucket = BucketName(bucket_name)  # matches by enum value
+    except ValueError as e:
+        raise ValueError(f"invalid bucket {bucket_name}") from e
+
+    with Session(engine) as session:
+        try:
+            with session.begin():
+                img_metadata = session.get(ImageFile, img_id)
+                if not img_metadata:
+                    raise ValueError(f"No image metadata found for id={img_id}")
+
+                logger.info("Calling ML service for fused cloth detection and labeling")
+                real_bucket = BUCKET_NAME_TO_S3[bucket]
+                ml_service_res = send_s3_img_to_service(
+                    img_filename=img_metadata.filename,
+                    bucket_name=real_bucket,
+                    endpoint="/inference/image/detect_and_label",
+                )
+                detected_cloths: List[DetectedCloth] = parse_json_response(
+                    response=ml_service_res, expected_type=List[DetectedCloth]
+                )
+                if not detected_cloths:
+                    raise ValueError("No cloths found")
+
+                # Idempotency guard: a retry reuses the crops of the previous run instead of uploading them again,
+                # the detection is deterministic so the crops come in the same order
+                existing_crops = sorted(img_metadata.crops, key=lambda crop: crop.created_at)
+                if existing_crops and len(existing_crops) != len(detected_cloths):
+                    raise ValueError(
+                        f"img_id={img_id} already has {len(existing_crops)} crops but {len(detected_cloths)} were detected"
+                    )
+
+                if existing_crops:
+                    crops_metadata = existing_crops
+                elif settings.VIRTUAL_CROPS:
+                    crops_metadata = [build_virtual_crop(img_metadata, cloth.box) for cloth in detected_cloths]
+                else:
+                    # all the crops are uploaded at once
+                    crops_metadata = procces_images(
+                        img_streams=[BytesIO(base64.b64decode(cloth.crop)) for cloth in detected_cloths],
+                        img_type="png",
+                        bucket_name=bucket,
+                    )
+                if not existing_crops:
+                    img_metadata.crops.extend(crops_metadata)
+
+                results = []
+                for cloth, cloth_crop_metadata in zip(detected_cloths, crops_metadata):
+                    cloth_crop_metadata.label = cloth.label_data.model_dump()
+                    results.append(
+                        LabelImgResult(
+                            img_id=cloth_crop_metadata.id,
+                            label=cloth.label_data.model_dump(),
+                            img_vector=cloth.storage_vector,
+                        ).model_dump()
+                    )
+
+                session.add(img_metadata)
+                logger.info(
+                    f"Successfully detected and labeled {len(results)} crops for image {img_id}"
+                )
+                return results
+
+        except IntegrityError as e:
+            logger.error(f"IntegrityError in detect_and_label_task: {e}", exc_info=True)
+            raise
+        except ValidationError as e:
+            logger.error(f"ValidationError in detect_and_label_task: {e}", exc_info=True)
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error in detect_and_label_task: {e}", exc_info=True)
+            raise
+
+
 class BestMatchingRequest(BaseModel):
     candidates: List[str]
     target: str
@@ -236,10 +474,8 @@ def select_img_for_product_task(
                 payload = BestMatchingRequest(
                     candidates=labels, target=product.name
                 ).model_dump()
-                endpoint = f"{settings.ML_SERVICE_URL}/inference/text/matching"
-
                 best_match_res = safe_post_and_parse(
-                    url=endpoint,
+                    endpoint="/inference/text/matching",
                     payload=payload,
                     model=BestMatchingResponse,
                     logger=logger,
@@ -389,6 +625,52 @@ def query_image_in_vector_db_task(
             raise
 
 
+# all the crops of a query image in one vector db query and one session, instead of a chord of query_image_in_vector_db_task
+@celery_app.task(name="task.query_crops_in_vector_db_task", bind=True)
+def query_crops_in_vector_db_task(
+    self, labelled_crops: List[dict], query_result_id: UUID, collection_name: str
+) -> List[UUID]:
+    logger.info(f"querying {len(labelled_crops)} cloth items...")
+    label_img_results = [LabelImgResult.model_validate(c) for c in labelled_crops]
+    if not label_img_results:
+        return []
+
+    chroma_client = chroma_client_wrapper.get_client()
+    img_collection = chroma_client.get_or_create_collection(collection_name)
+
+    with Session(engine) as session:
+        with session.begin():
+            result = img_collection.query(
+                query_embeddings=[r.img_vector for r in label_img_results], n_results=3
+            )
+            if not result["distances"]:
+                raise ValueError(
+                    "No distances founded in the query result for similar images"
+                )
+
+            cloth_ids = []
+            for label_img_result, ids, distances in zip(
+                label_img_results, result["ids"], result["distances"]
+            ):
+                cloth = QueryResultCloth(
+                    query_result_id=query_result_id, crop_img_id=label_img_result.img_id
+                )
+                session.add(cloth)
+
+                for idx, id_str in enumerate(ids):
+                    session.add(
+                        QueryResultProductImage(
+                            cloth_id=cloth.id,
+                            matched_image_id=UUID(id_str),
+                            score=1 - distances[idx],
+                            rank=idx + 1,
+                        )
+                    )
+                cloth_ids.append(cloth.id)
+
+            return cloth_ids
+
+
 @celery_app.task(name="task.finalize_orchestrator_task", bind=True)
 def finalize_indexing_task(
     self,
@@ -435,17 +717,9 @@ def update_job_status_task(
         session.commit()
 
 
-@celery_app.task(name="task.start_indexing_chord", bind=True)
-def start_indexing_chord(self, crop_ids: List[UUID], product_id: UUID, job_id: UUID):
-    header = [
-        label_img_task.s(c, BucketName.PRODUCT).set(
-            link_error=update_job_status_task.si(
-                job_id, JobStatus.FAILED, "Job Failed in indexing Product Image"
-            )
-        )
-        for c in crop_ids
-    ]
-    body = chain(
+def build_indexing_finisher(crop_ids: List[UUID], product_id: UUID, job_id: UUID):
+    """Chain that consumes the labelled crops: selects the primary crop, indexes it and finalizes the job."""
+    return chain(
         select_img_for_product_task.s(product_id),
         save_image_in_vector_db_task.s(settings.CHROMA_PRODUCT_IMAGE_COLLECTION),
         finalize_indexing_task.s(
@@ -461,9 +735,32 @@ def start_indexing_chord(self, crop_ids: List[UUID], product_id: UUID, job_id: U
             )
         ),
     )
+
+
+@celery_app.task(name="task.start_indexing_chord", bind=True)
+def start_indexing_chord(self, crop_ids: List[UUID], product_id: UUID, job_id: UUID):
+    header = [
+        label_img_task.s(c, BucketName.PRODUCT).set(
+            link_error=update_job_status_task.si(
+                job_id, JobStatus.FAILED, "Job Failed in indexing Product Image"
+            )
+        )
+        for c in crop_ids
+    ]
+    body = build_indexing_finisher(crop_ids, product_id, job_id)
     return chord(header)(body)
 
 
+@celery_app.task(name="task.start_fused_indexing_task", bind=True)
+def start_fused_indexing_task(
+    self, labelled_crops: List[dict], product_id: UUID, job_id: UUID
+):
+    # crops are already labelled by detect_and_label_task or label_crops_task, no chord needed
+    crop_ids = [LabelImgResult.model_validate(c).img_id for c in labelled_crops]
+    body = build_indexing_finisher(crop_ids, product_id, job_id)
+    return body.apply_async(args=(labelled_crops,))
+
+
 # for now only set the state of the job from started completed and failed, later we will wrap aroud the steps of the worker
 @celery_app.task(name="task.indexing_orchestratro_task", bind=True)
 def indexing_orchestrator_task(self, job_id: UUID) -> UUID:
@@ -490,10 +787,22 @@ def indexing_orchestrator_task(self, job_id: UUID) -> UUID:
                     job_id, JobStatus.STARTED, "Job is indexing Product Image"
                 )
 
-                workflow = chain(
-                    cloth_detection_task.s(img_id, BucketName.PRODUCT),
-                    start_indexing_chord.s(product_id, job_id),
-                )
+                if settings.ML_FUSED_DETECTION:
+                    workflow = chain(
+                        detect_and_label_task.s(img_id, BucketName.PRODUCT),
+                        start_fused_indexing_task.s(product_id, job_id),
+                    )
+                elif settings.ML_BATCHED_LABELLING:
+                    workflow = chain(
+                        cloth_detection_task.s(img_id, BucketName.PRODUCT),
+                        label_crops_task.s(BucketName.PRODUCT),
+                        start_fused_indexing_task.s(product_id, job_id),
+                    )
+                else:
+                    workflow = chain(
+                        cloth_detection_task.s(img_id, BucketName.PRODUCT),
+                        start_indexing_chord.s(product_id, job_id),
+                    )
                 workflow.apply_async(
                     link_error=update_job_status_task.si(
                         job_id, JobStatus.FAILED, "Job Failed in indexing Product Image"
@@ -555,14 +864,34 @@ def querying_orchestrator_task(self, job_id: UUID) -> UUID:
                     message="Starting to query...",
                 )
 
-                workflow = chain(
-                    cloth_detection_task.s(img_id, BucketName.QUERY),
-                    start_querying_pipeline_task.s(
-                        job_id=job_id,
-                        query_result_id=new_query.id,
-                        collection_name=settings.CHROMA_PRODUCT_IMAGE_COLLECTION,
-                    ),
-                )
+                if settings.ML_FUSED_DETECTION:
+                    workflow = chain(
+                        detect_and_label_task.s(img_id, BucketName.QUERY),
+                        query_crops_in_vector_db_task.s(
+                            query_result_id=new_query.id,
+                            collection_name=settings.CHROMA_PRODUCT_IMAGE_COLLECTION,
+                        ),
+                        update_job_status_task.si(job_id, JobStatus.COMPLETED, "Query Completed"),
+                    )
+                elif settings.ML_BATCHED_LABELLING:
+                    workflow = chain(
+                        cloth_detection_task.s(img_id, BucketName.QUERY),
+                        label_crops_task.s(BucketName.QUERY),
+                        query_crops_in_vector_db_task.s(
+                            query_result_id=new_query.id,
+                            collection_name=settings.CHROMA_PRODUCT_IMAGE_COLLECTION,
+                        ),
+                        update_job_status_task.si(job_id, JobStatus.COMPLETED, "Query Completed"),
+                    )
+                else:
+                    workflow = chain(
+                        cloth_detection_task.s(img_id, BucketName.QUERY),
+                        start_querying_pipeline_task.s(
+                            job_id=job_id,
+                            query_result_id=new_query.id,
+                            collection_name=settings.CHROMA_PRODUCT_IMAGE_COLLECTION,
+                        ),
+                    )
                 workflow.apply_async(
                     link_error=update_job_status_task.si(  # fix: changed for si, to not blow up when a error happens
                         job_id, JobStatus.FAILED, "Job Failed in indexing Product Image"
@@ -0,0 +1,119 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Generator
+from threading import Lock
+from typing import Annotated, List
+import anyio
+import anyio.to_thread
+from fastapi import Depends, File, Form, HTTPException, UploadFile
+from core import storage
+from core.config import settings
+from core.embedding.img_batcher import ImageEmbeddingBatcher
+from core.inference_executor import InferenceExecutor
+from core.transformer_models import ml_models
+
+_lock = Lock()
+_image_batcher: ImageEmbeddingBatcher | None = None
+_inference_executor: InferenceExecutor | None = None
+_s3_limiter: anyio.CapacityLimiter | None = None
+
+
+def get_image_batcher() -> ImageEmbeddingBatcher:
+    # lazy init, so the batcher thread is started in the process that serves the requests
+    global _image_batcher
+    if _image_batcher is None:
+        with _lock:
+            if _image_batcher is None:
+                _image_batcher = ImageEmbeddingBatcher(
+                    model=ml_models.clip_model,
+                    max_batch_size=settings.CLIP_MAX_BATCH_SIZE,
+                    max_wait_ms=settings.CLIP_MAX_BATCH_WAIT_MS,
+                )
+    return _image_batcher
+ImageBatcherDep = Annotated[ImageEmbeddingBatcher, Depends(get_image_batcher)]
+
+
+def get_inference_executor() -> InferenceExecutor:
+    global _inference_executor
+    if _inference_executor is None:
+        with _lock:
+            if _inference_executor is None:
+                _inference_executor = InferenceExecutor(
+                    max_workers=settings.INFERENCE_WORKERS,
+                    max_queue=settings.INFERENCE_MAX_QUEUE,
+                    retry_after_s=settings.INFERENCE_RETRY_AFTER_S,
+                )
+    return _inference_executor
+
+
+# admits the request for its whole duration, raises InferenceQueueFullError (503) when the service is full
+def inference_slot() -> Generator[InferenceExecutor, None, None]:
+    if not ml_models.ready:
+        raise HTTPException(
+            status_code=503,
+            detail="Models are loading, retry later.",
+            headers={"Retry-After": str(settings.INFERENCE_RETRY_AFTER_S)},
+        )
+    with get_inference_executor().admit() as executor:
+        yield executor
+InferenceSlotDep = Annotated[InferenceExecutor, Depends(inference_slot)]
+
+
+def get_s3_limiter() -> anyio.CapacityLimiter:
+    # the S3 reads get their own threads, as many as the pooled client has connections, so a batch
+    # of keys can't take every thread of the default pool nor queue for a connection in a thread
+    global _s3_limiter
+    if _s3_limiter is None:
+        _s3_limiter = anyio.CapacityLimiter(settings.S3_MAX_POOL_CONNECTIONS)
+    return _s3_limiter
+
+
+async def fetch_s3_object(bucket: str, key: str) -> bytes:
+    try:
+        return await anyio.to_thread.run_sync(storage.read_object, bucket, key, limiter=get_s3_limiter())
+    except storage.StorageNotConfiguredError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except storage.ObjectNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+
+# images can be uploaded as multipart or referenced by {bucket, key}, then the ml_service reads S3 itself
+async def read_image_data(
+    img_file: Annotated[UploadFile | None, File()] = None,
+    bucket: Annotated[str | None, Form()] = None,
+    key: Annotated[str | None, Form()] = None,
+) -> bytes:
+    if img_file is not None:
+        return await img_file.read()
+    if bucket and key:
+        return await fetch_s3_object(bucket, key)
+    raise HTTPException(status_code=400, detail="Send an img_file or a bucket and key.")
+ImageDataDep = Annotated[bytes, Depends(read_image_data)]
+
+
+def images_data_reader(max_batch_size: int) -> Callable[..., Awaitable[List[bytes]]]:
+    """
+    Dependency reading the images of a batch request, rejects batches over max_batch_size before
+    anything is read or fetched. Declare it before InferenceSlotDep so the images are read before
+    the request takes an inference slot.
+    """
+    async def read_images_data(
+        img_files: Annotated[List[UploadFile] | None, File()] = None,
+        bucket: Annotated[str | None, Form()] = None,
+        keys: Annotated[List[str] | None, Form()] = None,
+    ) -> List[bytes]:
+        if len(img_files or keys or []) > max_batch_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Too many images, the maximum batch size is {max_batch_size}.",
+            )
+        if img_files:
+            return [await img_file.read() for img_file in img_files]
+        if bucket and keys:
+            # fetched in parallel, bounded by the S3 limiter
+            return list(await asyncio.gather(*(fetch_s3_object(bucket, key) for key in keys)))
+        raise HTTPException(status_code=400, detail="Send img_files or a bucket and keys.")
+    return read_images_data
+LabelImagesDataDep = Annotated[List[bytes], Depends(images_data_reader(settings.MAX_LABEL_BATCH_SIZE))]
+DetectImagesDataDep = Annotated[List[bytes], Depends(images_data_reader(settings.MAX_DETECTION_BATCH_SIZE))]
@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from core.transformer_models import ml_models
+
+router = APIRouter(prefix="/health", tags=["health"])
+
+
+@router.get("/live")
+async def live():
+    """The process is up, it may still be loading the models."""
+    return {"status": "alive"}
+
+
+@router.get("/ready")
+async def ready():
+    """200 once the models are loaded and warmed up, 503 before (or when the loading failed)."""
+    content = {
+        "status": "ready" if ml_models.ready else ("failed" if ml_models.error else "loading"),
+        "device": str(ml_models.device),
+        "weights_source": ml_models.weights_source,
+        "model_version": ml_models.model_version or None,
+        "load_times_s": ml_models.load_times,
+        "warmup_s": ml_models.warmup_s,
+        "error": ml_models.error,
+    }
+    return JSONResponse(status_code=200 if ml_models.ready else 503, content=content)
@@ -3,72 +3,314 @@
 
 
 # here we will crop the main image into small croped imgs, creating few images crop in the db,
-from io import BytesIO
+import asyncio
 from PIL import Image, UnidentifiedImageError
-from typing import List
-from fastapi import APIRouter, Depends, File, HTTPException, Header, UploadFile
-from fastapi.responses import HTMLResponse
+from typing import Annotated, List, Literal
+from fastapi import APIRouter, Depends, File, HTTPException, Header, Query, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 import torch
-from core.cloth_detection.yolo import crop_img
-from core.embedding import img_to_vector, text_to_vector
+from pydantic import TypeAdapter
+from core.cloth_detection.yolo import ClothDetection, detect_clothes, detect_clothes_batch
+from core.embedding import text_to_vector
 from core.labelling import clip_labeling
-from core.transformer_models import yolo_model, clip_model, clip_processor
-from utils.images import pil_img_to_bytes, encode_image_base64
+from core.transformer_models import ml_models
+from api.deps import (
+    DetectImagesDataDep,
+    ImageBatcherDep,
+    ImageDataDep,
+    InferenceSlotDep,
+    LabelImagesDataDep,
+)
+from core.embedding.img_batcher import ImageEmbeddingBatcher
+from core.inference_executor import InferenceExecutor
+from core.result_cache import result_cache
+from core.config import settings
+from utils.images import (
+    CROP_MEDIA_TYPES,
+    DecodedImage,
+    LENGTH_PREFIXED_MEDIA_TYPE,
+    MULTIPART_MIXED_MEDIA_TYPE,
+    build_length_prefixed_body,
+    build_multipart_mixed_body,
+    parse_length_prefixed_body,
+    decode_image,
+    encode_crop,
+    pil_img_to_bytes,
+    encode_image_base64,
+)
 from utils.vectors import merge_two_vectors
 from models.label import LabelingResponse
+from models.detection import DetectedCloth, Detection, DetectionsResponse
 
 router = APIRouter(prefix="/inference/image", tags=["image_inference"])
 
 
+def _decode_images(imgs_data: List[bytes], target_size: int | None) -> List[DecodedImage]:
+    return [decode_image(img_data, target_size) for img_data in imgs_data]
+
+
+async def _decode(
+    executor: InferenceExecutor, imgs_data: List[bytes], target_size: int | None
+) -> List[DecodedImage]:
+    try:
+        return await executor.run(_decode_images, imgs_data, target_size)
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="Invalid image format")
+
+
+async def _cached_result(img_data: bytes, endpoint: str, *params: str) -> tuple[str, bytes | None]:
+    # hashing a 5MB upload (and the disk tier) would block the event loop
+    return await run_in_threadpool(result_cache.lookup, img_data, ml_models.model_version, endpoint, *params)
+
+
+async def _cache_result(key: str, data: bytes) -> None:
+    await run_in_threadpool(result_cache.put, key, data)
+
+
+def _detections_response(decoded: DecodedImage, detections: List[ClothDetection]) -> DetectionsResponse:
+    """Boxes are reported in pixels of the original image, callers crop the full resolution image."""
+    width, height = decoded.full_size
+    return DetectionsResponse(
+        width=width,
+        height=height,
+        detections=[
+            Detection(
+                box=list(decoded.to_full_box(detection.box)),
+                class_id=detection.class_id,
+                confidence=detection.confidence,
+            )
+            for detection in detections
+        ],
+    )
+
+
+def _detect_boxes(decoded: DecodedImage) -> DetectionsResponse:
+    detections = detect_clothes(decoded.img, model=ml_models.yolo_model)
+    if not detections:
+        raise ValueError("No clothing items found in image.")
+    return _detections_response(decoded, detections)
+
+
+def _full_resolution_crops(decoded: DecodedImage, detections: List[ClothDetection]) -> List[Image.Image]:
+    # detection ran on the reduced image, only now the original is decoded at full resolution
+    full_img = decoded.full_resolution()
+    return [full_img.crop(decoded.to_full_box(detection.box)) for detection in detections]
+
+
+def _crop_and_encode(decoded: DecodedImage) -> List[bytes]:
+    detections = detect_clothes(decoded.img, model=ml_models.yolo_model)
+    if not detections:
+        raise ValueError("No clothing items found in image.")
+    cropped_imgs = _full_resolution_crops(decoded, detections)
+    return [
+        encode_crop(
+            image,
+            encoding=settings.CROP_ENCODING,
+            png_compress_level=settings.CROP_PNG_COMPRESS_LEVEL,
+            jpeg_quality=settings.CROP_JPEG_QUALITY,
+        )
+        for image in cropped_imgs
+    ]
+
+
+# the blocking work (decode, YOLO, CLIP, encode) runs on the inference executor, never on the event loop
 # you want to see a DRY (Don't Repeat Yourself) version with decorators or exception middleware!
 @router.post("/crop_clothes")
 async def crop_cloth(
-    img_file: UploadFile,  # needs to do some checks ups here, but we can assume that image comming from fastapi endpoint should be secure
+    img_data: ImageDataDep,  # needs to do some checks ups here, but we can assume that image comming from fastapi endpoint should be secure
+    executor: InferenceSlotDep,
+    accept: Annotated[str | None, Header()] = None,
+    response_mode: Annotated[Literal["crops", "boxes"], Query()] = "crops",
 ):
-    # Process the image
-    # Maybe we should resize the image preserveting its aspect ratio without distortion , to be 640x640
-    try:
-        img_data = await img_file.read()
-        img = Image.open(BytesIO(img_data))
-        cropped_imgs = crop_img(img, model=yolo_model)
-        img_base64_list: List[str] = []
-        for image in cropped_imgs:
-            img_bytes = pil_img_to_bytes(img=image, format="PNG")
-            img_b64 = encode_image_base64(
-                img_bytes
-            )  # use StreamingResponse later for bytes response later, after prototyping
+    """
+    Returns the crops of the detected clothes. The response format is chosen by the Accept header:
+    `application/x-length-prefixed` or `multipart/mixed` send the raw crop bytes,
+    anything else keeps the json list of base64 strings.
 
-            img_base64_list.append(img_b64)
+    With `response_mode=boxes` only the boxes, class ids and confidences are returned, for callers
+    that already have the original image and crop it themselves.
+    """
+    cache_key, cached = await _cached_result(
+        img_data,
+        "crop_clothes",
+        response_mode,
+        settings.CROP_ENCODING,
+        str(settings.CROP_PNG_COMPRESS_LEVEL),
+        str(settings.CROP_JPEG_QUALITY),
+    )
+    if cached is not None and response_mode == "boxes":
+        return Response(content=cached, media_type="application/json")
 
-        return img_base64_list
+    if cached is not None:
+        encoded_crops = parse_length_prefixed_body(cached)
+    else:
+        # JPEGs are decoded at about YOLO_IMGSZ, YOLO letterboxes them to that size anyway
+        (decoded,) = await _decode(executor, [img_data], settings.YOLO_IMGSZ)
+        try:
+            if response_mode == "boxes":
+                detections = await executor.run(_detect_boxes, decoded)
+                await _cache_result(cache_key, detections.model_dump_json().encode())
+                return detections
 
-    except UnidentifiedImageError:
-        raise HTTPException(status_code=400, detail="Invalid image format")
-    except ValueError as e:
-        raise HTTPException(status_code=404, detail=str(e))
-    except RuntimeError as e:
-        raise HTTPException(status_code=500, detail="Model error: " + str(e))
+            encoded_crops = await executor.run(_crop_and_encode, decoded)
 
+        except ValueError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail="Model error: " + str(e))
+        await _cache_result(cache_key, build_length_prefixed_body(encoded_crops))
 
-@router.post("/label")
-async def labels_for_img(img_file: UploadFile):
-    print("Starting to categorize image")
-    img_data = await img_file.read()
-    img = Image.open(BytesIO(img_data))
+    crop_media_type = CROP_MEDIA_TYPES[settings.CROP_ENCODING]
+    headers = {"X-Crop-Media-Type": crop_media_type}
 
-    img_vector = img_to_vector.embed(
-        img=img, model=clip_model, processor=clip_processor
-    )
-    
-    img_labels = clip_labeling.generate_structured_label(
-        img_vector=img_vector, model=clip_model, processor=clip_processor
+    if accept and LENGTH_PREFIXED_MEDIA_TYPE in accept:
+        return Response(
+            content=build_length_prefixed_body(encoded_crops),
+            media_type=LENGTH_PREFIXED_MEDIA_TYPE,
+            headers=headers,
+        )
+    if accept and MULTIPART_MIXED_MEDIA_TYPE in accept:
+        body, boundary = build_multipart_mixed_body(encoded_crops, crop_media_type)
+        return Response(
+            content=body,
+            media_type=f"{MULTIPART_MIXED_MEDIA_TYPE}; boundary={boundary}",
+            headers=headers,
+        )
+
+    img_base64_list: List[str] = [encode_image_base64(crop) for crop in encoded_crops]
+    return JSONResponse(content=img_base64_list, headers=headers)
+
+
+def _labels_from_vectors(img_vectors: torch.Tensor) -> List[LabelingResponse]:
+    # one matmul against the whole vocabulary, then the top-k of each attribute
+    rankings = clip_labeling.rank_labels(
+        img_vectors=img_vectors, label_store=ml_models.label_store, top_k=settings.LABEL_TOP_K
     )
-    label_text = f"a {img_labels.color} {img_labels.pattern} {img_labels.style} {img_labels.category}"
-    label_vector = text_to_vector.embed_text(
-        text=label_text, model=clip_model, processor=clip_processor
+    img_labels = [clip_labeling.best_labels(ranking) for ranking in rankings]
+    label_vectors = text_to_vector.embed_text_list_cached(
+        texts=[clip_labeling.label_to_text(label) for label in img_labels],
+        model=ml_models.clip_model,
+        processor=ml_models.clip_processor,
+        cache=ml_models.text_embedding_cache,
     )
-    
-    storage_vector: list[float] = merge_two_vectors(vector1=img_vector, vector2=label_vector).squeeze(0).tolist() # get a one dimensional vector
 
-    response = LabelingResponse(label_data=img_labels, storage_vector=storage_vector)
-    return response
+    storage_vectors: list[list[float]] = merge_two_vectors(
+        vector1=img_vectors, vector2=label_vectors
+    ).tolist()  # [N, D] -> one vector per image
+
+    return [
+        LabelingResponse(label_data=label, storage_vector=vector, label_scores=ranking)
+        for label, vector, ranking in zip(img_labels, storage_vectors, rankings)
+    ]
+
+
+async def label_images(
+    imgs: List[Image.Image], batcher: ImageEmbeddingBatcher, executor: InferenceExecutor
+) -> List[LabelingResponse]:
+    """
+    Labels a list of images with batched tensor ops, one image tower pass (shared
+    with other requests by the batcher), one text tower pass and one merge for the whole list.
+    """
+    pixel_values = await executor.run(ml_models.clip_preprocessor, imgs)
+    # the forward pass is shared with the other in-flight requests by the batcher
+    img_vectors = await asyncio.wrap_future(batcher.submit(pixel_values))
+    return await executor.run(_labels_from_vectors, img_vectors)
+
+
+@router.post("/label")
+async def labels_for_img(
+    img_data: ImageDataDep, executor: InferenceSlotDep, batcher: ImageBatcherDep
+):
+    print("Starting to categorize image")
+    cache_key, cached = await _cached_result(img_data, "label")
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+
+    (decoded,) = await _decode(executor, [img_data], settings.CLIP_DECODE_SIZE)
+
+    responses = await label_images([decoded.img], batcher, executor)
+    await _cache_result(cache_key, responses[0].model_dump_json().encode())
+    return responses[0]
+
+
+@router.post("/label_batch")
+async def labels_for_imgs(
+    imgs_data: LabelImagesDataDep, executor: InferenceSlotDep, batcher: ImageBatcherDep
+) -> List[LabelingResponse]:
+    """Labels N images in one request, the responses keep the order of the uploaded files (or keys)."""
+    decoded_imgs = await _decode(executor, imgs_data, settings.CLIP_DECODE_SIZE)
+    return await label_images([decoded.img for decoded in decoded_imgs], batcher, executor)
+
+
+_detected_clothes_adapter = TypeAdapter(List[DetectedCloth])
+
+
+def _encode_png_base64(imgs: List[Image.Image]) -> List[str]:
+    return [encode_image_base64(pil_img_to_bytes(img=img, format="PNG")) for img in imgs]
+
+
+@router.post("/detect_and_label")
+async def detect_and_label(
+    img_data: ImageDataDep, executor: InferenceSlotDep, batcher: ImageBatcherDep
+) -> List[DetectedCloth]:
+    """
+    Fused stage: detects the clothes and labels all the crops in the same process, in one batch,
+    so the crops are not encoded, moved and decoded again before labelling.
+    """
+    cache_key, cached = await _cached_result(img_data, "detect_and_label")
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")  # type: ignore[return-value]
+
+    (decoded,) = await _decode(executor, [img_data], settings.YOLO_IMGSZ)
+    try:
+        detections = await executor.run(detect_clothes, decoded.img, ml_models.yolo_model)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail="Model error: " + str(e))
+
+    if not detections:
+        raise HTTPException(status_code=404, detail="No clothing items found in image.")
+
+    # the crops are stored by the backend, so they are cut from the full resolution image
+    crops = await executor.run(_full_resolution_crops, decoded, detections)
+    labelling_responses = await label_images(crops, batcher, executor)
+    encoded_crops = await executor.run(_encode_png_base64, crops)
+
+    detected_clothes = [
+        DetectedCloth(
+            crop=encoded_crop,
+            box=list(decoded.to_full_box(detection.box)),
+            label_data=labelling.label_data,
+            storage_vector=labelling.storage_vector,
+            label_scores=labelling.label_scores,
+        )
+        for encoded_crop, detection, labelling in zip(encoded_crops, detections, labelling_responses)
+    ]
+    await _cache_result(cache_key, _detected_clothes_adapter.dump_json(detected_clothes))
+    return detected_clothes
+
+
+@router.post("/detect_batch")
+async def detect_batch(
+    imgs_data: DetectImagesDataDep, executor: InferenceSlotDep
+) -> List[DetectionsResponse]:
+    """
+    Boxes of the clothes for many images, sent through YOLO in batches of settings.YOLO_BATCH_SIZE.
+    The responses keep the order of the uploaded files (or keys), images without clothes get an empty list.
+    """
+    decoded_imgs = await _decode(executor, imgs_data, settings.YOLO_IMGSZ)
+    try:
+        detections = await executor.run(
+            detect_clothes_batch,
+            [decoded.img for decoded in decoded_imgs],
+            model=ml_models.yolo_model,
+            batch_size=settings.YOLO_BATCH_SIZE,
+            imgsz=settings.YOLO_IMGSZ,
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail="Model error: " + str(e))
+
+    return [
+        _detections_response(decoded, img_detections)
+        for decoded, img_detections in zip(decoded_imgs, detections)
+    ]
@@ -1,7 +1,11 @@
 from fastapi import APIRouter
 from api import img_inference
 from api import text_inferece
+from api import metrics
+from api import health
 
 api_router = APIRouter()
 api_router.include_router(img_inference.router)
 api_router.include_router(text_inferece.router)
+api_router.include_router(metrics.router)
+api_router.include_router(health.router)
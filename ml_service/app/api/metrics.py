@@ -0,0 +1,9 @@
+from fastapi import APIRouter
+from utils.metrics import metrics
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("")
+async def get_metrics() -> dict:
+    return metrics.snapshot()
@@ -1,24 +1,69 @@
+from typing import List
 from fastapi import APIRouter, HTTPException
-from models.label import BestMatching, MatchingRequestBody
-from core.embedding.text_similarity import embed_and_compare
-from core.transformer_models import clip_model, clip_processor
+from models.label import BestMatching, MatchingBatchRequestBody, MatchingRequestBody
+from core.config import settings
+from core.embedding.text_similarity import embed_and_compare, embed_and_compare_batch
+from core.transformer_models import ml_models
+from api.deps import InferenceSlotDep
 
 router = APIRouter(prefix="/inference/text", tags=["text_inference"])
 
 
 @router.post("/matching")
 async def match_texts(
+    executor: InferenceSlotDep,
     body: MatchingRequestBody,
 ) -> BestMatching:
     if not body.candidates:
         raise HTTPException(status_code=400, detail="Candidates list cannot be empty.")
+    if len(body.candidates) > settings.MAX_MATCHING_CANDIDATES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many candidates, the maximum per request is {settings.MAX_MATCHING_CANDIDATES}.",
+        )
     if not body.target.strip():
         raise HTTPException(status_code=400, detail="Target text cannot be empty.")
 
-    result = embed_and_compare(
+    result = await executor.run(
+        embed_and_compare,
         text_list=body.candidates,
         comparing_text=body.target,
-        model=clip_model,
-        processor=clip_processor,
+        model=ml_models.clip_model,
+        processor=ml_models.clip_processor,
+        cache=ml_models.text_embedding_cache,
     )
     return result
+
+
+@router.post("/matching_batch")
+async def match_texts_batch(
+    executor: InferenceSlotDep,
+    body: MatchingBatchRequestBody,
+) -> List[BestMatching]:
+    """Many (candidates, target) problems in one call, the responses keep the order of the problems."""
+    if not body.problems:
+        raise HTTPException(status_code=400, detail="Problems list cannot be empty.")
+    if len(body.problems) > settings.MAX_MATCHING_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many problems, the maximum batch size is {settings.MAX_MATCHING_BATCH_SIZE}.",
+        )
+    candidates = sum(len(problem.candidates) for problem in body.problems)
+    if candidates > settings.MAX_MATCHING_CANDIDATES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many candidates ({candidates}), the maximum per request is {settings.MAX_MATCHING_CANDIDATES}.",
+        )
+    for i, problem in enumerate(body.problems):
+        if not problem.candidates:
+            raise HTTPException(status_code=400, detail=f"Candidates list of problem {i} cannot be empty.")
+        if not problem.target.strip():
+            raise HTTPException(status_code=400, detail=f"Target text of problem {i} cannot be empty.")
+
+    return await executor.run(
+        embed_and_compare_batch,
+        problems=body.problems,
+        model=ml_models.clip_model,
+        processor=ml_models.clip_processor,
+        cache=ml_models.text_embedding_cache,
+    )
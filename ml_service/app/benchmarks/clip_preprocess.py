@@ -0,0 +1,63 @@
+"""
+Per image cost of the CLIP preprocessing, HF CLIPProcessor vs the batched ClipImagePreprocessor.
+
+Run from ml_service/app:
+    python -m benchmarks.clip_preprocess [image paths...] [--crops 32] [--repeat 5] [--atol 1e-4]
+
+Without image paths the crops are cut from a synthetic photo, like the ones YOLO sends to CLIP.
+Reports ms per image of both pipelines, the speedup, and the max abs difference of the pixel_values,
+exits with an error when it is over --atol.
+"""
+
+import argparse
+import time
+
+import torch
+from PIL import Image
+from transformers import CLIPProcessor
+
+from benchmarks.crop_transport import random_crops, synthetic_photo
+from core.config import settings
+from core.embedding import img_to_vector
+from core.embedding.clip_preprocess import ClipImagePreprocessor
+
+
+def timed(fn, repeat: int) -> float:
+    fn()  # warmup
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--crops", type=int, default=32, help="crops per image")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    processor = CLIPProcessor.from_pretrained(settings.CLIP_MODEL_NAME)
+    preprocessor = ClipImagePreprocessor.from_processor(processor)  # type: ignore[arg-type]
+
+    sources = [Image.open(path).convert("RGB") for path in args.images] or [synthetic_photo(1024)]
+    crops = [crop for img in sources for crop in random_crops(img, args.crops)]
+
+    reference = img_to_vector.preprocess(crops, processor)  # type: ignore[arg-type]
+    vectorized = preprocessor(crops)  # type: ignore[arg-type]
+    max_diff = (reference - vectorized).abs().max().item()
+
+    hf_s = timed(lambda: img_to_vector.preprocess(crops, processor), args.repeat)  # type: ignore[arg-type]
+    fast_s = timed(lambda: preprocessor(crops), args.repeat)  # type: ignore[arg-type]
+
+    print(f"{len(crops)} crops, torch threads={torch.get_num_threads()}, {args.repeat} runs\n")
+    print(f"CLIPProcessor         {hf_s / len(crops) * 1000:>8.2f}ms/img")
+    print(f"ClipImagePreprocessor {fast_s / len(crops) * 1000:>8.2f}ms/img  ({hf_s / fast_s:.1f}x)")
+    print(f"max abs diff {max_diff:.2e} (atol {args.atol:.0e})")
+    if max_diff > args.atol:
+        raise SystemExit("The vectorized preprocessing does not match CLIPProcessor")
+
+
+if __name__ == "__main__":
+    main()
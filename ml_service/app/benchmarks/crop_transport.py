@@ -0,0 +1,92 @@
+"""
+Compares the crop encodings and transports of /inference/image/crop_clothes.
+
+Run from ml_service/app:
+    python -m benchmarks.crop_transport [image paths...] [--crops 5] [--repeat 3]
+
+Without image paths a synthetic 2048x2048 photo-like image is used. For every encoding it reports
+the bytes on the wire for the json/base64 list and the binary (length-prefixed) body, plus the
+encode and decode time per crop.
+"""
+
+import argparse
+import json
+import random
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from utils.images import build_length_prefixed_body, encode_crop, encode_image_base64
+
+ENCODINGS = [
+    ("png level 6", dict(encoding="png", png_compress_level=6)),
+    ("png level 1", dict(encoding="png", png_compress_level=1)),
+    ("webp lossless", dict(encoding="webp")),
+    ("jpeg q95", dict(encoding="jpeg", jpeg_quality=95)),
+]
+
+
+def synthetic_photo(size: int = 2048, seed: int = 0) -> Image.Image:
+    # gradients + shapes + blur, compresses like a photo, unlike pure noise
+    rng = random.Random(seed)
+    img = Image.linear_gradient("L").resize((size, size)).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for _ in range(200):
+        x, y = rng.randrange(size), rng.randrange(size)
+        r = rng.randrange(10, size // 6)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    return img.filter(ImageFilter.GaussianBlur(2))
+
+
+def random_crops(img: Image.Image, count: int, seed: int = 0) -> list[Image.Image]:
+    rng = random.Random(seed)
+    crops = []
+    for _ in range(count):
+        w = rng.randrange(img.width // 5, img.width // 2)
+        h = rng.randrange(img.height // 5, img.height // 2)
+        x, y = rng.randrange(img.width - w), rng.randrange(img.height - h)
+        crops.append(img.crop((x, y, x + w, y + h)))
+    return crops
+
+
+def run(crops: list[Image.Image], repeat: int) -> None:
+    print(f"{len(crops)} crops, {repeat} runs\n")
+    print(f"{'encoding':<15} {'json b64':>12} {'binary':>12} {'saved':>7} {'encode/crop':>12} {'decode/crop':>12}")
+
+    for name, options in ENCODINGS:
+        encode_s = decode_s = 0.0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            encoded = [encode_crop(crop, **options) for crop in crops]  # type: ignore[arg-type]
+            encode_s += time.perf_counter() - start
+
+            start = time.perf_counter()
+            for data in encoded:
+                Image.open(BytesIO(data)).load()
+            decode_s += time.perf_counter() - start
+
+        json_bytes = len(json.dumps([encode_image_base64(data) for data in encoded]).encode())
+        binary_bytes = len(build_length_prefixed_body(encoded))
+        runs = repeat * len(crops)
+        print(
+            f"{name:<15} {json_bytes / 1024:>10.0f}KB {binary_bytes / 1024:>10.0f}KB "
+            f"{1 - binary_bytes / json_bytes:>7.0%} {encode_s / runs * 1000:>10.1f}ms {decode_s / runs * 1000:>10.1f}ms"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="images to crop, a synthetic one is used if empty")
+    parser.add_argument("--crops", type=int, default=5, help="crops per image")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    imgs = [Image.open(path).convert("RGB") for path in args.images] or [synthetic_photo()]
+    crops = [crop for img in imgs for crop in random_crops(img, args.crops)]
+    run(crops, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Decode time and peak memory of the ml_service ingest path, full decode vs JPEG draft mode.
+
+Run from ml_service/app:
+    python -m benchmarks.image_decode [image paths...] [--repeat 10]
+
+Without image paths a synthetic 4096x3072 JPEG (the max upload resolution) is used. Every mode runs
+in a fresh process, so the peak RSS growth it reports belongs to that mode only.
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+from io import BytesIO
+
+from benchmarks.crop_transport import synthetic_photo
+from utils.images import decode_image
+
+MODES = [("full", None), ("draft yolo 640", 640), ("draft clip 224", 224)]
+
+
+def _run_mode(images: list[bytes], target_size: int | None, repeat: int, results) -> None:
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in images:
+            decoded = decode_image(data, target_size)
+    elapsed = time.perf_counter() - start
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed / (repeat * len(images)), peak_kb - baseline_kb, decoded.img.size))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.images:
+        images = [open(path, "rb").read() for path in args.images]
+    else:
+        buf = BytesIO()
+        synthetic_photo(4096).resize((4096, 3072)).save(buf, format="JPEG", quality=90)
+        images = [buf.getvalue()]
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{len(images)} images, {args.repeat} runs\n")
+    print(f"{'mode':<16} {'decoded size':>14} {'ms/img':>8} {'peak rss':>10}")
+    for name, target_size in MODES:
+        results = context.Queue()
+        process = context.Process(target=_run_mode, args=(images, target_size, args.repeat, results))
+        process.start()
+        seconds, peak_kb, (width, height) = results.get()
+        process.join()
+        print(f"{name:<16} {f'{width}x{height}':>14} {seconds * 1000:>8.1f} {peak_kb / 1024:>8.1f}MB")
+
+
+if __name__ == "__main__":
+    main()
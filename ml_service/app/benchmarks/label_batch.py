@@ -0,0 +1,98 @@
+"""
+Labelling latency of the crops of one photo: one /label request per crop (the label_img_task chord)
+against one /label_batch request (label_crops_task, ML_BATCHED_LABELLING on the backend).
+
+Run from ml_service/app, with the service running:
+    python -m benchmarks.label_batch [--url http://localhost:8080] [--crops 5] [--repeat 10]
+
+Only the ml_service side is measured, the broker round trips, result backend writes, DB sessions and
+S3 downloads saved per crop by the batched task come on top. Every request carries unique bytes so
+the result cache never answers.
+"""
+
+import argparse
+import time
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from benchmarks.crop_transport import random_crops, synthetic_photo
+
+
+def multipart_body(files: list[tuple[str, str, bytes]]) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = b""
+    for field, filename, data in files:
+        body += (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            "Content-Type: image/png\r\n\r\n"
+        ).encode() + data + b"\r\n"
+    body += f"--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def post(url: str, files: list[tuple[str, str, bytes]]) -> None:
+    body, content_type = multipart_body(files)
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+    with urllib.request.urlopen(request, timeout=120) as response:
+        response.read()
+
+
+def unique(png: bytes) -> bytes:
+    # bytes after the PNG end chunk are ignored by the decoder but change the result cache key
+    return png + uuid.uuid4().bytes
+
+
+def timed(fn, repeat: int) -> tuple[float, float]:
+    fn()  # warmup
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[-1]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--crops", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    crops = []
+    for crop in random_crops(synthetic_photo(), count=args.crops):
+        buf = BytesIO()
+        crop.save(buf, format="PNG")
+        crops.append(buf.getvalue())
+
+    label_url = f"{args.url}/inference/image/label"
+    batch_url = f"{args.url}/inference/image/label_batch"
+
+    def sequential():
+        for png in crops:
+            post(label_url, [("img_file", "crop.png", unique(png))])
+
+    def concurrent():
+        with ThreadPoolExecutor(max_workers=len(crops)) as pool:
+            list(pool.map(lambda png: post(label_url, [("img_file", "crop.png", unique(png))]), crops))
+
+    def batched():
+        post(batch_url, [("img_files", f"crop_{idx}.png", unique(png)) for idx, png in enumerate(crops)])
+
+    print(f"{args.crops} crops, {args.repeat} runs\n")
+    print(f"{'mode':<28} {'p50':>9} {'max':>9}")
+    for name, fn in (
+        ("/label per crop, sequential", sequential),
+        ("/label per crop, concurrent", concurrent),
+        ("/label_batch", batched),
+    ):
+        p50, worst = timed(fn, args.repeat)
+        print(f"{name:<28} {p50 * 1000:>7.0f}ms {worst * 1000:>7.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Latency and throughput of the torch and the ONNX Runtime (fp32 and int8) backends on CPU.
+
+Run from ml_service/app, after exporting the graphs with `python -m core.onnx_backend [--quantize]`:
+    python -m benchmarks.onnx_backend [--batch-sizes 1 8 32] [--repeat 5] [--threads 4]
+
+For the CLIP image tower, the CLIP text tower and YOLO it reports ms per batch and items/s of every
+backend whose graphs are on disk, plus the min cosine of the onnx CLIP embeddings against torch.
+"""
+
+import argparse
+import time
+from typing import Callable
+
+import torch
+from huggingface_hub import hf_hub_download
+from transformers import CLIPModel, CLIPProcessor
+
+from benchmarks.crop_transport import random_crops, synthetic_photo
+from core.cloth_detection.yolo import detect_clothes_batch, load_yolo
+from core.config import settings
+from core.embedding import img_to_vector, text_to_vector
+from core.labelling.vocab import LABEL_DICTIONARY
+from core.onnx_backend import OnnxClipModel, check_accuracy, export_key, onnx_model_dir, onnx_paths
+
+
+def timed(fn: Callable[[], object], repeat: int) -> float:
+    fn()  # warmup
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def report(name: str, batch_size: int, seconds: float) -> None:
+    print(f"{name:<22} {batch_size:>6} {seconds * 1000:>10.1f}ms {batch_size / seconds:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None, help="torch and onnx intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    torch_clip = CLIPModel.from_pretrained(settings.CLIP_MODEL_NAME).eval()  # type: ignore
+    processor = CLIPProcessor.from_pretrained(settings.CLIP_MODEL_NAME)
+    yolo_weights = hf_hub_download(settings.YOLO_MODEL_REPO, "best.pt")
+    key = export_key(settings.CLIP_MODEL_NAME, "hub", yolo_weights, settings.YOLO_IMGSZ)
+    model_dir = onnx_model_dir(settings.ONNX_MODEL_DIR, settings.CLIP_MODEL_NAME, key)
+
+    clip_backends: dict[str, object] = {"torch": torch_clip}
+    yolo_backends = {"torch": load_yolo(yolo_weights, torch.device("cpu"))}
+    for name, quantize in (("onnx fp32", False), ("onnx int8", True)):
+        paths = onnx_paths(model_dir, quantize)
+        if not all(path.exists() for path in paths.values()):
+            print(f"skipping {name}, graphs not found in {model_dir}")
+            continue
+        clip_backends[name] = OnnxClipModel(paths["clip_image"], paths["clip_text"], args.threads)
+        yolo_backends[name] = load_yolo(str(paths["yolo"]), torch.device("cpu"))
+
+    photo = synthetic_photo()
+    max_batch = max(args.batch_sizes)
+    crops = random_crops(photo, count=max_batch)
+    texts = [label for labels in LABEL_DICTIONARY.values() for label in labels]
+    texts = (texts * (max_batch // len(texts) + 1))[:max_batch]
+
+    print(f"\ntorch threads={torch.get_num_threads()}, {args.repeat} runs\n")
+    print(f"{'backend':<22} {'batch':>6} {'latency':>12} {'items/s':>10}")
+    for batch_size in args.batch_sizes:
+        pixel_values = img_to_vector.preprocess(crops[:batch_size], processor)  # type: ignore[arg-type]
+        for name, model in clip_backends.items():
+            seconds = timed(lambda: img_to_vector.embed_pixel_values(pixel_values, model), args.repeat)  # type: ignore[arg-type]
+            report(f"clip image {name}", batch_size, seconds)
+        for name, model in clip_backends.items():
+            seconds = timed(
+                lambda: text_to_vector.embed_text_list(texts[:batch_size], model, processor),  # type: ignore[arg-type]
+                args.repeat,
+            )
+            report(f"clip text {name}", batch_size, seconds)
+        imgs = [photo] * min(batch_size, settings.YOLO_BATCH_SIZE)
+        for name, yolo in yolo_backends.items():
+            seconds = timed(
+                lambda: detect_clothes_batch(imgs, yolo, batch_size=len(imgs), imgsz=settings.YOLO_IMGSZ),
+                args.repeat,
+            )
+            report(f"yolo {name}", len(imgs), seconds)
+        print()
+
+    for name, model in clip_backends.items():
+        if name == "torch":
+            continue
+        scores = check_accuracy(torch_clip, model, processor, crops, texts)  # type: ignore[arg-type]
+        print(f"{name}: image min cosine {scores['image_min']:.4f}, text min cosine {scores['text_min']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Throughput of the multi-process model server (gunicorn_conf.py) per number of workers.
+
+Run from ml_service/app:
+    python -m benchmarks.worker_scaling [--workers 1 2 4] [--requests 64] [--concurrency 16]
+
+For every worker count it starts `gunicorn -c gunicorn_conf.py main:app` on a local port, waits until
+it answers, then sends the same synthetic image to /inference/image/crop_clothes?response_mode=boxes
+from `--concurrency` client threads. Reports requests/second, p50 and p95 latency, and the memory
+shared between the workers (from /proc, linux only).
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from benchmarks.crop_transport import synthetic_photo
+
+APP_DIR = Path(__file__).resolve().parent.parent
+ENDPOINT = "/inference/image/crop_clothes?response_mode=boxes"
+
+
+def multipart_body(field: str, filename: str, data: bytes) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def post(url: str, body: bytes, content_type: str) -> float:
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=120) as response:
+            response.read()
+    except urllib.error.HTTPError as e:
+        if e.code != 404:  # 404 is "no clothes found", the inference still ran
+            raise
+    return time.perf_counter() - start
+
+
+def wait_until_ready(base_url: str, timeout_s: float) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/health/ready", timeout=2):
+                return
+        except OSError:  # includes the 503 of a server still loading
+            time.sleep(1)
+    raise TimeoutError(f"The server at {base_url} did not start in {timeout_s}s")
+
+
+def shared_kb(pids: list[int]) -> tuple[int, int]:
+    """Sum of the shared and private memory of the processes, in KB."""
+    shared = private = 0
+    for pid in pids:
+        try:
+            for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+                name, _, value = line.partition(":")
+                if name in ("Shared_Clean", "Shared_Dirty"):
+                    shared += int(value.split()[0])
+                elif name in ("Private_Clean", "Private_Dirty"):
+                    private += int(value.split()[0])
+        except OSError:
+            pass
+    return shared, private
+
+
+def child_pids(pid: int) -> list[int]:
+    try:
+        return [int(p) for p in Path(f"/proc/{pid}/task/{pid}/children").read_text().split()]
+    except OSError:
+        return []
+
+
+def unique_upload(jpeg: bytes) -> tuple[bytes, str]:
+    # bytes after the JPEG end marker are ignored by the decoder but change the sha256,
+    # every request misses the result cache and runs the models
+    return multipart_body("img_file", "bench.jpg", jpeg + uuid.uuid4().bytes)
+
+
+def run(workers: int, args: argparse.Namespace, jpeg: bytes) -> None:
+    env = dict(os.environ, SERVER_WORKERS=str(workers), BIND=f"127.0.0.1:{args.port}")
+    env.setdefault("PROJECT_NAME", "ml_service_benchmark")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn_conf.py", "main:app"],
+        cwd=APP_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_ready(base_url, args.startup_timeout)
+        url = base_url + ENDPOINT
+        # warmup, one request per worker
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(lambda _: post(url, *unique_upload(jpeg)), range(workers * 2)))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            latencies = sorted(pool.map(lambda _: post(url, *unique_upload(jpeg)), range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+        shared, private = shared_kb(child_pids(server.pid))
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+        print(
+            f"{workers:>7} {args.requests / elapsed:>8.1f} {p50:>9.0f}ms {p95:>9.0f}ms "
+            f"{shared / 1024:>9.0f}MB {private / 1024:>9.0f}MB"
+        )
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    buf = BytesIO()
+    synthetic_photo(1024).save(buf, format="JPEG", quality=90)
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, cpus {len(os.sched_getaffinity(0))}\n")
+    print(f"{'workers':>7} {'req/s':>8} {'p50':>11} {'p95':>11} {'shared':>11} {'private':>11}")
+    for workers in args.workers:
+        run(workers, args, buf.getvalue())
+
+
+if __name__ == "__main__":
+    main()
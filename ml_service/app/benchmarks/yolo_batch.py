@@ -0,0 +1,53 @@
+"""
+Throughput of the batched YOLO detection on CPU.
+
+Run from ml_service/app:
+    python -m benchmarks.yolo_batch [image paths...] [--images 32] [--batch-sizes 1 4 8 16]
+
+Without image paths synthetic 1024x1365 photo-like images are used (the detections are
+meaningless, but the cost of the forward pass is the same). Reports images/second per batch size.
+"""
+
+import argparse
+import time
+
+import torch
+from huggingface_hub import hf_hub_download
+from PIL import Image
+
+from benchmarks.crop_transport import synthetic_photo
+from core.cloth_detection.yolo import detect_clothes_batch, load_yolo
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*")
+    parser.add_argument("--images", dest="count", type=int, default=32, help="images per run")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = load_yolo(hf_hub_download("kesimeg/yolov8n-clothing-detection", "best.pt"), torch.device("cpu"))
+    sources = [Image.open(path).convert("RGB") for path in args.images] or [
+        synthetic_photo(1365, seed=i).resize((1024, 1365)) for i in range(4)
+    ]
+    imgs = [sources[i % len(sources)] for i in range(args.count)]
+
+    # warmup, the first predict call builds the predictor
+    detect_clothes_batch(imgs[:2], model, batch_size=2, imgsz=args.imgsz)
+
+    print(f"{len(imgs)} images, imgsz={args.imgsz}, torch threads={torch.get_num_threads()}\n")
+    print(f"{'batch size':>10} {'total':>9} {'img/s':>8} {'ms/img':>8}")
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        detect_clothes_batch(imgs, model, batch_size=batch_size, imgsz=args.imgsz)
+        elapsed = time.perf_counter() - start
+        print(f"{batch_size:>10} {elapsed:>8.2f}s {len(imgs) / elapsed:>8.1f} {elapsed / len(imgs) * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
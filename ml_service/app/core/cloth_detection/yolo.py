@@ -1,24 +1,99 @@
+from dataclasses import dataclass
 from huggingface_hub import hf_hub_download
 import torch
 from ultralytics import YOLO
+from ultralytics.engine.results import Results
+from ultralytics.nn.tasks import DetectionModel
+from ultralytics.nn.modules import (Conv, C2f, Bottleneck, SPPF, Concat, Detect, DFL)
+from torch.nn import (Sequential, Conv2d, SiLU, BatchNorm2d, MaxPool2d,
+                      AdaptiveAvgPool2d, Linear, ModuleList, Upsample)
 from PIL import Image
 
+DETECTION_CONFIDENCE = 0.7
 
-def extract_clothing_patches(img: Image.Image, model: YOLO) -> list[Image.Image]:
-    """
-    here we recive a image Pil type  from the api endpoint, the endpoint should instantice the image for simplicity
-    """
+# --- Define ALL the classes that are safe to unpickle ---
+safe_classes = [
+    # Standard PyTorch Modules
+    Sequential, Conv2d, SiLU, BatchNorm2d, MaxPool2d, AdaptiveAvgPool2d, Linear,
+    # Custom Ultralytics Modules
+    DetectionModel,
+    Conv,
+    C2f,
+    Bottleneck,
+    SPPF,
+    Concat,
+    Detect,
+    ModuleList,
+    Upsample,
+    DFL
+]
+
+
+def load_yolo(weights_path: str, device: torch.device) -> YOLO:
+    if weights_path.endswith(".onnx"):
+        # exported graph, ultralytics serves it with ONNX Runtime and picks the device at predict time
+        return YOLO(weights_path, task="detect")
+    # Load YOLO model with safe_globals context
+    with torch.serialization.safe_globals(safe_classes):
+        return YOLO(weights_path).to(device)
 
-    results = model.predict(img, conf=0.7)[0]  # pega o primeiro (e único) batch/result
 
-    patches = []
+@dataclass
+class ClothDetection:
+    box: tuple[int, int, int, int]  # [x1, y1, x2, y2] in pixels of the input image
+    class_id: int
+    confidence: float
+
+
+def _to_detections(results: Results) -> list[ClothDetection]:
+    detections = []
     for box in results.boxes:
         # coords em formato [x1, y1, x2, y2]
         x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-        patch = img.crop((x1, y1, x2, y2))
-        patches.append(patch)
+        detections.append(
+            ClothDetection(
+                box=(x1, y1, x2, y2),
+                class_id=int(box.cls[0].item()),
+                confidence=float(box.conf[0].item()),
+            )
+        )
+    return detections
+
 
-    return patches
+def detect_clothes(img: Image.Image, model: YOLO) -> list[ClothDetection]:
+    results = model.predict(img, conf=DETECTION_CONFIDENCE)[0]  # pega o primeiro (e único) batch/result
+    return _to_detections(results)
+
+
+def detect_clothes_batch(
+    imgs: list[Image.Image], model: YOLO, batch_size: int, imgsz: int = 640
+) -> list[list[ClothDetection]]:
+    """
+    Detects the clothes of many images, sending `batch_size` images through each `predict` call.
+
+    Args:
+        imgs (list[Image.Image]): The images to process, they can have different sizes.
+        model (YOLO): The detection model.
+        batch_size (int): Images per forward pass.
+        imgsz (int): Every image is letterboxed to imgsz x imgsz, so images of any size share a batch.
+
+    Returns:
+        list[list[ClothDetection]]: The detections of each image, in the order of `imgs`,
+        boxes are in pixels of the source image.
+    """
+    detections: list[list[ClothDetection]] = []
+    for start in range(0, len(imgs), batch_size):
+        batch = imgs[start : start + batch_size]
+        results = model.predict(batch, conf=DETECTION_CONFIDENCE, imgsz=imgsz, verbose=False)
+        detections.extend(_to_detections(result) for result in results)
+    return detections
+
+
+def extract_clothing_patches(img: Image.Image, model: YOLO) -> list[Image.Image]:
+    """
+    here we recive a image Pil type  from the api endpoint, the endpoint should instantice the image for simplicity
+    """
+    return [img.crop(detection.box) for detection in detect_clothes(img, model)]
 
 
 def crop_img(img: Image.Image, model: YOLO) -> list[Image.Image]:
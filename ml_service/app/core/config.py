@@ -1,7 +1,71 @@
+from typing import Literal
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     PROJECT_NAME: str
     all_cors_origins: list[str] = ["*"]
 
+    # models, served with torch or with ONNX Runtime (exported on first start when missing, see core/onnx_backend.py)
+    YOLO_MODEL_REPO: str = "kesimeg/yolov8n-clothing-detection"
+    CLIP_MODEL_NAME: str = "patrickjohncyh/fashion-clip"
+    MODEL_BUNDLE_DIR: str | None = None  # offline bundle (core/model_bundle.py), no hub access when set
+    MODEL_BUNDLE_VERIFY: bool = True  # check the bundle checksums before loading
+    MODEL_BACKEND: Literal["torch", "onnx"] = "torch"
+    ONNX_MODEL_DIR: str = "/tmp/ml_service/onnx"
+    ONNX_QUANTIZE: bool = False  # dynamic int8 quantization of the onnx graphs
+    ONNX_MIN_COSINE: float = 0.99  # accuracy check of the onnx embeddings against the torch ones
+
+    # synthetic passes through every model at startup, /health/ready turns green after them
+    WARMUP_ITERATIONS: int = 2
+
+    # uploads are decoded close to the model input size (JPEG draft mode), at full resolution only to cut crops
+    CLIP_DECODE_SIZE: int = 224
+
+    # labels returned with their scores per attribute, best first
+    LABEL_TOP_K: int = 3
+
+    # LRU of text embeddings, label sentences are a small finite set (13*12*6*9) plus the product names
+    TEXT_EMBEDDING_CACHE_SIZE: int = 20_000
+    MAX_MATCHING_BATCH_SIZE: int = 256  # max problems per /inference/text/matching_batch request
+    MAX_MATCHING_CANDIDATES: int = 4096  # max candidates of all the problems of a /matching_batch request
+
+    # CLIP image micro-batching, trade throughput (bigger batches) against latency (shorter waits)
+    CLIP_MAX_BATCH_SIZE: int = 32
+    CLIP_MAX_BATCH_WAIT_MS: float = 5.0
+    MAX_LABEL_BATCH_SIZE: int = 64  # max images per /inference/image/label_batch request
+
+    # batched YOLO detection, images are letterboxed to YOLO_IMGSZ so any sizes share a batch
+    YOLO_BATCH_SIZE: int = 8
+    YOLO_IMGSZ: int = 640
+    MAX_DETECTION_BATCH_SIZE: int = 64  # max images per /inference/image/detect_batch request
+
+    # encoding of the crops returned by /inference/image/crop_clothes
+    CROP_ENCODING: Literal["png", "webp", "jpeg"] = "png"
+    CROP_PNG_COMPRESS_LEVEL: int = 6
+    CROP_JPEG_QUALITY: int = 95
+
+    # optional S3/MinIO access, lets callers send {bucket, key} instead of the image bytes
+    S3_ENDPOINT_URL: str | None = None
+    S3_ACCESS_KEY: str | None = None
+    S3_SECRET_KEY: str | None = None
+    S3_MAX_POOL_CONNECTIONS: int = 32
+
+    # results of crop_clothes, label and detect_and_label keyed by sha256(image) + model version
+    RESULT_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESULT_CACHE_DIR: str | None = None  # enables the disk tier
+    RESULT_CACHE_DISK_MAX_BYTES: int = 1024 * 1024 * 1024  # hundreds of multi-MB crop bodies, or ~100k json results
+
+    # blocking inference runs on a bounded pool, requests over INFERENCE_WORKERS + INFERENCE_MAX_QUEUE get a 503
+    INFERENCE_WORKERS: int = 4
+    INFERENCE_MAX_QUEUE: int = 32
+    INFERENCE_RETRY_AFTER_S: int = 1
+
+    # multi-process serving (gunicorn_conf.py), the models are loaded once and shared copy-on-write by the workers
+    SERVER_WORKERS: int = 1
+    TORCH_THREADS_PER_WORKER: int | None = None  # None -> available cpus / SERVER_WORKERS
+    PIN_WORKER_CPUS: bool = False  # gives each worker its own slice of the cpus
+
+    # persisted label vocabulary embeddings, keyed by model name + hash of vocab.py
+    LABEL_EMBEDDINGS_CACHE_DIR: str = "/tmp/ml_service/label_embeddings"
+
 settings = Settings()# type: ignore[call-arg] | because we load the args from the env
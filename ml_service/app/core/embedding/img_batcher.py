@@ -0,0 +1,128 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+import torch
+from transformers import CLIPModel
+
+from core.embedding.img_to_vector import embed_pixel_values
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+QUEUE_WAIT_MS_BUCKETS = [0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000]
+
+
+@dataclass
+class _PendingRequest:
+    pixel_values: torch.Tensor
+    future: Future
+    enqueued_at: float
+
+
+class ImageEmbeddingBatcher:
+    """
+    Micro-batching scheduler in front of `clip_model.get_image_features`.
+
+    Concurrent callers submit their pixel_values and get a future back, a single
+    background thread collects requests until `max_batch_size` rows are queued or the
+    oldest request waited `max_wait_ms`, runs one forward pass and hands each caller its rows.
+
+    Args:
+        model (CLIPModel): The clip model used for the image tower.
+        max_batch_size (int): Max number of images in one forward pass.
+        max_wait_ms (float): Max time the first request of a batch waits for others to join.
+    """
+
+    def __init__(self, model: CLIPModel, max_batch_size: int, max_wait_ms: float):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self._queue: queue.Queue[_PendingRequest] = queue.Queue()
+        self._carry: _PendingRequest | None = None  # request that did not fit in the last batch
+
+        self._batch_size_hist = metrics.histogram("clip_image_batch_size", BATCH_SIZE_BUCKETS)
+        self._queue_wait_hist = metrics.histogram("clip_image_queue_wait_ms", QUEUE_WAIT_MS_BUCKETS)
+        metrics.gauge("clip_image_queue_depth", lambda: self._queue.qsize())
+
+        self._thread = threading.Thread(target=self._run, name="clip-image-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, pixel_values: torch.Tensor) -> Future:
+        """
+        Queue pixel_values with shape [N, 3, H, W], the future resolves to the normalized
+        embeddings with shape [N, D] in the same order.
+        """
+        future: Future = Future()
+        self._queue.put(_PendingRequest(pixel_values, future, time.perf_counter()))
+        return future
+
+    def embed(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        """Blocking version of `submit`, for sync callers."""
+        return self.submit(pixel_values).result()
+
+    def _next_request(self, timeout: float | None) -> _PendingRequest | None:
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        try:
+            if timeout is None:
+                return self._queue.get()
+            if timeout <= 0:
+                return self._queue.get_nowait()
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _collect_batch(self) -> list[_PendingRequest]:
+        first = self._next_request(timeout=None)
+        assert first is not None
+        batch = [first]
+        rows = first.pixel_values.shape[0]
+        deadline = first.enqueued_at + self.max_wait_s
+
+        while rows < self.max_batch_size:
+            request = self._next_request(timeout=deadline - time.perf_counter())
+            if request is None:
+                break
+            if rows + request.pixel_values.shape[0] > self.max_batch_size:
+                self._carry = request
+                break
+            batch.append(request)
+            rows += request.pixel_values.shape[0]
+
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started_at = time.perf_counter()
+            for request in batch:
+                self._queue_wait_hist.observe((started_at - request.enqueued_at) * 1000)
+
+            try:
+                pixel_values = torch.cat([r.pixel_values for r in batch], dim=0)
+                self._batch_size_hist.observe(pixel_values.shape[0])
+                embeddings = embed_pixel_values(pixel_values, self.model)
+            except Exception as e:
+                logger.error(f"Batched image embedding failed: {e}", exc_info=True)
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            offset = 0
+            for request in batch:
+                rows = request.pixel_values.shape[0]
+                request.future.set_result(embeddings[offset : offset + rows])
+                offset += rows
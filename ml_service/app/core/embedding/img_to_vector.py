@@ -3,7 +3,7 @@ from transformers import CLIPProcessor, CLIPModel
 from PIL import Image
 import torch
 
-#from here we get the img vector and the initialized model, 
+#from here we get the img vector and the initialized model,
 
 #Device handling:
 #If you want to support GPU inference, consider moving tensors and model to the same device:
@@ -13,14 +13,24 @@ import torch
 #You might want to add a check in case pixel_values is missing, or the input is invalid.
 
 
-def embed(img: Image.Image, model: CLIPModel, processor: CLIPProcessor) -> torch.Tensor:
-    device = next(model.parameters()).device  # get the same device as the model
-    
+def preprocess(img: Image.Image | list[Image.Image], processor: CLIPProcessor) -> torch.Tensor:
+    """Runs the CLIP image preprocessing, returns pixel_values with shape [N, 3, 224, 224]
+    Reference pipeline, the request path uses the batched `clip_preprocess.ClipImagePreprocessor`."""
     inputs = processor(images=img, return_tensors="pt")
-    pixel_values = cast(torch.Tensor, inputs["pixel_values"]).to(device) # move vector to same device as model
-    
+    return cast(torch.Tensor, inputs["pixel_values"])
+
+
+def embed_pixel_values(pixel_values: torch.Tensor, model: CLIPModel) -> torch.Tensor:
+    device = model.device  # get the same device as the model
+    pixel_values = pixel_values.to(device) # move vector to same device as model
+
     with torch.no_grad():
-        outputs = model.get_image_features(pixel_values=pixel_values)  # type: ignore[arg-type]  shape: [1, 512]
+        outputs = model.get_image_features(pixel_values=pixel_values)  # type: ignore[arg-type]  shape: [N, 512]
         image_embedding = outputs / outputs.norm(p=2, dim=-1, keepdim=True)  # L2 normalize (optional for similarity search)
-    
+
     return image_embedding
+
+
+def embed(img: Image.Image, model: CLIPModel, processor: CLIPProcessor) -> torch.Tensor:
+    pixel_values = preprocess(img, processor)
+    return embed_pixel_values(pixel_values, model)
@@ -0,0 +1,59 @@
+from threading import Lock
+from typing import Callable
+
+import torch
+from cachetools import LRUCache
+
+from utils.metrics import metrics
+
+
+class TextEmbeddingCache:
+    """
+    Bounded LRU of CLIP text embeddings keyed by (model id, text).
+
+    The texts embedded by the service come from a small set (label sentences, label vocabulary,
+    product names), so most calls only read the cache. The misses of a call are deduplicated and
+    embedded together in one forward pass.
+
+    Args:
+        model_id (str): Identifies the model (and backend) producing the embeddings.
+        maxsize (int): Max number of cached embeddings.
+    """
+
+    def __init__(self, model_id: str, maxsize: int):
+        self.model_id = model_id
+        self._cache: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = Lock()
+
+        self._hits = metrics.counter("text_embedding_cache_hits_total")
+        self._misses = metrics.counter("text_embedding_cache_misses_total")
+        metrics.gauge("text_embedding_cache_size", lambda: len(self._cache))
+
+    def embed(self, texts: list[str], embed_fn: Callable[[list[str]], torch.Tensor]) -> torch.Tensor:
+        """
+        Args:
+            texts (list[str]): The texts, duplicates allowed.
+            embed_fn (Callable[[list[str]], torch.Tensor]): Embeds a list of texts, called once with the misses.
+
+        Returns:
+            torch.Tensor: The embeddings with shape [len(texts), D], in the order of `texts`.
+        """
+        found: dict[str, torch.Tensor] = {}
+        with self._lock:
+            for text in texts:
+                vector = self._cache.get((self.model_id, text))
+                if vector is not None:
+                    found[text] = vector
+
+        misses = list(dict.fromkeys(text for text in texts if text not in found))
+        self._hits.inc(len(texts) - len(misses))
+        self._misses.inc(len(misses))
+
+        if misses:
+            vectors = embed_fn(misses)
+            with self._lock:
+                for text, vector in zip(misses, vectors):
+                    # a copy, a view would keep the whole batch tensor alive
+                    found[text] = self._cache[(self.model_id, text)] = vector.clone()
+
+        return torch.stack([found[text] for text in texts])
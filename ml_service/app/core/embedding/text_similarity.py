@@ -4,18 +4,66 @@ import torch
 from torch.nn.functional import cosine_similarity
 
 
-from core.embedding.text_to_vector import embed_text, embed_text_list
+from core.embedding.text_cache import TextEmbeddingCache
+from core.embedding.text_to_vector import embed_text, embed_text_list, embed_text_list_cached
 from pydantic import BaseModel
-from models.label import BestMatching
+from models.label import BestMatching, MatchingRequestBody
 
     
-def embed_and_compare(text_list: List[str], comparing_text:str, model:CLIPModel, processor:CLIPProcessor) -> BestMatching:
-    cadidates_embeddings = embed_text_list(text_list, model, processor)
-    query_embedding = embed_text(comparing_text, model, processor)
+def embed_and_compare(
+    text_list: List[str],
+    comparing_text: str,
+    model: CLIPModel,
+    processor: CLIPProcessor,
+    cache: TextEmbeddingCache | None = None,
+) -> BestMatching:
+    if cache is None:
+        cadidates_embeddings = embed_text_list(text_list, model, processor)
+        query_embedding = embed_text(comparing_text, model, processor)
+    else:
+        # candidates and target go through the cache together, the misses in one forward pass
+        embeddings = embed_text_list_cached([*text_list, comparing_text], model, processor, cache)
+        cadidates_embeddings, query_embedding = embeddings[:-1], embeddings[-1:]
     
     similarities = cosine_similarity(query_embedding, cadidates_embeddings)
     best_idx = torch.argmax(similarities).item()
     best_score = similarities[best_idx].item()
     best_text = text_list[best_idx]
     
-    return BestMatching(text=best_text, score=best_score, index=best_idx)
\ No newline at end of file
+    return BestMatching(text=best_text, score=best_score, index=best_idx)
+
+
+def embed_and_compare_batch(
+    problems: List[MatchingRequestBody],
+    model: CLIPModel,
+    processor: CLIPProcessor,
+    cache: TextEmbeddingCache | None = None,
+) -> List[BestMatching]:
+    """
+    Batched `embed_and_compare`, every distinct string of all the problems is embedded once and all
+    the similarities come from one matmul, gathered into a [problems, max candidates] padded matrix.
+    """
+    texts = list(dict.fromkeys(text for problem in problems for text in [*problem.candidates, problem.target]))
+    text_idx = {text: i for i, text in enumerate(texts)}
+    if cache is None:
+        embeddings = embed_text_list(texts, model, processor)
+    else:
+        embeddings = embed_text_list_cached(texts, model, processor, cache)
+
+    max_candidates = max(len(problem.candidates) for problem in problems)
+    candidate_idxs = torch.zeros(len(problems), max_candidates, dtype=torch.long)
+    padding = torch.ones(len(problems), max_candidates, dtype=torch.bool)
+    for row, problem in enumerate(problems):
+        candidate_idxs[row, : len(problem.candidates)] = torch.tensor([text_idx[text] for text in problem.candidates])
+        padding[row, : len(problem.candidates)] = False
+    target_idxs = torch.tensor([text_idx[problem.target] for problem in problems])
+
+    # the embeddings are L2 normalized, the dot product is the cosine similarity
+    similarities = torch.matmul(embeddings[target_idxs.to(embeddings.device)], embeddings.T)  # [P, U]
+    similarities = similarities.cpu().gather(1, candidate_idxs).masked_fill(padding, float("-inf"))
+    best_scores, best_idxs = similarities.max(dim=1)
+
+    return [
+        BestMatching(text=problem.candidates[best_idx], score=best_score, index=best_idx)
+        for problem, best_idx, best_score in zip(problems, best_idxs.tolist(), best_scores.tolist())
+    ]
@@ -2,12 +2,21 @@ from typing import cast
 from transformers import CLIPProcessor, CLIPModel
 import torch
 
+from core.embedding.text_cache import TextEmbeddingCache
+
+# texts per forward pass, the activations of a request with thousands of texts stay bounded
+TEXT_CHUNK_SIZE = 256
+
 
 # we can added the labeled texts into a vecto db later
 def embed_text_list(
-    texts: list[str], model: CLIPModel, processor: CLIPProcessor
+    texts: list[str], model: CLIPModel, processor: CLIPProcessor, chunk_size: int = TEXT_CHUNK_SIZE
 ) -> torch.Tensor:
-    device = next(model.parameters()).device  # enforce that tensors would be in the same device as the model
+    """Embeds the texts in forward passes of at most `chunk_size`, a long list does not become one huge batch."""
+    if len(texts) > chunk_size:
+        chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+        return torch.cat([embed_text_list(chunk, model, processor, chunk_size) for chunk in chunks])
+    device = model.device  # enforce that tensors would be in the same device as the model
     
     text_inputs = processor(
         text=texts, return_tensors="pt", padding=True, truncation=True, max_length=77
@@ -31,4 +40,11 @@ def embed_text_list(
 
 
 def embed_text(text: str, model: CLIPModel, processor:CLIPProcessor) -> torch.Tensor:
-    return embed_text_list([text],model, processor)[0].unsqueeze(0)
\ No newline at end of file
+    return embed_text_list([text],model, processor)[0].unsqueeze(0)
+
+
+def embed_text_list_cached(
+    texts: list[str], model: CLIPModel, processor: CLIPProcessor, cache: TextEmbeddingCache
+) -> torch.Tensor:
+    """`embed_text_list` through the cache, only the texts missing from it reach the model."""
+    return cache.embed(texts, lambda misses: embed_text_list(misses, model, processor))
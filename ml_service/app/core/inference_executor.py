@@ -0,0 +1,83 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Iterator, TypeVar
+
+from utils.metrics import metrics
+
+T = TypeVar("T")
+
+
+class InferenceQueueFullError(RuntimeError):
+    """Raised when a request can not be admitted, the api answers 503 with Retry-After."""
+
+    def __init__(self, retry_after_s: int):
+        super().__init__("Inference queue is full, retry later.")
+        self.retry_after_s = retry_after_s
+
+
+class InferenceExecutor:
+    """
+    Runs the blocking torch inference out of the event loop, on a size limited thread pool.
+
+    Requests are admitted with `admit()` for their whole duration, at most `max_workers + max_queue`
+    requests are in the service at once, the next ones are rejected right away instead of piling up
+    until the caller times out.
+
+    Args:
+        max_workers (int): Threads running inference.
+        max_queue (int): Admitted requests allowed to wait for a thread.
+        retry_after_s (int): Value of the Retry-After header sent with the rejections.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int, retry_after_s: int = 1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._capacity = max_workers + max_queue
+        self._retry_after_s = retry_after_s
+        self._lock = Lock()
+        self._admitted = 0
+        self._pending = 0  # submitted to the pool, not started yet
+        self._running = 0
+
+        self._rejections = metrics.counter("inference_rejections_total")
+        metrics.gauge("inference_in_flight", lambda: self._admitted)
+        metrics.gauge("inference_running", lambda: self._running)
+        metrics.gauge("inference_queue_depth", lambda: self._pending)
+
+    @contextmanager
+    def admit(self) -> Iterator["InferenceExecutor"]:
+        with self._lock:
+            if self._admitted >= self._capacity:
+                self._rejections.inc()
+                raise InferenceQueueFullError(self._retry_after_s)
+            self._admitted += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Runs fn(*args, **kwargs) on the inference pool without blocking the event loop."""
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(self._call, fn, *args, **kwargs)
+        # a request cancelled while queued cancels its job, which then never reaches _call
+        future.add_done_callback(self._on_done)
+        return await asyncio.wrap_future(future)
+
+    def _on_done(self, future: Future) -> None:
+        if future.cancelled():
+            with self._lock:
+                self._pending -= 1
+
+    def _call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        with self._lock:
+            self._pending -= 1
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
@@ -1,37 +1,68 @@
 import torch
-from transformers import CLIPModel, CLIPProcessor
-from core.labelling.vocab import LABEL_DICTIONARY
-from core.embedding import text_to_vector
-from models.label import StructuredLabel
+from core.labelling.label_store import LabelEmbeddingStore
+from models.label import LabelScore, StructuredLabel
 
 
-def get_best_match_for_img(
-    img_vector: torch.Tensor, labels: list[str], labels_vector: torch.Tensor
-) -> str:
-    similarities = torch.matmul(img_vector, labels_vector.T)
-    best_idx = int(similarities.argmax(dim=1).item())
-    best_label = labels[best_idx]
+def rank_labels(
+    img_vectors: torch.Tensor, label_store: LabelEmbeddingStore, top_k: int
+) -> list[dict[str, list[LabelScore]]]:
+    """
+    Scores a batch of images against the whole vocabulary with one matmul, then takes the
+    top-k of each attribute segment of the scores.
 
-    return best_label
+    Args:
+        img_vectors (torch.Tensor): L2 normalized image embeddings with shape [N, D].
+        label_store (LabelEmbeddingStore): The embedded label vocabulary.
+        top_k (int): Labels kept per attribute, capped by the size of the attribute.
+
+    Returns:
+        list[dict[str, list[LabelScore]]]: For each image, attribute -> its top-k labels with their
+        cosine similarity, best first.
+    """
+    similarities = torch.matmul(img_vectors, label_store.vectors.T)  # [N, num_labels]
+
+    attributes = list(label_store.labels)
+    ks = [min(top_k, len(label_store.labels[attribute])) for attribute in attributes]
+    top = [
+        similarities[:, label_store.slices[attribute]].topk(k, dim=1)
+        for attribute, k in zip(attributes, ks)
+    ]
+    # a single device sync for the scores and one for the indexes, whatever the batch size
+    scores = torch.cat([values for values, _ in top], dim=1).tolist()
+    idxs = torch.cat([indices for _, indices in top], dim=1).tolist()
+
+    ranked = []
+    for row_scores, row_idxs in zip(scores, idxs):
+        image_ranking = {}
+        offset = 0
+        for attribute, k in zip(attributes, ks):
+            labels = label_store.labels[attribute]
+            image_ranking[attribute] = [
+                LabelScore(label=labels[idx], score=score)
+                for idx, score in zip(row_idxs[offset : offset + k], row_scores[offset : offset + k])
+            ]
+            offset += k
+        ranked.append(image_ranking)
+    return ranked
+
+
+def best_labels(ranking: dict[str, list[LabelScore]]) -> StructuredLabel:
+    return StructuredLabel(**{attribute: scores[0].label for attribute, scores in ranking.items()})
 
 
 def generate_structured_label(
-    img_vector: torch.Tensor, model: CLIPModel, processor: CLIPProcessor
+    img_vector: torch.Tensor, label_store: LabelEmbeddingStore
 ) -> StructuredLabel:
-    embedded_labels = {}
-
-    #this result we can storage in a cache or something for not needing to embed every time the call is make it
-    for label_type, label_list in LABEL_DICTIONARY.items():
-        embeddings = text_to_vector.embed_text_list(
-            texts=label_list, model=model, processor=processor
-        )
-        embedded_labels[label_type] = {"labels": label_list, "vectors": embeddings}
-    
-    #will comparate with all labels key(ex:category, style, color, pattern)
-    best_matches = {
-        key: get_best_match_for_img(
-            img_vector=img_vector, labels=value["labels"], labels_vector=value["vectors"]
-        )
-        for key, value in embedded_labels.items()
-    }
-    return StructuredLabel(**best_matches)
+    # the label vocabulary is embedded once at startup, here its only a matmul
+    return generate_structured_labels(img_vector, label_store)[0]
+
+
+def generate_structured_labels(
+    img_vectors: torch.Tensor, label_store: LabelEmbeddingStore
+) -> list[StructuredLabel]:
+    """Batched version of `generate_structured_label`, img_vectors has shape [N, D]."""
+    return [best_labels(ranking) for ranking in rank_labels(img_vectors, label_store, top_k=1)]
+
+
+def label_to_text(label: StructuredLabel) -> str:
+    return f"a {label.color} {label.pattern} {label.style} {label.category}"
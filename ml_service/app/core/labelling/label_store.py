@@ -0,0 +1,107 @@
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+import torch
+from transformers import CLIPModel, CLIPProcessor
+
+from core.embedding import text_to_vector
+from core.labelling import vocab
+from core.labelling.vocab import LABEL_DICTIONARY
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LabelEmbeddingStore:
+    """
+    Embeddings of the whole label vocabulary stacked in a single tensor.
+
+    Attributes:
+        labels (dict[str, list[str]]): attribute name (category, color...) -> its labels.
+        slices (dict[str, slice]): attribute name -> rows of `vectors` holding its labels.
+        vectors (torch.Tensor): L2 normalized label embeddings with shape [num_labels, D].
+    """
+
+    labels: dict[str, list[str]]
+    slices: dict[str, slice]
+    vectors: torch.Tensor
+
+    def attribute_vectors(self, attribute: str) -> torch.Tensor:
+        return self.vectors[self.slices[attribute]]
+
+    def to(self, device: torch.device) -> "LabelEmbeddingStore":
+        return LabelEmbeddingStore(self.labels, self.slices, self.vectors.to(device))
+
+
+def vocab_hash() -> str:
+    """Hash of vocab.py, any change in the vocabulary invalidates the persisted embeddings."""
+    return hashlib.sha256(Path(vocab.__file__).read_bytes()).hexdigest()
+
+
+def _build_slices(labels: dict[str, list[str]]) -> dict[str, slice]:
+    slices = {}
+    start = 0
+    for attribute, label_list in labels.items():
+        slices[attribute] = slice(start, start + len(label_list))
+        start += len(label_list)
+    return slices
+
+
+def build_label_store(model: CLIPModel, processor: CLIPProcessor) -> LabelEmbeddingStore:
+    labels = {attribute: list(label_list) for attribute, label_list in LABEL_DICTIONARY.items()}
+    all_labels = [label for label_list in labels.values() for label in label_list]
+
+    # one pass through the text tower for the whole vocabulary
+    vectors = text_to_vector.embed_text_list(texts=all_labels, model=model, processor=processor)
+    return LabelEmbeddingStore(labels=labels, slices=_build_slices(labels), vectors=vectors)
+
+
+def store_path(cache_dir: str | Path, model_name: str) -> Path:
+    safe_model_name = model_name.replace("/", "__")
+    return Path(cache_dir) / f"{safe_model_name}-{vocab_hash()[:16]}.pt"
+
+
+def load_or_build_label_store(
+    model: CLIPModel, processor: CLIPProcessor, model_name: str, cache_dir: str | Path
+) -> LabelEmbeddingStore:
+    """
+    Load the label embeddings persisted for this model and vocabulary, or build and persist them.
+
+    Args:
+        model (CLIPModel): The clip model, used only when the embeddings are not on disk.
+        processor (CLIPProcessor): The clip processor matching the model.
+        model_name (str): Name of the model, part of the cache key.
+        cache_dir (str | Path): Directory where the embeddings are persisted.
+
+    Returns:
+        LabelEmbeddingStore: The store, with vectors on the same device as the model.
+    """
+    device = model.device
+    path = store_path(cache_dir, model_name)
+
+    if path.exists():
+        try:
+            data = torch.load(path, map_location="cpu", weights_only=True)
+            labels = data["labels"]
+            logger.info(f"Loaded label embeddings from {path}")
+            return LabelEmbeddingStore(
+                labels=labels, slices=_build_slices(labels), vectors=data["vectors"]
+            ).to(device)
+        except Exception as e:
+            # a corrupted file should not stop the service, we just rebuild it
+            logger.warning(f"Could not load label embeddings from {path}, rebuilding: {e}")
+
+    store = build_label_store(model, processor)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        torch.save({"labels": store.labels, "vectors": store.vectors.cpu()}, tmp_path)
+        tmp_path.replace(path)  # atomic, concurrent workers never read a half written file
+        logger.info(f"Persisted label embeddings to {path}")
+    except OSError as e:
+        logger.warning(f"Could not persist label embeddings to {path}: {e}")
+
+    return store
@@ -0,0 +1,218 @@
+"""
+Offline model bundles, the service cold starts from a local directory without the Hugging Face hub.
+
+A bundle is a versioned directory:
+
+    bundle-<version>/
+        manifest.json       sources, paths and the sha256 of every file
+        yolo/best.pt
+        clip/               CLIPModel (safetensors, memory mapped at load) + CLIPProcessor files
+
+The version is derived from the checksums, two bundles of the same weights get the same version.
+Set MODEL_BUNDLE_DIR to serve from a bundle, nothing is downloaded then.
+
+Run from ml_service/app:
+    python -m core.model_bundle build --out /models      builds /models/bundle-<version>
+    python -m core.model_bundle verify /models/bundle-<version>
+    python -m core.model_bundle bench /models/bundle-<version>   load times, bundle vs hub
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+BUNDLE_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+YOLO_WEIGHTS = "yolo/best.pt"
+CLIP_DIR = "clip"
+
+
+class BundleError(RuntimeError):
+    pass
+
+
+@dataclass
+class BundleManifest:
+    version: str
+    yolo_repo: str
+    clip_model_name: str
+    files: dict[str, str]  # path relative to the bundle -> sha256
+    created_at: str
+
+    @property
+    def clip_dir(self) -> str:
+        return CLIP_DIR
+
+    @property
+    def yolo_weights(self) -> str:
+        return YOLO_WEIGHTS
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _checksums(bundle_dir: Path) -> dict[str, str]:
+    return {
+        str(path.relative_to(bundle_dir)): _sha256(path)
+        for path in sorted(bundle_dir.rglob("*"))
+        if path.is_file() and path.name != MANIFEST_NAME
+    }
+
+
+def build_bundle(out_dir: str | Path, yolo_repo: str, clip_model_name: str) -> Path:
+    """
+    Downloads the weights, saves CLIP as safetensors and writes the manifest with the checksums.
+
+    Returns:
+        Path: The bundle directory, `out_dir/bundle-<version>`.
+    """
+    from huggingface_hub import hf_hub_download
+    from transformers import CLIPModel, CLIPProcessor
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    # built next to its final place, the rename is atomic and a half built bundle is never visible
+    tmp_dir = Path(tempfile.mkdtemp(prefix=".bundle-", dir=out_dir))
+    try:
+        (tmp_dir / YOLO_WEIGHTS).parent.mkdir(parents=True)
+        shutil.copyfile(hf_hub_download(yolo_repo, "best.pt"), tmp_dir / YOLO_WEIGHTS)
+
+        clip_model = CLIPModel.from_pretrained(clip_model_name)
+        clip_model.save_pretrained(tmp_dir / CLIP_DIR, safe_serialization=True)
+        CLIPProcessor.from_pretrained(clip_model_name).save_pretrained(tmp_dir / CLIP_DIR)  # type: ignore[union-attr]
+
+        files = _checksums(tmp_dir)
+        version = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()[:12]
+        manifest = {
+            "format": BUNDLE_FORMAT,
+            "version": version,
+            "yolo_repo": yolo_repo,
+            "clip_model_name": clip_model_name,
+            "files": files,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+        (tmp_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+
+        # mkdtemp creates the dir 0700, the bundle is read by the service user, not only by its builder
+        tmp_dir.chmod(0o755)
+        bundle_dir = out_dir / f"bundle-{version}"
+        if bundle_dir.exists():
+            shutil.rmtree(tmp_dir)  # same weights, already bundled
+        else:
+            os.rename(tmp_dir, bundle_dir)
+        return bundle_dir
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def load_manifest(bundle_dir: str | Path) -> BundleManifest:
+    path = Path(bundle_dir) / MANIFEST_NAME
+    try:
+        data = json.loads(path.read_text())
+    except (OSError, ValueError) as e:
+        raise BundleError(f"Could not read the bundle manifest {path}: {e}") from e
+    if data.get("format") != BUNDLE_FORMAT:
+        raise BundleError(f"Unsupported bundle format {data.get('format')} in {path}")
+    return BundleManifest(
+        version=data["version"],
+        yolo_repo=data["yolo_repo"],
+        clip_model_name=data["clip_model_name"],
+        files=data["files"],
+        created_at=data["created_at"],
+    )
+
+
+def verify_bundle(bundle_dir: str | Path) -> BundleManifest:
+    """Checks every file against the manifest, raises BundleError on a missing or corrupted file."""
+    bundle_dir = Path(bundle_dir)
+    manifest = load_manifest(bundle_dir)
+    for relative_path, expected in manifest.files.items():
+        path = bundle_dir / relative_path
+        if not path.is_file():
+            raise BundleError(f"Missing bundle file {path}")
+        if _sha256(path) != expected:
+            raise BundleError(f"Checksum mismatch for {path}")
+    return manifest
+
+
+def bench_load_times(bundle_dir: Path, repeat: int) -> None:
+    import torch
+    from huggingface_hub import hf_hub_download
+    from transformers import CLIPModel, CLIPProcessor
+
+    from core.cloth_detection.yolo import load_yolo
+
+    manifest = load_manifest(bundle_dir)
+    cpu = torch.device("cpu")
+
+    def from_hub():
+        load_yolo(hf_hub_download(manifest.yolo_repo, "best.pt"), cpu)
+        CLIPModel.from_pretrained(manifest.clip_model_name)
+        CLIPProcessor.from_pretrained(manifest.clip_model_name)
+
+    def from_bundle():
+        load_yolo(str(bundle_dir / manifest.yolo_weights), cpu)
+        CLIPModel.from_pretrained(bundle_dir / manifest.clip_dir, local_files_only=True)
+        CLIPProcessor.from_pretrained(bundle_dir / manifest.clip_dir, local_files_only=True)
+
+    def timed(fn) -> float:
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+    from_hub()  # the first hub load may download, the comparison is against a warm hub cache
+    print(f"{'source':<8} {'best':>8} {'mean':>8}")
+    for name, fn in (("hub", from_hub), ("bundle", from_bundle)):
+        times = [timed(fn) for _ in range(repeat)]
+        print(f"{name:<8} {min(times):>7.2f}s {sum(times) / len(times):>7.2f}s")
+    start = time.perf_counter()
+    verify_bundle(bundle_dir)
+    print(f"checksum verification {time.perf_counter() - start:.2f}s")
+
+
+def main() -> None:
+    from core.config import settings
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="download the weights into a new bundle")
+    build.add_argument("--out", required=True)
+    build.add_argument("--yolo-repo", default=settings.YOLO_MODEL_REPO)
+    build.add_argument("--clip-model", default=settings.CLIP_MODEL_NAME)
+    verify = commands.add_parser("verify", help="check the checksums of a bundle")
+    verify.add_argument("bundle_dir")
+    bench = commands.add_parser("bench", help="load times from the bundle vs from the hub")
+    bench.add_argument("bundle_dir")
+    bench.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        bundle_dir = build_bundle(args.out, args.yolo_repo, args.clip_model)
+        manifest = load_manifest(bundle_dir)
+        size = sum((bundle_dir / path).stat().st_size for path in manifest.files)
+        print(f"Bundle {manifest.version} written to {bundle_dir} ({len(manifest.files)} files, {size / 1e6:.0f}MB)")
+    elif args.command == "verify":
+        try:
+            manifest = verify_bundle(args.bundle_dir)
+        except BundleError as e:
+            raise SystemExit(str(e))
+        print(f"Bundle {manifest.version} is valid ({len(manifest.files)} files)")
+    else:
+        bench_load_times(Path(args.bundle_dir), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""
+ONNX Runtime backend for CPU serving, selected with settings.MODEL_BACKEND = "onnx".
+
+The CLIP image and text towers are exported to two onnx graphs and served by `OnnxClipModel`,
+which has the part of the CLIPModel interface the service uses (`get_image_features`,
+`get_text_features`, `device`), so the embedding, labelling and batching code does not change.
+YOLO is exported with ultralytics, which serves onnx weights with ONNX Runtime itself.
+Graphs exported at startup go through the same accuracy check (`verify_export`), the service keeps
+the torch models when it fails.
+
+Export (plus the accuracy check against the torch embeddings), run from ml_service/app:
+    python -m core.onnx_backend [--quantize] [--threshold 0.99]
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from threading import Lock
+
+import torch
+from transformers import CLIPModel, CLIPProcessor
+
+logger = logging.getLogger(__name__)
+
+ONNX_OPSET = 17
+
+
+class OnnxExportError(RuntimeError):
+    pass
+
+
+def export_key(clip_model_name: str, clip_weights_source: str, yolo_weights_path: str, imgsz: int) -> str:
+    """
+    Hash of everything the exported graphs depend on: the CLIP weights, the checksum of the YOLO
+    weights, the YOLO input size and the opset. Any change gets its own directory, exported again.
+    """
+    yolo_digest = hashlib.sha256()
+    with open(yolo_weights_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            yolo_digest.update(chunk)
+    parts = [clip_model_name, clip_weights_source, yolo_digest.hexdigest(), str(imgsz), str(ONNX_OPSET)]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:12]
+
+
+def onnx_model_dir(base_dir: str | Path, model_name: str, key: str) -> Path:
+    return Path(base_dir) / f"{model_name.replace('/', '__')}-{key}"
+
+
+def onnx_paths(model_dir: Path, quantize: bool) -> dict[str, Path]:
+    """Paths of the clip image tower, clip text tower and yolo graphs, `.int8` ones when quantized."""
+    suffix = ".int8.onnx" if quantize else ".onnx"
+    return {name: model_dir / f"{name}{suffix}" for name in ("clip_image", "clip_text", "yolo")}
+
+
+class _ClipImageTower(torch.nn.Module):
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        return self.model.get_image_features(pixel_values=pixel_values)
+
+
+class _ClipTextTower(torch.nn.Module):
+    def __init__(self, model: CLIPModel):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        return self.model.get_text_features(input_ids=input_ids, attention_mask=attention_mask)
+
+
+def _export_atomic(export_fn, path: Path) -> None:
+    # the service may be starting in other processes, they never see a half written graph
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    export_fn(tmp_path)
+    tmp_path.replace(path)
+
+
+def quantize_int8(src: Path, dst: Path) -> None:
+    """Dynamic int8 quantization, weights are stored in int8 and activations quantized on the fly."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    _export_atomic(lambda tmp: quantize_dynamic(str(src), str(tmp), weight_type=QuantType.QInt8), dst)
+
+
+def export_clip(model: CLIPModel, processor: CLIPProcessor, model_dir: Path) -> tuple[Path, Path]:
+    """Exports the fp32 image and text towers, with dynamic batch (and sequence) axes."""
+    model_dir.mkdir(parents=True, exist_ok=True)
+    paths = onnx_paths(model_dir, quantize=False)
+    model = model.to("cpu").eval()
+
+    pixel_values = torch.zeros(1, 3, 224, 224)
+    text_inputs = processor(text=["a red shirt"], return_tensors="pt", padding=True)
+
+    with torch.no_grad():
+        _export_atomic(
+            lambda tmp: torch.onnx.export(
+                _ClipImageTower(model),
+                (pixel_values,),
+                str(tmp),
+                input_names=["pixel_values"],
+                output_names=["image_embeds"],
+                dynamic_axes={"pixel_values": {0: "batch"}, "image_embeds": {0: "batch"}},
+                opset_version=ONNX_OPSET,
+            ),
+            paths["clip_image"],
+        )
+        _export_atomic(
+            lambda tmp: torch.onnx.export(
+                _ClipTextTower(model),
+                (text_inputs["input_ids"], text_inputs["attention_mask"]),
+                str(tmp),
+                input_names=["input_ids", "attention_mask"],
+                output_names=["text_embeds"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "text_embeds": {0: "batch"},
+                },
+                opset_version=ONNX_OPSET,
+            ),
+            paths["clip_text"],
+        )
+    return paths["clip_image"], paths["clip_text"]
+
+
+def export_yolo(weights_path: str, model_dir: Path, imgsz: int) -> Path:
+    """
+    Exports the detector with a dynamic batch axis. Ultralytics writes the graph next to the weights,
+    so they are copied to a temporary directory of `model_dir` first, the hub cache or the bundle
+    may be mounted read only.
+    """
+    from core.cloth_detection.yolo import load_yolo
+
+    model_dir.mkdir(parents=True, exist_ok=True)
+    path = onnx_paths(model_dir, quantize=False)["yolo"]
+    with tempfile.TemporaryDirectory(dir=model_dir) as tmp_dir:
+        local_weights = Path(tmp_dir) / Path(weights_path).name
+        shutil.copyfile(weights_path, local_weights)
+        yolo = load_yolo(str(local_weights), torch.device("cpu"))
+        exported = yolo.export(format="onnx", dynamic=True, imgsz=imgsz, opset=ONNX_OPSET, simplify=False)
+        if not exported:
+            raise OnnxExportError(f"Could not export {weights_path} to onnx")
+        _export_atomic(lambda tmp: shutil.move(str(exported), tmp), path)
+    return path
+
+
+def export_all(
+    clip_model: CLIPModel,
+    clip_processor: CLIPProcessor,
+    yolo_weights_path: str,
+    model_dir: Path,
+    imgsz: int,
+    quantize: bool,
+) -> dict[str, Path]:
+    """Exports the three graphs (and their int8 versions when `quantize`), returns the paths to serve."""
+    export_clip(clip_model, clip_processor, model_dir)
+    export_yolo(yolo_weights_path, model_dir, imgsz)
+
+    fp32_paths = onnx_paths(model_dir, quantize=False)
+    if not quantize:
+        return fp32_paths
+
+    int8_paths = onnx_paths(model_dir, quantize=True)
+    for name, path in fp32_paths.items():
+        quantize_int8(path, int8_paths[name])
+    return int8_paths
+
+
+def _create_session(path: Path, intra_op_threads: int | None):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = intra_op_threads or torch.get_num_threads()
+    options.inter_op_num_threads = 1
+    return ort.InferenceSession(str(path), sess_options=options, providers=["CPUExecutionProvider"])
+
+
+class OnnxClipModel:
+    """
+    CLIP towers served by ONNX Runtime, a drop in for the CLIPModel methods used by the service.
+
+    The sessions are created lazily, per process: ONNX Runtime thread pools do not survive a fork,
+    so with the preloading gunicorn server each worker opens its own sessions, sized with the
+    torch thread budget of the worker when `intra_op_threads` is None.
+
+    Args:
+        image_path (Path): Graph of the image tower.
+        text_path (Path): Graph of the text tower.
+        intra_op_threads (int | None): Threads per session.
+    """
+
+    device = torch.device("cpu")
+
+    def __init__(self, image_path: Path, text_path: Path, intra_op_threads: int | None = None):
+        self.image_path = image_path
+        self.text_path = text_path
+        self.intra_op_threads = intra_op_threads
+        self._lock = Lock()
+        self._pid: int | None = None
+        self._image_session = None
+        self._text_session = None
+
+    def _sessions(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._image_session = _create_session(self.image_path, self.intra_op_threads)
+                    self._text_session = _create_session(self.text_path, self.intra_op_threads)
+                    self._pid = os.getpid()
+        return self._image_session, self._text_session
+
+    def get_image_features(self, pixel_values: torch.Tensor) -> torch.Tensor:
+        image_session, _ = self._sessions()
+        outputs = image_session.run(None, {"pixel_values": pixel_values.cpu().float().numpy()})
+        return torch.from_numpy(outputs[0])
+
+    def get_text_features(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> torch.Tensor:
+        _, text_session = self._sessions()
+        outputs = text_session.run(
+            None,
+            {
+                "input_ids": input_ids.cpu().long().numpy(),
+                "attention_mask": attention_mask.cpu().long().numpy(),
+            },
+        )
+        return torch.from_numpy(outputs[0])
+
+
+def check_accuracy(
+    torch_model: CLIPModel,
+    onnx_model: OnnxClipModel,
+    processor: CLIPProcessor,
+    images: list,
+    texts: list[str],
+) -> dict[str, float]:
+    """
+    Cosine similarity between the torch and the onnx embeddings of the same inputs.
+
+    Returns:
+        dict[str, float]: min and mean cosine for the image and the text towers.
+    """
+    from core.embedding import img_to_vector, text_to_vector
+
+    pixel_values = img_to_vector.preprocess(images, processor)
+    image_cos = torch.nn.functional.cosine_similarity(
+        img_to_vector.embed_pixel_values(pixel_values, torch_model).cpu(),
+        img_to_vector.embed_pixel_values(pixel_values, onnx_model),  # type: ignore[arg-type]
+    )
+    text_cos = torch.nn.functional.cosine_similarity(
+        text_to_vector.embed_text_list(texts, torch_model, processor).cpu(),
+        text_to_vector.embed_text_list(texts, onnx_model, processor),  # type: ignore[arg-type]
+    )
+    return {
+        "image_min": image_cos.min().item(),
+        "image_mean": image_cos.mean().item(),
+        "text_min": text_cos.min().item(),
+        "text_mean": text_cos.mean().item(),
+    }
+
+
+def verify_export(
+    torch_model: CLIPModel, onnx_model: OnnxClipModel, processor: CLIPProcessor, min_cosine: float
+) -> dict[str, float]:
+    """
+    Accuracy check of freshly exported CLIP graphs on random images and the label sentences.
+
+    Raises:
+        OnnxExportError: The min cosine of the image or the text tower is below `min_cosine`.
+    """
+    from PIL import Image
+
+    from core.labelling.vocab import LABEL_DICTIONARY
+
+    generator = torch.Generator().manual_seed(0)
+    images = [
+        Image.fromarray(torch.randint(0, 256, (height, width, 3), dtype=torch.uint8, generator=generator).numpy())
+        for width, height in ((224, 224), (180, 320), (400, 260), (48, 96))
+    ]
+    texts = [label for labels in LABEL_DICTIONARY.values() for label in labels]
+    scores = check_accuracy(torch_model, onnx_model, processor, images, texts)
+    if min(scores["image_min"], scores["text_min"]) < min_cosine:
+        raise OnnxExportError(
+            "Accuracy check failed, " + ", ".join(f"{name} cosine {value:.4f}" for name, value in scores.items())
+        )
+    return scores
+
+
+def main() -> None:
+    from huggingface_hub import hf_hub_download
+
+    from benchmarks.crop_transport import random_crops, synthetic_photo
+    from core.config import settings
+    from core.labelling.vocab import LABEL_DICTIONARY
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quantize", action="store_true", default=settings.ONNX_QUANTIZE)
+    parser.add_argument("--threshold", type=float, default=settings.ONNX_MIN_COSINE)
+    parser.add_argument("--out", default=settings.ONNX_MODEL_DIR)
+    args = parser.parse_args()
+
+    clip_model = CLIPModel.from_pretrained(settings.CLIP_MODEL_NAME).eval()  # type: ignore
+    clip_processor = CLIPProcessor.from_pretrained(settings.CLIP_MODEL_NAME)
+    yolo_weights = hf_hub_download(settings.YOLO_MODEL_REPO, "best.pt")
+    key = export_key(settings.CLIP_MODEL_NAME, "hub", yolo_weights, settings.YOLO_IMGSZ)
+    model_dir = onnx_model_dir(args.out, settings.CLIP_MODEL_NAME, key)
+    paths = export_all(
+        clip_model,
+        clip_processor,  # type: ignore[arg-type]
+        yolo_weights,
+        model_dir,
+        imgsz=settings.YOLO_IMGSZ,
+        quantize=args.quantize,
+    )
+    for name, path in paths.items():
+        print(f"{name:<10} {path} ({path.stat().st_size / 1e6:.1f}MB)")
+
+    images = random_crops(synthetic_photo(), count=16)
+    texts = [label for labels in LABEL_DICTIONARY.values() for label in labels]
+    onnx_model = OnnxClipModel(paths["clip_image"], paths["clip_text"])
+    scores = check_accuracy(clip_model, onnx_model, clip_processor, images, texts)  # type: ignore[arg-type]
+    print(", ".join(f"{name} cosine {value:.4f}" for name, value in scores.items()))
+
+    if min(scores["image_min"], scores["text_min"]) < args.threshold:
+        raise SystemExit(f"Accuracy check failed, min cosine is below {args.threshold}")
+    print(f"Accuracy check passed (min cosine >= {args.threshold})")
+
+
+if __name__ == "__main__":
+    main()
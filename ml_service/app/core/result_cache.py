@@ -0,0 +1,175 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from threading import Lock, local
+
+from cachetools import LRUCache
+
+from core.config import settings
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _DiskResults:
+    """
+    Disk tier of the result cache, one SQLite file shared by the workers of the service. Results
+    range from a few KB of JSON (labels, boxes) to a few MB (/crop_clothes bodies, the base64 crops
+    of /detect_and_label), one row each instead of one file each. The total size is kept in the
+    database next to them, so a put costs a couple of indexed statements whatever the number of
+    cached results. Only when a put goes over the limit are the least recently used rows deleted,
+    just enough to get down to EVICT_TO of the limit, so the next puts don't evict again. A result
+    bigger than that headroom is not stored, it would flush many smaller ones.
+    """
+
+    EVICT_TO = 0.9
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self._path = Path(cache_dir) / "results.sqlite3"
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        # sqlite connections can't be shared across threads, nor inherited through a fork
+        self._local = local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)"
+            )
+            conn.execute("INSERT OR IGNORE INTO stats VALUES (0, (SELECT COALESCE(SUM(size), 0) FROM results))")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT data FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            # mark as recently used for the eviction
+            conn.execute("UPDATE results SET used_at = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read result {key} from the disk cache: {e}")
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self._max_bytes * (1 - self.EVICT_TO):
+            return
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute("SELECT size FROM results WHERE key = ?", (key,)).fetchone()
+                conn.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (key, data, len(data), time.time())
+                )
+                conn.execute("UPDATE stats SET size = size + ? WHERE id = 0", (len(data) - (row[0] if row else 0),))
+                (size,) = conn.execute("SELECT size FROM stats WHERE id = 0").fetchone()
+                if size > self._max_bytes:
+                    self._evict(conn, size)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write result {key} to the disk cache: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, size: int) -> None:
+        to_free = size - self._max_bytes * self.EVICT_TO
+        keys, freed = [], 0
+        # walks the used_at index oldest first and stops as soon as enough is freed
+        for key, row_size in conn.execute("SELECT key, size FROM results ORDER BY used_at"):
+            if freed >= to_free:
+                break
+            keys.append((key,))
+            freed += row_size
+        conn.executemany("DELETE FROM results WHERE key = ?", keys)
+        conn.execute("UPDATE stats SET size = size - ? WHERE id = 0", (freed,))
+
+
+class ResultCache:
+    """
+    Inference results keyed by the sha256 of the image bytes plus the model version and the
+    endpoint parameters, so byte identical images (task retries, re-submitted query images,
+    re-indexed products) are answered without running the models again.
+
+    Two tiers, an in memory LRU bounded by bytes, and an optional disk tier (_DiskResults) bounded
+    by bytes that evicts the least recently used results first. Values are the serialized responses.
+    """
+
+    def __init__(self, max_bytes: int, cache_dir: str | None, disk_max_bytes: int):
+        self._memory: LRUCache = LRUCache(maxsize=max_bytes, getsizeof=len)
+        self._lock = Lock()
+        self._disk = _DiskResults(cache_dir, disk_max_bytes) if cache_dir else None
+
+        self._hits = metrics.counter("result_cache_hits_total")
+        self._misses = metrics.counter("result_cache_misses_total")
+        # bytes of the images answered from the cache, they were never decoded nor run through the models
+        self._bytes_saved = metrics.counter("result_cache_image_bytes_saved_total")
+        metrics.gauge("result_cache_hit_ratio", self.hit_ratio)
+        metrics.gauge("result_cache_memory_bytes", lambda: self._memory.currsize)
+
+    @staticmethod
+    def key(img_data: bytes, *parts: str) -> str:
+        """Hash of the image bytes and of the parts (model version, endpoint, parameters)."""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part.encode())
+            digest.update(b"\0")
+        digest.update(img_data)
+        return digest.hexdigest()
+
+    def hit_ratio(self) -> float:
+        lookups = self._hits.value + self._misses.value
+        return self._hits.value / lookups if lookups else 0.0
+
+    def lookup(self, img_data: bytes, *parts: str) -> tuple[str, bytes | None]:
+        """Returns the key of the image and its cached result, None on a miss."""
+        key = self.key(img_data, *parts)
+        data = self.get(key)
+        if data is None:
+            self._misses.inc()
+        else:
+            self._hits.inc()
+            self._bytes_saved.inc(len(img_data))
+        return key, data
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._memory.get(key)
+        if data is not None:
+            return data
+
+        if not self._disk:
+            return None
+        data = self._disk.get(key)
+        if data is not None:
+            self._put_memory(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        self._put_memory(key, data)
+        if self._disk:
+            self._disk.put(key, data)
+
+    def _put_memory(self, key: str, data: bytes) -> None:
+        if len(data) > self._memory.maxsize:
+            return
+        with self._lock:
+            self._memory[key] = data
+
+
+result_cache = ResultCache(
+    max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+    cache_dir=settings.RESULT_CACHE_DIR,
+    disk_max_bytes=settings.RESULT_CACHE_DISK_MAX_BYTES,
+)
@@ -0,0 +1,58 @@
+from threading import Lock
+import boto3
+from botocore.client import Config
+from botocore.exceptions import BotoCoreError, ClientError
+from core.config import settings
+
+
+class StorageNotConfiguredError(RuntimeError):
+    pass
+
+
+class ObjectNotFoundError(LookupError):
+    pass
+
+
+_lock = Lock()
+_s3_client = None
+
+
+def get_s3_client():
+    # one client per process, boto3 clients are thread safe and keep a pool of connections
+    global _s3_client
+    if not settings.S3_ENDPOINT_URL:
+        raise StorageNotConfiguredError("S3 storage is not configured in the ml_service")
+    if _s3_client is None:
+        with _lock:
+            if _s3_client is None:
+                _s3_client = boto3.client(
+                    "s3",
+                    endpoint_url=settings.S3_ENDPOINT_URL,
+                    aws_access_key_id=settings.S3_ACCESS_KEY,
+                    aws_secret_access_key=settings.S3_SECRET_KEY,
+                    config=Config(
+                        signature_version="s3v4",
+                        max_pool_connections=settings.S3_MAX_POOL_CONNECTIONS,
+                    ),
+                )
+    return _s3_client
+
+
+def read_object(bucket: str, key: str) -> bytes:
+    """
+    Reads an object from S3/MinIO into memory.
+
+    Raises:
+        StorageNotConfiguredError: If the S3 settings are missing.
+        ObjectNotFoundError: If the object does not exist.
+        RuntimeError: If the download fails due to AWS/Boto errors.
+    """
+    try:
+        res = get_s3_client().get_object(Bucket=bucket, Key=key)
+        return res["Body"].read()
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "NoSuchBucket"):
+            raise ObjectNotFoundError(f"s3://{bucket}/{key} not found") from e
+        raise RuntimeError(f"Failed to read s3://{bucket}/{key}: {e}") from e
+    except BotoCoreError as e:
+        raise RuntimeError(f"Failed to read s3://{bucket}/{key}: {e}") from e
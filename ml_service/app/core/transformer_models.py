@@ -1,52 +1,234 @@
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
 
 import torch
 from huggingface_hub import hf_hub_download
+from PIL import Image
 from ultralytics import YOLO
 from transformers import CLIPProcessor, CLIPModel
-from ultralytics.nn.tasks import DetectionModel
-from ultralytics.nn.modules import (Conv, C2f, Bottleneck, SPPF, Concat, Detect, DFL)
-from torch.nn import (Sequential, Conv2d, SiLU, BatchNorm2d, MaxPool2d,
-                      AdaptiveAvgPool2d, Linear, ModuleList, Upsample)
-
-# --- Best Practice: Define the device once ---
-# This will automatically use the GPU if available, otherwise fall back to CPU.
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print(f"--- ML Service: Models will be loaded on device: {device} ---")
-
-# --- Load YOLO Model (requires safe_globals) ---
-local_yolo_path = hf_hub_download("kesimeg/yolov8n-clothing-detection", "best.pt")
-FASHION_MODEL_NAME = "patrickjohncyh/fashion-clip"
-
-# --- Define ALL the classes that are safe to unpickle ---
-safe_classes = [
-    # Standard PyTorch Modules
-    Sequential, Conv2d, SiLU, BatchNorm2d, MaxPool2d, AdaptiveAvgPool2d, Linear,
-    # Custom Ultralytics Modules
-    DetectionModel,
-    Conv,
-    C2f,
-    Bottleneck,
-    SPPF,
-    Concat,
-    Detect,
-    ModuleList,
-    Upsample,
-    DFL
-]
-
-# Load YOLO model with safe_globals context
-with torch.serialization.safe_globals(safe_classes):
-    yolo_model = YOLO(local_yolo_path).to(device)
-    print(f"YOLO model to ${device} succeeded")
-
-# --- Load CLIP Model (does NOT require safe_globals) ---
-try:
-    clip_model = CLIPModel.from_pretrained(FASHION_MODEL_NAME).to(device) # type: ignore
-    print(f"CLIP model  to ${device} succeeded")
-    clip_processor = CLIPProcessor.from_pretrained(FASHION_MODEL_NAME)
+from core.config import settings
+from core.labelling.label_store import LabelEmbeddingStore, load_or_build_label_store, vocab_hash
+from core.cloth_detection.yolo import DETECTION_CONFIDENCE, detect_clothes, detect_clothes_batch, load_yolo
+from core.embedding import img_to_vector, text_to_vector
+from core.embedding.clip_preprocess import ClipImagePreprocessor
+from core.embedding.text_cache import TextEmbeddingCache
+from core.onnx_backend import (
+    OnnxClipModel,
+    OnnxExportError,
+    export_all,
+    export_key,
+    onnx_model_dir,
+    onnx_paths,
+    verify_export,
+)
+from core.model_bundle import BundleManifest, load_manifest, verify_bundle
+
+logger = logging.getLogger(__name__)
+
+YOLO_MODEL_REPO = settings.YOLO_MODEL_REPO
+FASHION_MODEL_NAME = settings.CLIP_MODEL_NAME
+
+
+@dataclass
+class ModelRegistry:
+    """
+    The models of the service, filled by `load_models` (in the FastAPI lifespan, or in the gunicorn
+    master when the app is preloaded) and read by the endpoints at request time.
+
+    Attributes:
+        load_times (dict[str, float]): Seconds spent loading each model, reported by /health/ready.
+        warmup_s (float | None): Seconds spent in the warmup pass.
+        ready (bool): Models loaded and warmed up, the service can take traffic.
+        error (str | None): Why the loading failed.
+    """
+
+    device: torch.device = field(default_factory=lambda: torch.device("cuda" if torch.cuda.is_available() else "cpu"))
+    yolo_model: YOLO = None  # type: ignore[assignment]
+    clip_model: CLIPModel = None  # type: ignore[assignment]
+    clip_processor: CLIPProcessor = None  # type: ignore[assignment]
+    clip_preprocessor: ClipImagePreprocessor = None  # type: ignore[assignment]
+    yolo_model_repo: str = YOLO_MODEL_REPO
+    clip_model_name: str = FASHION_MODEL_NAME
+    clip_model_id: str = FASHION_MODEL_NAME  # clip_model_name + backend, keys the caches of its vectors
+    weights_source: str = "hub"  # or "bundle <version>"
+    label_store: LabelEmbeddingStore = None  # type: ignore[assignment]
+    text_embedding_cache: TextEmbeddingCache = None  # type: ignore[assignment]
+    model_version: str = ""
+
+    load_times: dict[str, float] = field(default_factory=dict)
+    warmup_s: float | None = None
+    loaded: bool = False
+    ready: bool = False
+    error: str | None = None
+
+
+ml_models = ModelRegistry()
+
+
+def _timed(name: str, load_fn):
+    start = time.perf_counter()
+    result = load_fn()
+    ml_models.load_times[name] = round(time.perf_counter() - start, 3)
+    logger.info(f"{name} loaded on {ml_models.device} in {ml_models.load_times[name]}s")
+    return result
+
+
+def _load_yolo(bundle: BundleManifest | None) -> tuple[YOLO, str]:
+    if bundle is None:
+        local_yolo_path = hf_hub_download(YOLO_MODEL_REPO, "best.pt")
+    else:
+        local_yolo_path = str(Path(settings.MODEL_BUNDLE_DIR) / bundle.yolo_weights)  # type: ignore[arg-type]
+    return load_yolo(local_yolo_path, ml_models.device), local_yolo_path
+
+
+def _load_clip(bundle: BundleManifest | None) -> tuple[CLIPModel, CLIPProcessor]:
+    if bundle is None:
+        source, local_files_only = FASHION_MODEL_NAME, False
+    else:
+        # safetensors, memory mapped, and no request to the hub
+        source, local_files_only = Path(settings.MODEL_BUNDLE_DIR) / bundle.clip_dir, True  # type: ignore[arg-type]
+    clip_model = CLIPModel.from_pretrained(source, local_files_only=local_files_only).to(ml_models.device)  # type: ignore
+    clip_processor = CLIPProcessor.from_pretrained(source, local_files_only=local_files_only)
     if isinstance(clip_processor, tuple):
         clip_processor = clip_processor[0]
-    print("CLIP model and processor loaded successfully")
-except Exception as e:
-    print(f"Error loading CLIP model: {e}")
-    raise
\ No newline at end of file
+    return clip_model, clip_processor
+
+
+def _use_onnx_backend(local_yolo_path: str) -> None:
+    # the torch models are only used to export (and check) the graphs when they are missing
+    key = export_key(ml_models.clip_model_name, ml_models.weights_source, local_yolo_path, settings.YOLO_IMGSZ)
+    onnx_dir = onnx_model_dir(settings.ONNX_MODEL_DIR, ml_models.clip_model_name, key)
+    onnx_files = onnx_paths(onnx_dir, quantize=settings.ONNX_QUANTIZE)
+    exported = not all(path.exists() for path in onnx_files.values())
+    if exported:
+        logger.info(f"Exporting the models to onnx in {onnx_dir}")
+        onnx_files = export_all(
+            ml_models.clip_model,
+            ml_models.clip_processor,
+            local_yolo_path,
+            onnx_dir,
+            imgsz=settings.YOLO_IMGSZ,
+            quantize=settings.ONNX_QUANTIZE,
+        )
+    onnx_clip = OnnxClipModel(onnx_files["clip_image"], onnx_files["clip_text"])
+    if exported:
+        try:
+            scores = verify_export(ml_models.clip_model, onnx_clip, ml_models.clip_processor, settings.ONNX_MIN_COSINE)
+        except OnnxExportError as e:
+            # removed so the next start exports (and checks) again instead of serving them unchecked
+            for path in onnx_files.values():
+                path.unlink(missing_ok=True)
+            logger.error(f"{e}, serving the torch models")
+            return
+        logger.info("Onnx export checked, " + ", ".join(f"{name} cosine {value:.4f}" for name, value in scores.items()))
+    ml_models.yolo_model = load_yolo(str(onnx_files["yolo"]), ml_models.device)
+    ml_models.clip_model = onnx_clip  # type: ignore[assignment]
+    # the onnx (and int8) embeddings are close to, not equal to, the torch ones, they get their own label store,
+    # and the export key names the graphs in model_version
+    ml_models.clip_model_id = f"{ml_models.clip_model_name}-onnx-{key}{'-int8' if settings.ONNX_QUANTIZE else ''}"
+    logger.info(f"Serving the models with ONNX Runtime from {onnx_dir} (int8={settings.ONNX_QUANTIZE})")
+
+
+def load_models() -> ModelRegistry:
+    """
+    Loads YOLO and CLIP in parallel, then the label embeddings. Does nothing when already loaded,
+    so the gunicorn master can load them once before forking and the workers reuse them.
+    """
+    if ml_models.loaded:
+        return ml_models
+
+    bundle = None
+    if settings.MODEL_BUNDLE_DIR:
+        load_bundle = verify_bundle if settings.MODEL_BUNDLE_VERIFY else load_manifest
+        bundle = _timed("bundle_manifest", lambda: load_bundle(settings.MODEL_BUNDLE_DIR))  # type: ignore[arg-type]
+        if (bundle.yolo_repo, bundle.clip_model_name) != (YOLO_MODEL_REPO, FASHION_MODEL_NAME):
+            logger.warning(
+                f"Bundle {bundle.version} holds {bundle.yolo_repo} and {bundle.clip_model_name}, "
+                f"the settings ask for {YOLO_MODEL_REPO} and {FASHION_MODEL_NAME}, serving the bundle"
+            )
+        # the served weights name the models, the label store, onnx graphs and caches follow the bundle
+        ml_models.yolo_model_repo = bundle.yolo_repo
+        ml_models.clip_model_name = ml_models.clip_model_id = bundle.clip_model_name
+        ml_models.weights_source = f"bundle {bundle.version}"
+
+    # downloads and deserialization release the GIL, the two models load side by side
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-loader") as pool:
+        yolo_future = pool.submit(_timed, "yolo", lambda: _load_yolo(bundle))
+        clip_future = pool.submit(_timed, "clip", lambda: _load_clip(bundle))
+        ml_models.yolo_model, local_yolo_path = yolo_future.result()
+        ml_models.clip_model, ml_models.clip_processor = clip_future.result()
+
+    # vectorized batch version of the processor image pipeline, used on the request path
+    ml_models.clip_preprocessor = ClipImagePreprocessor.from_processor(ml_models.clip_processor)
+
+    if settings.MODEL_BACKEND == "onnx":
+        _timed("onnx", lambda: _use_onnx_backend(local_yolo_path))
+
+    # text embeddings of the label sentences and product names, keyed by the model that produced them
+    ml_models.text_embedding_cache = TextEmbeddingCache(
+        model_id=ml_models.clip_model_id, maxsize=settings.TEXT_EMBEDDING_CACHE_SIZE
+    )
+    # label vocabulary embeddings, loaded from disk when the model and vocab.py did not change
+    ml_models.label_store = _timed(
+        "label_store",
+        lambda: load_or_build_label_store(
+            model=ml_models.clip_model,
+            processor=ml_models.clip_processor,
+            model_name=ml_models.clip_model_id,
+            cache_dir=settings.LABEL_EMBEDDINGS_CACHE_DIR,
+        ),
+    )
+
+    # identifies the models and the settings shaping their outputs, part of the result cache keys
+    ml_models.model_version = hashlib.sha256(
+        "|".join(
+            [
+                ml_models.yolo_model_repo,
+                ml_models.clip_model_id,
+                ml_models.weights_source,
+                vocab_hash(),
+                str(DETECTION_CONFIDENCE),
+                str(settings.YOLO_IMGSZ),
+                str(settings.CLIP_DECODE_SIZE),
+                str(settings.LABEL_TOP_K),
+            ]
+        ).encode()
+    ).hexdigest()[:16]
+    ml_models.loaded = True
+    logger.info(f"Models loaded from {ml_models.weights_source}, version {ml_models.model_version}")
+    return ml_models
+
+
+def warmup_models() -> None:
+    """
+    Runs every model on synthetic inputs at the configured batch sizes, so the lazy initialisations
+    (YOLO predictor setup, kernel selection, thread pools, onnx sessions) are paid before the
+    first real request. Must run in the process serving the requests.
+    """
+    start = time.perf_counter()
+    img = Image.new("RGB", (settings.YOLO_IMGSZ, settings.YOLO_IMGSZ), color=(128, 128, 128))
+    crop = Image.new("RGB", (256, 320), color=(128, 128, 128))
+
+    for _ in range(settings.WARMUP_ITERATIONS):
+        detect_clothes(img, ml_models.yolo_model)
+        detect_clothes_batch(
+            [img] * settings.YOLO_BATCH_SIZE,
+            ml_models.yolo_model,
+            batch_size=settings.YOLO_BATCH_SIZE,
+            imgsz=settings.YOLO_IMGSZ,
+        )
+        for batch_size in sorted({1, settings.CLIP_MAX_BATCH_SIZE}):
+            pixel_values = ml_models.clip_preprocessor([crop] * batch_size)
+            img_to_vector.embed_pixel_values(pixel_values, ml_models.clip_model)
+        text_to_vector.embed_text_list(
+            ["a black plain casual t-shirt"] * settings.CLIP_MAX_BATCH_SIZE,
+            ml_models.clip_model,
+            ml_models.clip_processor,
+        )
+
+    ml_models.warmup_s = round(time.perf_counter() - start, 3)
+    logger.info(f"Models warmed up in {ml_models.warmup_s}s")
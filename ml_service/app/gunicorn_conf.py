@@ -0,0 +1,73 @@
+"""
+Gunicorn config for the multi-process model server.
+
+    gunicorn -c gunicorn_conf.py main:app
+
+The app is imported once in the master with `preload_app` and YOLO, CLIP and the label embeddings
+are loaded there, then SERVER_WORKERS workers are forked and share the weights copy-on-write. The
+master owns the listening socket, so it is the router in front of the workers: every worker accepts
+from the same socket and the kernel spreads the connections between the idle ones.
+
+Each worker gets TORCH_THREADS_PER_WORKER intra-op threads and, with PIN_WORKER_CPUS, its own slice
+of the cpus, so N workers don't fight for the same cores.
+
+Only for cpu serving, CUDA can not be used in a process forked after it was initialised, on a GPU
+the models are loaded in each worker instead.
+"""
+
+import gc
+import os
+
+# must be set before torch is imported: the master never enters a parallel region with more than
+# one thread, otherwise the OpenMP pool inherited by the forked workers can deadlock
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+import torch  # noqa: E402
+
+from core.config import settings  # noqa: E402
+
+bind = os.environ.get("BIND", "0.0.0.0:8080")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = settings.SERVER_WORKERS
+preload_app = not torch.cuda.is_available()
+timeout = 120
+
+
+def _available_cpus() -> list[int]:
+    return sorted(os.sched_getaffinity(0))
+
+
+def _threads_per_worker(cpus: list[int]) -> int:
+    return settings.TORCH_THREADS_PER_WORKER or max(1, len(cpus) // settings.SERVER_WORKERS)
+
+
+def when_ready(server):
+    if preload_app:
+        # loaded here, before the fork, the lifespan of each worker only runs the warmup
+        from core.transformer_models import load_models
+
+        load_models()
+    # the objects loaded in the master are moved to a permanent generation, the gc of the workers
+    # never writes their headers, so their pages stay shared
+    gc.freeze()
+    server.log.info(f"Models loaded once, forking {settings.SERVER_WORKERS} workers (preload_app={preload_app})")
+
+
+def pre_fork(server, worker):
+    # a stable slot per worker, a restarted worker takes the slot (and the cpus) of the dead one
+    used_slots = {getattr(w, "cpu_slot", None) for w in server.WORKERS.values()}
+    worker.cpu_slot = next(slot for slot in range(len(used_slots) + 1) if slot not in used_slots)
+
+
+def post_fork(server, worker):
+    cpus = _available_cpus()
+    num_threads = _threads_per_worker(cpus)
+    torch.set_num_threads(num_threads)
+
+    if settings.PIN_WORKER_CPUS:
+        start = (worker.cpu_slot * num_threads) % len(cpus)
+        worker_cpus = {cpus[(start + i) % len(cpus)] for i in range(num_threads)}
+        os.sched_setaffinity(0, worker_cpus)
+        server.log.info(f"Worker {worker.pid} (slot {worker.cpu_slot}): {num_threads} torch threads, cpus {sorted(worker_cpus)}")
+    else:
+        server.log.info(f"Worker {worker.pid} (slot {worker.cpu_slot}): {num_threads} torch threads")
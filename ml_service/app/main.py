@@ -1,16 +1,47 @@
-from fastapi import FastAPI
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from fastapi.routing import APIRoute
 from api.main import api_router
 from core.config import settings
+from core.inference_executor import InferenceQueueFullError
+from core.transformer_models import load_models, ml_models, warmup_models
 from starlette.middleware.cors import CORSMiddleware
 
+logger = logging.getLogger(__name__)
+
 def custom_generate_unique_id(route: APIRoute) -> str:
     return f"{route.tags[0]}-{route.name}"
 
+async def load_and_warmup_models() -> None:
+    try:
+        # a no-op when the gunicorn master already loaded them, the warmup runs in every worker
+        await run_in_threadpool(load_models)
+        await run_in_threadpool(warmup_models)
+        ml_models.ready = True
+        logger.info("ML service ready")
+    except Exception as e:
+        ml_models.error = str(e)
+        logger.error(f"Could not load the models: {e}", exc_info=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the models load in the background, /health/live answers right away and /health/ready
+    # (and the inference endpoints) only once they are loaded and warmed up
+    loading = asyncio.create_task(load_and_warmup_models())
+    yield
+    loading.cancel()
+
+
 app = FastAPI(
     root_path="/api",              # Requests are prefixed with /api
     title=settings.PROJECT_NAME,
     generate_unique_id_function=custom_generate_unique_id,
+    lifespan=lifespan,
 )
 app.include_router(api_router)
 app.add_middleware(
@@ -20,3 +51,13 @@ app.add_middleware(
         allow_methods=["*"],
         allow_headers=["*"],
     )
+
+
+@app.exception_handler(InferenceQueueFullError)
+async def inference_queue_full_handler(request: Request, exc: InferenceQueueFullError):
+    # fast rejection, the backend backs off instead of waiting for a timeout
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after_s)},
+    )
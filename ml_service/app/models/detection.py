@@ -0,0 +1,28 @@
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from models.label import LabelScore, StructuredLabel
+
+
+class DetectedCloth(BaseModel):
+    # base64 encoded PNG of the crop
+    crop: str
+    # [x1, y1, x2, y2] in pixels of the original image
+    box: List[int]
+    label_data: StructuredLabel
+    storage_vector: List[float]
+    # attribute -> top-k labels with their scores, best first
+    label_scores: Optional[Dict[str, List[LabelScore]]] = None
+
+
+class Detection(BaseModel):
+    # [x1, y1, x2, y2] in pixels of the original image
+    box: List[int]
+    class_id: int
+    confidence: float
+
+
+class DetectionsResponse(BaseModel):
+    # size of the image the boxes refer to
+    width: int
+    height: int
+    detections: List[Detection]
@@ -1,17 +1,25 @@
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 class StructuredLabel(BaseModel):
     category: str
     color: str
     style: str
     pattern: str
-    
+
+
+class LabelScore(BaseModel):
+    label: str
+    # cosine similarity between the image and the label embeddings
+    score: float
+
 class LabelingResponse(BaseModel):
     label_data: StructuredLabel
     # The final vector to be stored in ChromaDB.
     # The ml_service is responsible for merging the image and text vectors.
     storage_vector: List[float]  
+    # attribute -> top-k labels with their scores, best first, for confidence filtering
+    label_scores: Optional[Dict[str, List[LabelScore]]] = None
     
 class  BestMatching(BaseModel):
     index: int
@@ -21,3 +29,6 @@ class  BestMatching(BaseModel):
 class MatchingRequestBody(BaseModel):
     candidates: List[str]
     target: str
+
+class MatchingBatchRequestBody(BaseModel):
+    problems: List[MatchingRequestBody]
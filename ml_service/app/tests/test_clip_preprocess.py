@@ -0,0 +1,66 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+from transformers import CLIPImageProcessor
+
+from core.embedding.clip_preprocess import ClipImagePreprocessor
+
+# same tolerance as benchmarks/clip_preprocess.py, float32 rounding of the fused rescale + normalize
+ATOL = 1e-4
+
+SIZES = [
+    (224, 224),  # no resize
+    (640, 480),  # landscape photo
+    (300, 1000),  # tall crop
+    (1000, 90),  # very wide crop
+    (7, 5),  # tiny crops, upscaled
+    (2, 30),
+]
+
+
+@pytest.fixture(scope="module")
+def image_processor() -> CLIPImageProcessor:
+    # the openai CLIP defaults (shortest edge 224, center crop 224, bicubic, CLIP mean/std), no download
+    return CLIPImageProcessor()
+
+
+@pytest.fixture(scope="module")
+def preprocessor(image_processor) -> ClipImagePreprocessor:
+    return ClipImagePreprocessor.from_processor(SimpleNamespace(image_processor=image_processor))  # type: ignore[arg-type]
+
+
+def random_image(width: int, height: int, mode: str = "RGB", seed: int = 0) -> Image.Image:
+    rng = np.random.default_rng(seed)
+    img = Image.fromarray(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    return img if mode == "RGB" else img.convert(mode)
+
+
+def reference(image_processor: CLIPImageProcessor, imgs: list) -> np.ndarray:
+    return image_processor(images=imgs, return_tensors="pt")["pixel_values"].numpy()
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_matches_clip_processor(image_processor, preprocessor, size):
+    img = random_image(*size)
+    pixel_values = preprocessor(img)
+
+    assert pixel_values.shape == (1, 3, 224, 224)
+    np.testing.assert_allclose(pixel_values.numpy(), reference(image_processor, [img]), atol=ATOL, rtol=0)
+
+
+@pytest.mark.parametrize("mode", ["L", "RGBA", "P", "CMYK"])
+def test_matches_clip_processor_on_non_rgb_images(image_processor, preprocessor, mode):
+    img = random_image(320, 240, mode=mode)
+    np.testing.assert_allclose(preprocessor(img).numpy(), reference(image_processor, [img]), atol=ATOL, rtol=0)
+
+
+def test_batch_of_mixed_sizes_and_arrays(image_processor, preprocessor):
+    imgs = [random_image(*size, seed=seed) for seed, size in enumerate(SIZES)]
+    expected = reference(image_processor, imgs)
+
+    np.testing.assert_allclose(preprocessor(imgs).numpy(), expected, atol=ATOL, rtol=0)
+    # uint8 HxWx3 arrays, as decoded by the service, give the same pixel values
+    arrays = [np.asarray(img) for img in imgs]
+    np.testing.assert_allclose(preprocessor(arrays).numpy(), expected, atol=ATOL, rtol=0)  # type: ignore[arg-type]
@@ -0,0 +1,105 @@
+import itertools
+import sqlite3
+
+import pytest
+
+from core import result_cache as result_cache_module
+from core.result_cache import ResultCache
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    # strictly increasing used_at, the disk eviction order does not depend on the timer resolution
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(result_cache_module.time, "time", lambda: float(next(ticks)))
+
+
+def disk_rows(cache_dir) -> dict[str, int]:
+    with sqlite3.connect(cache_dir / "results.sqlite3") as conn:
+        return dict(conn.execute("SELECT key, size FROM results").fetchall())
+
+
+def disk_size(cache_dir) -> int:
+    with sqlite3.connect(cache_dir / "results.sqlite3") as conn:
+        return conn.execute("SELECT size FROM stats WHERE id = 0").fetchone()[0]
+
+
+def test_memory_tier_evicts_least_recently_used_by_bytes():
+    cache = ResultCache(max_bytes=100, cache_dir=None, disk_max_bytes=0)
+    cache.put("a", b"a" * 60)
+    cache.put("b", b"b" * 30)
+    assert cache.get("a") is not None  # b is now the least recently used
+    cache.put("c", b"c" * 30)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a" * 60
+    assert cache.get("c") == b"c" * 30
+
+    cache.put("huge", b"x" * 101)
+    assert cache.get("huge") is None
+    assert cache.get("a") is not None  # not flushed by the oversized value
+
+
+def test_disk_tier_tracks_its_size(tmp_path):
+    cache = ResultCache(max_bytes=1, cache_dir=str(tmp_path), disk_max_bytes=10_000)
+    for i in range(5):
+        cache.put(f"k{i}", bytes(500))
+    assert disk_size(tmp_path) == 2500
+
+    cache.put("k0", bytes(100))  # overwrite
+    assert disk_size(tmp_path) == 2100
+    assert disk_size(tmp_path) == sum(disk_rows(tmp_path).values())
+
+    # reopened by another worker, the size is read back, not recounted
+    ResultCache(max_bytes=1, cache_dir=str(tmp_path), disk_max_bytes=10_000)
+    assert disk_size(tmp_path) == 2100
+
+
+def test_disk_tier_evicts_least_recently_used_down_to_evict_to(tmp_path):
+    cache = ResultCache(max_bytes=1, cache_dir=str(tmp_path), disk_max_bytes=10_000)
+    for i in range(20):
+        cache.put(f"k{i}", bytes(500))
+    assert disk_size(tmp_path) == 10_000
+
+    assert cache.get("k0") is not None  # most recently used now
+    cache.put("k20", bytes(500))  # 10_500, over the limit
+
+    rows = disk_rows(tmp_path)
+    assert disk_size(tmp_path) == sum(rows.values()) == 9000
+    assert "k0" in rows
+    assert not {"k1", "k2", "k3"} & set(rows)
+    assert "k4" in rows and "k20" in rows
+
+
+def test_disk_tier_skips_results_bigger_than_the_eviction_headroom(tmp_path):
+    cache = ResultCache(max_bytes=1, cache_dir=str(tmp_path), disk_max_bytes=10_000)
+    cache.put("small", bytes(500))
+    cache.put("big", bytes(1001))
+
+    assert cache.get("big") is None
+    assert set(disk_rows(tmp_path)) == {"small"}
+
+
+def test_disk_hit_is_promoted_to_memory(tmp_path):
+    ResultCache(max_bytes=1000, cache_dir=str(tmp_path), disk_max_bytes=10_000).put("k", b"result")
+
+    cache = ResultCache(max_bytes=1000, cache_dir=str(tmp_path), disk_max_bytes=10_000)
+    assert "k" not in cache._memory
+    assert cache.get("k") == b"result"
+    assert cache._memory["k"] == b"result"
+
+
+def test_lookup_counts_hits_misses_and_bytes_saved():
+    cache = ResultCache(max_bytes=1000, cache_dir=None, disk_max_bytes=0)
+    img = b"image bytes"
+    hits, misses, saved = cache._hits.value, cache._misses.value, cache._bytes_saved.value
+
+    key, data = cache.lookup(img, "v1", "label")
+    assert data is None
+    cache.put(key, b"result")
+    assert cache.lookup(img, "v1", "label") == (key, b"result")
+    assert cache.lookup(img, "v2", "label")[1] is None  # another model version, another key
+
+    assert cache._hits.value - hits == 1
+    assert cache._misses.value - misses == 2
+    assert cache._bytes_saved.value - saved == len(img)
@@ -1,8 +1,19 @@
 
 import base64
+import time
+import uuid
+from dataclasses import dataclass
 from io import BytesIO
 from PIL import Image
 
+from utils.metrics import metrics
+
+DECODE_MS_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 250, 500, 1000]
+DECODED_MB_BUCKETS = [0.25, 0.5, 1, 2, 4, 8, 16, 32, 64]
+
+_decode_ms_hist = metrics.histogram("image_decode_ms", DECODE_MS_BUCKETS)
+_decoded_mb_hist = metrics.histogram("image_decoded_mb", DECODED_MB_BUCKETS)
+
 def pil_img_to_bytes(img: Image.Image, format: str = "PNG") -> bytes:
     """
     Convert a PIL Image to bytes.
@@ -29,4 +40,145 @@ def encode_image_base64(img_bytes:bytes):
     Returns:
         str: Base64-encoded string representation of the image bytes, decoded as UTF-8.
     """
-    return base64.b64encode(img_bytes).decode("utf-8")
\ No newline at end of file
+    return base64.b64encode(img_bytes).decode("utf-8")
+
+@dataclass
+class DecodedImage:
+    """
+    An uploaded image decoded close to the size the model needs.
+
+    Attributes:
+        img (Image.Image): The decoded image, smaller than the original for reduced JPEG decodes.
+        full_size (tuple[int, int]): Width and height of the original image.
+        data (bytes): The encoded image, decoded again only when full resolution crops are needed.
+    """
+
+    img: Image.Image
+    full_size: tuple[int, int]
+    data: bytes
+
+    @property
+    def is_reduced(self) -> bool:
+        return self.img.size != self.full_size
+
+    def to_full_box(self, box: tuple[int, int, int, int]) -> tuple[int, int, int, int]:
+        """Maps a [x1, y1, x2, y2] box of `img` to pixels of the original image."""
+        if not self.is_reduced:
+            return box
+        full_width, full_height = self.full_size
+        sx, sy = full_width / self.img.width, full_height / self.img.height
+        x1, y1, x2, y2 = box
+        return (
+            max(0, round(x1 * sx)),
+            max(0, round(y1 * sy)),
+            min(full_width, round(x2 * sx)),
+            min(full_height, round(y2 * sy)),
+        )
+
+    def full_resolution(self) -> Image.Image:
+        if not self.is_reduced:
+            return self.img
+        return decode_image(self.data).img
+
+
+def decode_image(data: bytes, target_size: int | None = None) -> DecodedImage:
+    """
+    Decodes an image, JPEGs are decoded straight to the smallest DCT scale (1/2, 1/4, 1/8) that
+    keeps both sides >= target_size, so a 4096px upload never exists in memory at full resolution
+    when the model only needs 224px or 640px. Other formats are decoded at full resolution.
+
+    Args:
+        data (bytes): The encoded image.
+        target_size (int | None): Min size of the decoded sides, None decodes at full resolution.
+
+    Returns:
+        DecodedImage: The decoded image and the size of the original.
+    """
+    start = time.perf_counter()
+    img = Image.open(BytesIO(data))
+    full_size = img.size
+    if target_size and img.format == "JPEG":
+        img.draft("RGB", (target_size, target_size))
+    img.load()
+
+    _decode_ms_hist.observe((time.perf_counter() - start) * 1000)
+    _decoded_mb_hist.observe(img.width * img.height * len(img.getbands()) / 1024 / 1024)
+    return DecodedImage(img=img, full_size=full_size, data=data)
+
+
+CROP_MEDIA_TYPES = {"png": "image/png", "webp": "image/webp", "jpeg": "image/jpeg"}
+# binary crop responses, each crop is sent as a 4 bytes big-endian length followed by the crop bytes
+LENGTH_PREFIXED_MEDIA_TYPE = "application/x-length-prefixed"
+MULTIPART_MIXED_MEDIA_TYPE = "multipart/mixed"
+
+
+def encode_crop(
+    img: Image.Image,
+    encoding: str = "png",
+    png_compress_level: int = 6,
+    jpeg_quality: int = 95,
+) -> bytes:
+    """
+    Encode a crop with the configured format.
+
+    Args:
+        img (Image.Image): The crop to encode.
+        encoding (str): 'png', 'webp' (lossless) or 'jpeg' (high quality, no chroma subsampling).
+        png_compress_level (int): zlib level for png, 0 (fastest) to 9 (smallest).
+        jpeg_quality (int): Quality used for jpeg.
+
+    Returns:
+        bytes: The encoded crop.
+    """
+    buf = BytesIO()
+    if encoding == "png":
+        img.save(buf, format="PNG", compress_level=png_compress_level)
+    elif encoding == "webp":
+        img.save(buf, format="WEBP", lossless=True, method=0)  # method 0 is the fastest lossless mode
+    elif encoding == "jpeg":
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buf, format="JPEG", quality=jpeg_quality, subsampling=0)
+    else:
+        raise ValueError(f"Unsupported crop encoding: {encoding}")
+    return buf.getvalue()
+
+
+def build_length_prefixed_body(parts: list[bytes]) -> bytes:
+    buf = BytesIO()
+    for part in parts:
+        buf.write(len(part).to_bytes(4, "big"))
+        buf.write(part)
+    return buf.getvalue()
+
+
+def parse_length_prefixed_body(body: bytes) -> list[bytes]:
+    """Inverse of `build_length_prefixed_body`."""
+    parts = []
+    offset = 0
+    while offset < len(body):
+        size = int.from_bytes(body[offset : offset + 4], "big")
+        offset += 4
+        parts.append(body[offset : offset + size])
+        offset += size
+    return parts
+
+
+def build_multipart_mixed_body(parts: list[bytes], media_type: str) -> tuple[bytes, str]:
+    """
+    Build a multipart/mixed body with one part per crop.
+
+    Returns:
+        tuple[bytes, str]: The body and the boundary to put in the Content-Type header.
+    """
+    boundary = uuid.uuid4().hex
+    buf = BytesIO()
+    for idx, part in enumerate(parts):
+        buf.write(f"--{boundary}\r\n".encode())
+        buf.write(f"Content-Type: {media_type}\r\n".encode())
+        buf.write(f"Content-Length: {len(part)}\r\n".encode())
+        buf.write(f'Content-Disposition: attachment; name="crop_{idx}"\r\n\r\n'.encode())
+        buf.write(part)
+        buf.write(b"\r\n")
+    buf.write(f"--{boundary}--\r\n".encode())
+    return buf.getvalue(), boundary